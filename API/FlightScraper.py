@@ -1,18 +1,43 @@
+import numpy as np
 import pandas as pd
 import networkx as nx
 import pickle
 import os
 import requests
-from constants import FlightScraper as FS
+import difflib
+import unicodedata
+from constants import FlightScraper as FS, Geo
+from GeoIndex import GeoIndex
 import Pickler
 from functools import lru_cache
 import logging
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.tracing import span
 
 logger = logging.getLogger(__name__)
 
+def fold(text):
+    """ Casefolded ASCII with single spaces, so "São  Paulo" and "sao paulo" compare equal """
+    ascii_text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return " ".join(ascii_text.casefold().split())
+
+def place_key(name):
+    """ (city, country) keys of a place name such as "Toronto, Canada"; the country is "" when not given """
+    city, _, country = str(name).partition(",")
+    country = fold(country)
+    return fold(city), FS.COUNTRY_ALIASES.get(country, country)
+
 class SearchFlights:
-    def __init__(self, fetch_from_web=True, airports_url=FS.URL_AIRPORTS, routes_url=FS.URL_ROUTES, graph_pkl_file='Pickles/airport_flight_graph.pkl', airports_pkl_file='Pickles/airports_data.pkl', routes_pkl_file = 'Pickles/routes_data.pkl'):
-        """ Tool to search for optimal paths between cities """
+    def __init__(self, fetch_from_web=True, airports_url=FS.URL_AIRPORTS, routes_url=FS.URL_ROUTES, graph_pkl_file='Pickles/airport_flight_graph.pkl', airports_pkl_file='Pickles/airports_data.pkl', routes_pkl_file = 'Pickles/routes_data.pkl', cities=None):
+        """
+        Tool to search for optimal paths between cities
+
+        `cities` are catalog city records with `name`, `lat` and `lng`; their nearest airports
+        are resolved once here, so routing does not depend on the airport's city spelling.
+        Other places (e.g. the departure location "Toronto, Canada") are matched against the
+        airport cities by folded name and country, with a fuzzy fallback for misspellings.
+        """
         self.airports_url = airports_url
         self.routes_url = routes_url
         
@@ -20,7 +45,13 @@ class SearchFlights:
         self.airports_pkl_file = airports_pkl_file
         self.routes_pkl_file = routes_pkl_file
         
-        self.graph, self.city_translator = self._load_or_build_graph(fetch_from_web)
+        with span("graph_load"):
+            self.graph, self.city_translator = self._load_or_build_graph(fetch_from_web)
+        self.airport_index = self._build_airport_index()
+        self.places = self._index_airport_cities()
+        self.spellings = {}  # folded name -> closest known city key, or None
+        if cities:
+            self.add_cities(cities)
 
     def _load_or_build_graph(self, fetch_from_web):
         """Loads the graph from pickle if available; otherwise, fetches or builds it."""
@@ -58,11 +89,114 @@ class SearchFlights:
                 graph.add_edge(source, destination)
         return graph
 
+    def _build_airport_index(self):
+        """ Spatial index over the airports that have routes, None if the airport data has no coordinates. """
+        if self.airports_df is None or not {"lat", "lon"}.issubset(self.airports_df.columns):
+            logger.warning("Airport data has no coordinates, falling back to city name matching")
+            return None
+        return GeoIndex.from_airports(self.airports_df, airports=set(self.graph.nodes))
+
+    def _index_airport_cities(self):
+        """
+        Airport cities by folded name, for resolving place names.
+
+        Returns:
+            dict: {city key: [place]}, cities with more airports first; a place is a dict with
+                `country`, `location` ((lat, lon) or None), `airports` (nearest airports, for
+                catalog cities) and `named` (IATA codes of the airports named after the city,
+                those with routes first). The location averages the airports with routes when
+                there are any, so a small airfield of the same name does not pull it away.
+        """
+        if self.airports_df is None:
+            return {}
+        df = self.airports_df[self.airports_df["iata"].notna() & (self.airports_df["iata"] != "\\N")]
+        has_coordinates = {"lat", "lon"}.issubset(df.columns)
+        grouped = {}
+        for row in df.itertuples(index=False):
+            routed = row.iata in self.graph
+            located = has_coordinates and pd.notna(row.lat) and pd.notna(row.lon)
+            grouped.setdefault((place_key(row.city)[0], fold(row.country)), []).append(
+                (not routed, row.iata, (row.lat, row.lon) if located else None)
+            )
+        places = {}
+        for (city, country), airports in sorted(grouped.items(), key=lambda item: -len(item[1])):
+            airports.sort(key=lambda airport: airport[0])
+            coordinates = [location for unrouted, _, location in airports if location and not unrouted] or \
+                [location for _, _, location in airports if location]
+            places.setdefault(city, []).append({
+                "country": country, "airports": None, "named": [iata for _, iata, _ in airports],
+                "location": tuple(float(value) for value in np.mean(coordinates, axis=0)) if coordinates else None,
+            })
+        return places
+
+    def add_cities(self, cities, k=Geo.AIRPORTS_PER_CITY, radius_km=Geo.AIRPORT_RADIUS_KM):
+        """ Resolves and stores the nearest airports of catalog cities (records with `name`, `lat`, `lng`). """
+        located = [city for city in cities if city.get("lat") is not None and city.get("lng") is not None]
+        if self.airport_index is not None and located:
+            nearest = self.airport_index.nearest_many(
+                [city["lat"] for city in located], [city["lng"] for city in located], k=k, radius_km=radius_km
+            )
+        else:
+            nearest = [[] for _ in located]
+        for city, airports in zip(located, nearest):
+            # catalog cities have exact coordinates, so they go before airport cities of the same name
+            self.places.setdefault(place_key(city["name"])[0], []).insert(0, {
+                "country": fold(city.get("country", "")), "location": (city["lat"], city["lng"]),
+                "airports": [iata for iata, _ in airports], "named": [],
+            })
+        self.spellings.clear()
+
+    def nearest_airports(self, lat, lon, k=Geo.AIRPORTS_PER_CITY, radius_km=Geo.AIRPORT_RADIUS_KM):
+        """ Nearest `k` airports with routes within `radius_km` of a location, as [(iata, km)]. """
+        if self.airport_index is None:
+            return []
+        return self.airport_index.nearest(lat, lon, k=k, radius_km=radius_km)
+
+    def resolve_place(self, city):
+        """ Known places a name like "Toronto, Canada" may refer to, those in the named country first. """
+        name, country = place_key(city)
+        if name not in self.places:
+            if name not in self.spellings:
+                close = difflib.get_close_matches(name, self.places.keys(), n=1, cutoff=FS.FUZZY_CITY_CUTOFF)
+                self.spellings[name] = close[0] if close else None
+            name = self.spellings[name]
+            if name is None:
+                return []
+        places = self.places[name]
+        return [place for place in places if place["country"] == country] + \
+            [place for place in places if place["country"] != country]
+
+    def locate_city(self, city):
+        """ (lat, lon) of a place: a catalog city, else the mean position of the airports named after it. """
+        return next((place["location"] for place in self.resolve_place(city) if place["location"] is not None), None)
+
+    def airports_for_city(self, city):
+        """
+        IATA codes serving a place: a catalog city's nearest airports, else the airports named after
+        it that have routes, else the airports nearest to its location, else any named after it.
+        """
+        places = self.resolve_place(city)
+        for place in places:
+            if place["airports"]:
+                return place["airports"]
+            routed = [iata for iata in place["named"] if iata in self.graph]
+            if routed:
+                return routed
+            if place["location"] is not None:
+                nearest = [iata for iata, _ in self.nearest_airports(*place["location"])]
+                if nearest:
+                    return nearest
+        return next((place["named"] for place in places if place["named"]), [])
+
     def find_path_between_cities(self, src_city, dst_city):
         """ optimal flight path finder between two cities """
-        # Translate cities to IATA codes using the loaded airports_df
-        src_airports = self.airports_df[self.airports_df["city"].str.lower() == src_city.lower()]["iata"].tolist()
-        dst_airports = self.airports_df[self.airports_df["city"].str.lower() == dst_city.lower()]["iata"].tolist()
+        with span("path_search"):
+            return self._find_path_between_cities(src_city, dst_city)
+
+    def _find_path_between_cities(self, src_city, dst_city):
+        # Translate cities to IATA codes, by location where known
+        src_airports = self.airports_for_city(src_city)
+        dst_airports = self.airports_for_city(dst_city)
 
         # Check if we found any airports for the given cities
         if not src_airports:
@@ -90,14 +224,15 @@ class SearchFlights:
 
     def find_path_between_multiple_cities(self, cities):
         """ Finds an optimal flight path through multiple cities using airport connections. """
+        with span("path_search"):
+            return self._find_path_between_multiple_cities(cities)
+
+    def _find_path_between_multiple_cities(self, cities):
         if len(cities) < 2:
             return "At least two cities are required to find a path."
 
         # Convert city names to airport IATA codes
-        city_airports = {
-            city: self.airports_df[self.airports_df["city"].str.lower() == city.lower()]["iata"].tolist()
-            for city in cities
-        }
+        city_airports = {city: self.airports_for_city(city) for city in cities}
 
         # Check for missing airports
         for city, airports in city_airports.items():
@@ -131,10 +266,10 @@ class SearchFlights:
 
         # now format it as [... { city : [ airports to reach this city ] } ...]
         path_dict = {}
-        airport_cities = []
+        airport_cities = {iata: city for city, airports in city_airports.items() for iata in airports}
         last_idx = 0
         for idx, path in enumerate(total_path):
-            found_city = self.city_translator[path]
+            found_city = airport_cities.get(path, self.city_translator[path])
             if found_city in cities:
                 path_dict.update({ found_city : total_path[last_idx:idx] })
                 last_idx = idx
@@ -0,0 +1,72 @@
+import numpy as np
+from constants import Geo
+
+
+class GeoIndex:
+    def __init__(self, labels, lats, lons):
+        """
+        Haversine BallTree over labelled (lat, lon) points, queried in kilometres.
+
+        Args:
+            labels (list): One label per point (airport IATA code, city id, ...).
+            lats (array-like): Latitudes in degrees.
+            lons (array-like): Longitudes in degrees.
+        """
+        from sklearn.neighbors import BallTree  # slow import, only paid once an index is built
+
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        valid = np.isfinite(lats) & np.isfinite(lons)
+        self.labels = np.asarray(labels, dtype=object)[valid]
+        self.tree = BallTree(np.radians(np.column_stack([lats[valid], lons[valid]])), metric="haversine")
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_airports(cls, airports_df, airports=None):
+        """ Index over airports with an IATA code, optionally only those in `airports` (e.g. the route graph). """
+        df = airports_df[airports_df["iata"].notna() & (airports_df["iata"] != "\\N")]
+        if airports is not None:
+            df = df[df["iata"].isin(airports)]
+        return cls(df["iata"].tolist(), df["lat"], df["lon"])
+
+    @classmethod
+    def from_cities(cls, cities):
+        """ Index over city records with `lat` / `lng`, labelled by the `id` key if present, else by name. """
+        cities = [city for city in cities if city.get("lat") is not None and city.get("lng") is not None]
+        labels = [city.get("id", city.get("name")) for city in cities]
+        return cls(labels, [city["lat"] for city in cities], [city["lng"] for city in cities])
+
+    @staticmethod
+    def _to_radians(lats, lons):
+        return np.radians(np.column_stack([np.atleast_1d(lats), np.atleast_1d(lons)]).astype(float))
+
+    def nearest_many(self, lats, lons, k=Geo.AIRPORTS_PER_CITY, radius_km=Geo.AIRPORT_RADIUS_KM):
+        """
+        Nearest `k` points within `radius_km` of many locations in one vectorized query.
+
+        Returns:
+            list: For each location, a list of (label, distance in km), nearest first.
+        """
+        if len(self) == 0:
+            return [[] for _ in np.atleast_1d(lats)]
+        distances, indices = self.tree.query(self._to_radians(lats, lons), k=min(k, len(self)))
+        distances = distances * Geo.EARTH_RADIUS_KM
+        return [
+            [(self.labels[i], float(d)) for i, d in zip(row_indices, row_distances)
+             if radius_km is None or d <= radius_km]
+            for row_indices, row_distances in zip(indices, distances)
+        ]
+
+    def nearest(self, lat, lon, k=Geo.AIRPORTS_PER_CITY, radius_km=Geo.AIRPORT_RADIUS_KM):
+        """ Nearest `k` points within `radius_km` of one location, as [(label, km)], nearest first. """
+        return self.nearest_many([lat], [lon], k=k, radius_km=radius_km)[0]
+
+    def within(self, lat, lon, radius_km):
+        """ All points within `radius_km` of one location, as [(label, km)], nearest first. """
+        if len(self) == 0:
+            return []
+        indices, distances = self.tree.query_radius(
+            self._to_radians(lat, lon), r=radius_km / Geo.EARTH_RADIUS_KM, return_distance=True, sort_results=True
+        )
+        return [(self.labels[i], float(d * Geo.EARTH_RADIUS_KM)) for i, d in zip(indices[0], distances[0])]
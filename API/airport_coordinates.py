@@ -0,0 +1,49 @@
+"""
+Adds lat/lon columns to the pickled OpenFlights airports, joined by IATA code from the
+airportsdata package (fetched from PyPI into a temporary directory when not installed).
+
+    cd API && python airport_coordinates.py
+"""
+import importlib
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+AIRPORTS_PKL_FILE = 'Pickles/airports_data.pkl'
+AIRPORTSDATA_PACKAGE = 'airportsdata'
+
+
+def import_airportsdata(target_dir):
+    """ Imports airportsdata, installing it into `target_dir` first if it is missing. """
+    try:
+        return importlib.import_module(AIRPORTSDATA_PACKAGE)
+    except ImportError:
+        subprocess.run([sys.executable, '-m', 'pip', 'install', '--quiet', '--target', target_dir,
+                        AIRPORTSDATA_PACKAGE], check=True)
+        sys.path.insert(0, target_dir)
+        return importlib.import_module(AIRPORTSDATA_PACKAGE)
+
+
+def add_coordinates(airports_df, known_airports):
+    """
+    Sets lat/lon of every airport with a known IATA code. The others take the mean position of
+    the airports of their city, or stay NaN.
+    """
+    airports_df = airports_df.copy()
+    for column in ('lat', 'lon'):
+        airports_df[column] = airports_df['iata'].map(
+            lambda code: known_airports[code][column] if code in known_airports else np.nan
+        ).astype(float)
+    city_mean = airports_df.groupby(['city', 'country'])[['lat', 'lon']].transform('mean')
+    airports_df[['lat', 'lon']] = airports_df[['lat', 'lon']].fillna(city_mean)
+    return airports_df
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as target_dir:
+        airportsdata = import_airportsdata(target_dir)
+        airports_df = add_coordinates(pd.read_pickle(AIRPORTS_PKL_FILE), airportsdata.load('IATA'))
+    airports_df.to_pickle(AIRPORTS_PKL_FILE)
+    print(f"✅ {airports_df['lat'].notna().sum()} of {len(airports_df)} airports have coordinates")
@@ -1,3 +1,5 @@
 from django.contrib import admin
+from .models import EmbeddingConfig
 
-# Register your models here.
+# Global alpha/beta default for sessions that never set their own
+admin.site.register(EmbeddingConfig)
@@ -0,0 +1,69 @@
+"""
+Alpha/beta weights for blending a user's image and text embeddings.
+
+Each session keeps its own pair in the session itself, which the signed-cookie session engine
+stores client-side, so setting or reading it touches no database. Sessions that never set one
+use the global default from EmbeddingConfig, read through an in-process cache that is reloaded
+when the config version counter (in the Django cache, bumped by EmbeddingConfig.save) moves.
+With a per-process cache backend other processes only see a new default after
+DEFAULTS_MAX_AGE_S.
+"""
+import time
+from django.core.cache import cache
+from constants import Config
+from .models import EmbeddingConfig
+
+SESSION_KEY = "alpha_beta"
+VERSION_KEY = "embedding_config_version"
+DEFAULTS_MAX_AGE_S = 60
+
+# (config version, monotonic load time, (alpha, beta)), replaced as a whole
+_defaults = (None, 0.0, (Config.ALPHA_DEFAULT, Config.BETA_DEFAULT))
+
+
+def config_version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def bump_config_version():
+    """ Invalidates every process's cached defaults. """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:  # not set yet
+        cache.set(VERSION_KEY, 1, timeout=None)
+
+
+def cached_defaults(version):
+    """ The cached default (alpha, beta) if still valid for `version`, else None. """
+    cached_version, loaded_at, weights = _defaults
+    if cached_version == version and time.monotonic() - loaded_at < DEFAULTS_MAX_AGE_S:
+        return weights
+    return None
+
+
+def store_defaults(version, config):
+    global _defaults
+    weights = (config.alpha, config.beta) if config else (Config.ALPHA_DEFAULT, Config.BETA_DEFAULT)
+    _defaults = (version, time.monotonic(), weights)
+    return weights
+
+
+def default_weights():
+    """ Global (alpha, beta); the database is only read when the cache is stale. """
+    version = config_version()
+    return cached_defaults(version) or store_defaults(version, EmbeddingConfig.objects.first())
+
+
+async def adefault_weights():
+    version = config_version()
+    return cached_defaults(version) or store_defaults(version, await EmbeddingConfig.objects.afirst())
+
+
+def set_session_weights(session, alpha, beta):
+    session[SESSION_KEY] = [alpha, beta]
+
+
+async def asession_weights(session):
+    """ The session's (alpha, beta), or the global default if it never set one. """
+    weights = await session.aget(SESSION_KEY)
+    return tuple(weights) if weights else await adefault_weights()
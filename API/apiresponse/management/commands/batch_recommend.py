@@ -0,0 +1,19 @@
+import sys
+from django.core.management.base import BaseCommand
+
+sys.path.append('..')
+from src.faiss_indexing.batch_recommend import add_arguments, run
+
+
+class Command(BaseCommand):
+    help = "Recommend cities for many stored users (embedding matrix or criteria) and stream them to JSONL / Parquet."
+
+    def add_arguments(self, parser):
+        add_arguments(parser)
+
+    def handle(self, *args, **options):
+        run(
+            options["input"], options["output"], catalog_dir=options["catalog_dir"], top_k=options["top_k"],
+            chunk_size=options["chunk_size"], workers=options["workers"], filter=options["filter"],
+            fmt=options["format"], image_embeddings_path=options["image_embeddings"],
+        )
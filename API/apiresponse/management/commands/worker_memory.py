@@ -0,0 +1,43 @@
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+
+sys.path.append('..')
+from src.memory_usage import worker_memory_report
+
+DEFAULT_PIDFILE = os.environ.get("GUNICORN_PIDFILE", "/tmp/tripadvisory-gunicorn.pid")
+MB = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = "Shared vs. private memory of the gunicorn master and each worker (Linux smaps_rollup)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pid", type=int, default=None, help="Master pid (default: read from the gunicorn pidfile).")
+        parser.add_argument("--pidfile", default=DEFAULT_PIDFILE)
+
+    def handle(self, *args, **options):
+        master_pid = options["pid"]
+        if master_pid is None:
+            try:
+                with open(options["pidfile"], "r") as f:
+                    master_pid = int(f.read().strip())
+            except (OSError, ValueError):
+                raise CommandError(f"No master pid given and none readable from {options['pidfile']}")
+
+        rows = worker_memory_report(master_pid)
+        if not rows:
+            raise CommandError(f"Cannot read /proc/{master_pid}/smaps_rollup (not Linux, or no such process)")
+
+        self.stdout.write(f"{'pid':>8} {'role':8} {'rss MB':>10} {'pss MB':>10} {'shared MB':>10} {'private MB':>11}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['pid']:>8} {row['role']:8} {row['rss'] / MB:10.1f} {row['pss'] / MB:10.1f} "
+                f"{row['shared'] / MB:10.1f} {row['private'] / MB:11.1f}"
+            )
+        workers = [row for row in rows if row["role"] == "worker"]
+        total_pss = sum(row["pss"] for row in rows)
+        self.stdout.write(f"\nTotal PSS (what the server really uses): {total_pss / MB:.1f} MB")
+        if workers:
+            private = sum(row["private"] for row in workers) / len(workers)
+            self.stdout.write(f"Average private memory per worker (cost of one more worker): {private / MB:.1f} MB")
@@ -0,0 +1,109 @@
+import random
+import re
+import sys
+import time
+import uuid
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+sys.path.append('..')
+from src.profiling import capture, save_capture
+from src.tracing import TRACING_ENABLED, end_trace, record, server_timing_header, start_trace
+
+REQUEST_ID_PATTERN = re.compile(r"[\w-]{1,64}")
+
+
+class ServerTimingMiddleware:
+    """
+    Collects the stage spans of each request, records the request duration per view and, when
+    `SERVER_TIMING` is set or the request asks with ?server_timing=1, reports the stages in a
+    `Server-Timing` header. Works for both sync and async views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not TRACING_ENABLED:
+            return self.get_response(request)
+        token, start = start_trace(), time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            trace = end_trace(token)
+        return self.finish(request, response, trace, start)
+
+    async def __acall__(self, request):
+        if not TRACING_ENABLED:
+            return await self.get_response(request)
+        token, start = start_trace(), time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            trace = end_trace(token)
+        return self.finish(request, response, trace, start)
+
+    def finish(self, request, response, trace, start):
+        elapsed = time.perf_counter() - start
+        view_name = request.resolver_match.url_name if request.resolver_match else "unresolved"
+        record(f"request.{view_name}", elapsed)
+        if getattr(settings, "SERVER_TIMING", False) or request.GET.get("server_timing") == "1":
+            # streamed responses are timed up to their first byte
+            response["Server-Timing"] = ", ".join(filter(None, [server_timing_header(trace), f"total;dur={elapsed * 1000:.1f}"]))
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in (`PROFILE_REQUESTS`) sampling profiler: samples the stacks of every request and keeps
+    the capture of those slower than `PROFILE_SLOW_REQUEST_S`, plus a `PROFILE_SAMPLE_RATE`
+    fraction of the rest, as collapsed stacks in `PROFILE_DIR` keyed by request id plus a random
+    suffix. The id is returned in an `X-Profile-Id` header; staff can list the captures at
+    /api/profiles/.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "PROFILE_REQUESTS", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with capture(request.path) as profile:
+            response = self.get_response(request)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        # the event loop thread serves many requests at once, only executor work is attributable
+        with capture(request.path, bind_thread=False) as profile:
+            response = await self.get_response(request)
+        return await sync_to_async(self.finish, thread_sensitive=False)(request, response, profile)
+
+    def finish(self, request, response, profile):
+        elapsed = time.perf_counter() - profile.start
+        if elapsed < settings.PROFILE_SLOW_REQUEST_S and random.random() >= settings.PROFILE_SAMPLE_RATE:
+            return response
+        request_id = request.headers.get("X-Request-ID", "")
+        # the client's id only prefixes the capture id, so a client cannot overwrite another capture
+        suffix = uuid.uuid4().hex[:12]
+        capture_id = f"{request_id}-{suffix}" if REQUEST_ID_PATTERN.fullmatch(request_id) else uuid.uuid4().hex
+        save_capture(
+            profile, settings.PROFILE_DIR, capture_id, max_captures=settings.PROFILE_MAX_CAPTURES,
+            view=request.resolver_match.url_name if request.resolver_match else "unresolved",
+            method=request.method, path=request.path, status=response.status_code,
+            duration_ms=round(elapsed * 1000, 1), slow=elapsed >= settings.PROFILE_SLOW_REQUEST_S,
+        )
+        response["X-Profile-Id"] = capture_id
+        return response
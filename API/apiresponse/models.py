@@ -7,4 +7,6 @@ class EmbeddingConfig(models.Model):
     def save(self, *args, **kwargs):
         if self.alpha + self.beta != 1:
             raise ValueError("Alpha and Beta must sum to 1.")
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+        from .blend_weights import bump_config_version
+        bump_config_version()  # processes reload the global default on their next read
\ No newline at end of file
@@ -0,0 +1,52 @@
+import gc
+import logging
+import os
+import sys
+import time
+
+sys.path.append('..')
+from src.faiss_indexing.rerank import RERANK_FEATURES
+
+logger = logging.getLogger(__name__)
+
+# Torch threads per worker after the fork; the default (one per core in every worker) oversubscribes the box
+TORCH_THREADS_PER_WORKER = os.environ.get("TORCH_THREADS_PER_WORKER")
+
+
+def preload_artifacts(models=True):
+    """
+    Loads every read-only artifact in the gunicorn master before it forks: the catalog and its
+    geo index and re-ranking features, the flight graph and, with `models`, T5, MiniLM and CLIP.
+    The workers inherit them copy-on-write instead of each loading its own copy.
+
+    The heap is then frozen (`gc.freeze`) so the workers' garbage collector never writes to
+    these objects' headers, which would dirty and un-share their pages. Nothing here may start
+    threads (executors, OpenMP pools): they do not survive the fork.
+    """
+    from apiresponse.views import city_geo_index, get_catalog, get_flight_search
+
+    gc.disable()  # no collections while the preloaded objects are allocated, re-enabled in the workers
+    start = time.perf_counter()
+    catalog = get_catalog()
+    catalog.attributes.normalized(RERANK_FEATURES)
+    city_geo_index(catalog, catalog.version)
+    get_flight_search()
+    if models:
+        from src.embedding_extract.image_embeddings_extraction import load_clip_model
+        from src.model.evaluate import load_sentence_model, load_t5_model
+        load_t5_model()
+        load_sentence_model()
+        load_clip_model()
+
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Preloaded artifacts in {time.perf_counter() - start:.1f}s, {gc.get_freeze_count()} objects frozen")
+
+
+def after_fork(num_workers):
+    """ Per-worker setup once forked: collection back on, and a share of the cores for torch. """
+    gc.enable()
+    if "torch" in sys.modules:
+        import torch
+        threads = int(TORCH_THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // max(num_workers, 1)))
+        torch.set_num_threads(threads)
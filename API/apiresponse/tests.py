@@ -1,3 +1,508 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+import numpy as np
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase
 
-# Create your tests here.
+# Slowest acceptable cold import of the app (views and management commands) in seconds; set
+# IMPORT_TIME_BUDGET_S to adjust for slow CI machines. It is about 0.3s on a laptop.
+IMPORT_TIME_BUDGET_S = float(os.environ.get("IMPORT_TIME_BUDGET_S", 1.5))
+
+# Loaded on first use behind accessor functions (load_t5_model, get_flight_search, ...), never at import
+HEAVY_MODULES = ("torch", "transformers", "clip", "sentence_transformers", "datasets", "sklearn", "pandas", "networkx")
+
+APP_IMPORTS = (
+    "import django; django.setup(); import apiresponse.views, apiresponse.management.commands.batch_recommend, "
+    "apiresponse.management.commands.worker_memory"
+)
+
+
+def import_times(statement, cwd):
+    """
+    Runs `statement` in a fresh interpreter with `python -X importtime`.
+
+    Returns:
+        tuple: ({module: cumulative seconds}, total seconds of the top-level imports)
+    """
+    api_dir = str(settings.BASE_DIR)
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "config.settings",
+        "PYTHONPATH": os.pathsep.join([api_dir, os.path.dirname(api_dir)]),
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement], cwd=cwd, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise AssertionError(f"Import failed:\n{result.stderr[-2000:]}")
+
+    modules, total_us = {}, 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative) / 1e6
+        if not name.startswith("  "):  # one space after the bar, nested imports are indented further
+            total_us += int(cumulative)
+    return modules, total_us / 1e6
+
+
+class ColdStartTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.work_dir = tempfile.TemporaryDirectory()
+        cls.modules, cls.total_s = import_times(APP_IMPORTS, cls.work_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.work_dir.cleanup()
+        super().tearDownClass()
+
+    def test_import_time_within_budget(self):
+        slowest = sorted(self.modules.items(), key=lambda item: -item[1])[:10]
+        self.assertLess(
+            self.total_s, IMPORT_TIME_BUDGET_S,
+            f"Importing the app took {self.total_s:.2f}s; slowest modules: {slowest}",
+        )
+
+    def test_no_heavy_modules_at_import(self):
+        loaded = [name for name in HEAVY_MODULES if name in self.modules]
+        self.assertEqual(loaded, [], f"Imported at module load: {loaded}")
+
+    def test_no_files_created_at_import(self):
+        self.assertEqual(os.listdir(self.work_dir.name), [])
+
+
+class DepartureLocationTests(SimpleTestCase):
+    """ Departure locations as T5 / the rule-based parse extract them ("Toronto, Canada") resolve to airports. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import random
+        from FlightScraper import SearchFlights
+        from src.model.evaluate import rule_based_criteria
+        from src.synthetic_data.synthetic_prompt_generator import departure_locations, generate_sample
+
+        pickles = os.path.join(settings.BASE_DIR, "Pickles")
+        cls.flights = SearchFlights(
+            fetch_from_web=False, graph_pkl_file=os.path.join(pickles, "airport_flight_graph.pkl"),
+            airports_pkl_file=os.path.join(pickles, "airports_data.pkl"),
+            routes_pkl_file=os.path.join(pickles, "routes_data.pkl"),
+            cities=[{"name": "Detroit", "country": "United States", "lat": 42.3834, "lng": -83.1024}],
+        )
+        # one prompt per departure location in the generator vocabulary
+        rng, samples = random.Random(0), {}
+        while len(samples) < len(departure_locations):
+            sample = generate_sample(rng)
+            samples.setdefault(sample["output"]["departure_location"], sample["prompt"])
+        cls.criteria = [rule_based_criteria(prompt) for prompt in samples.values()]
+
+    def test_departure_location_is_located(self):
+        for criteria in self.criteria:
+            with self.subTest(departure_location=criteria["departure_location"]):
+                self.assertIsNotNone(self.flights.locate_city(criteria["departure_location"]))
+
+    def test_departure_location_has_route(self):
+        for criteria in self.criteria:
+            with self.subTest(departure_location=criteria["departure_location"]):
+                path = self.flights.find_path_between_cities(criteria["departure_location"], "Detroit")
+                self.assertIsInstance(path, list, path)
+
+    def test_country_and_spelling(self):
+        self.assertEqual(self.flights.airports_for_city("Toronto, Canada"), self.flights.airports_for_city("torono"))
+        self.assertIn("LHR", self.flights.airports_for_city("London, UK"))
+        self.assertNotIn("YXU", self.flights.airports_for_city("London, UK"))  # London, Ontario
+        self.assertIsNone(self.flights.locate_city("Nowhereville"))
+
+
+def run_with_deadline(budget_s, step):
+    """ Runs `step(deadline)` (a coroutine function) under a fresh request deadline; returns (result, paths). """
+    from src.deadline import current_deadline, end_deadline, start_deadline
+
+    async def main():
+        token = start_deadline(budget_s)
+        try:
+            deadline = current_deadline()
+            return await step(deadline), deadline.report()
+        finally:
+            end_deadline(token)
+    return asyncio.run(main())
+
+
+class PipelineDegradationTests(SimpleTestCase):
+    """ The paths a request takes when T5 or CLIP are late or fail, without loading any model. """
+
+    PROMPT = "I am departing from Toronto, Canada in July. I prefer a mountainous destination."
+
+    def setUp(self):
+        from src.embedding_extract import implicit_user_embedding
+        from src.model.evaluate import rule_based_criteria
+
+        self.module = implicit_user_embedding
+        self.criteria = rule_based_criteria(self.PROMPT)
+        self.image = np.ones(512, dtype="float32")
+        self.text = np.full(384, 0.5, dtype="float32")
+        self.module._criteria_cache.clear()
+        self.addCleanup(self.module._criteria_cache.clear)
+        # the rule-based path embeds its criteria with MiniLM
+        patcher = mock.patch.object(self.module, "user_preferences_to_embedding", return_value=self.text)
+        self.embed = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def text_path(self, budget_s):
+        async def step(deadline):
+            return self.module.text_embedding_within_deadline(self.PROMPT)
+        return run_with_deadline(budget_s, step)
+
+    def steps(self, image, text, budget_s=1.0):
+        """ steps_within_deadline with the image / text steps returning (or raising) the given values """
+        async def outcome(value, delay=0.0):
+            await asyncio.sleep(delay)
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        async def step(deadline):
+            image_future = asyncio.ensure_future(outcome(*image)) if image else None
+            text_future = asyncio.ensure_future(outcome(*text)) if text else None
+            return await self.module.steps_within_deadline(image_future, text_future, self.PROMPT, deadline)
+        return run_with_deadline(budget_s, step)
+
+    def test_cached(self):
+        self.module.cache_text_embedding(self.PROMPT, (self.text, {"budget": "cached"}))
+        (embedding, criteria), paths = self.text_path(5.0)
+        self.assertEqual(paths["text"], "cached")
+        self.assertEqual(criteria, {"budget": "cached"})
+
+    def test_t5_capped(self):
+        def evaluate_t5(prompt, return_criteria, max_time, multi_vector):
+            time.sleep(max_time)
+            return self.text, {"budget": "partial"}
+
+        with mock.patch.multiple(self.module, T5_MIN_BUDGET_S=0.0, RANKING_RESERVE_S=0.0, evaluate_t5=evaluate_t5):
+            (_, criteria), paths = self.text_path(0.05)
+        self.assertEqual(paths["text"], "t5_capped")
+        self.assertIsNone(self.module.cached_text_embedding(self.PROMPT))  # partial criteria are not cached
+
+    def test_rule_based_when_too_little_time_for_t5(self):
+        (embedding, criteria), paths = self.text_path(self.module.T5_MIN_BUDGET_S / 2)
+        self.assertEqual(paths["text"], "rule_based")
+        self.assertEqual(criteria, self.criteria)
+        self.assertIs(embedding, self.text)
+
+    def test_image_only_when_text_fails(self):
+        with self.assertLogs(self.module.logger, "ERROR"):
+            (image, text, criteria), paths = self.steps((self.image,), (RuntimeError("T5 crashed"),))
+        self.assertIs(image, self.image)
+        self.assertIsNone(text)
+        self.assertEqual(criteria, self.criteria)
+        self.assertEqual(paths["text"], "failed")
+
+    def test_image_only_when_text_is_late(self):
+        with mock.patch.object(self.module, "RANKING_RESERVE_S", 0.0):
+            (image, text, criteria), paths = self.steps((self.image,), ((self.text, {}), 1.0), budget_s=0.1)
+        self.assertIsNone(text)
+        self.assertEqual(criteria, self.criteria)
+        self.assertEqual(paths["text"], "timed_out")
+
+    def test_rule_based_when_text_fails_without_images(self):
+        with self.assertLogs(self.module.logger, "ERROR"):
+            (image, text, criteria), paths = self.steps(None, (RuntimeError("T5 crashed"),))
+        self.assertIsNone(image)
+        self.assertIs(text, self.text)
+        self.assertEqual(criteria, self.criteria)
+        self.assertEqual(paths["text"], "rule_based")
+
+    def test_deadline_exceeded_when_the_fallback_fails_too(self):
+        from src.deadline import DeadlineExceeded
+
+        self.embed.side_effect = RuntimeError("MiniLM crashed")
+        with self.assertRaises(DeadlineExceeded), self.assertLogs(self.module.logger, "ERROR"):
+            self.steps(None, (RuntimeError("T5 crashed"),))
+
+
+class RecommendViewTests(SimpleTestCase):
+    """ Status codes of find_recommended_cities for bad parameters and internal errors """
+
+    INPUTS = {"image_folder": None, "prompt": "Toronto", "alpha": 0.0, "beta": 1.0}
+
+    def get(self, query="", error=None):
+        """ Status and body of the view when the embedding step raises `error` (or returns a text-only embedding) """
+        from apiresponse import views
+
+        async def read_user_inputs(request):
+            return dict(self.INPUTS), None
+
+        async def aget_user_overall_embedding(*args, **kwargs):
+            if error is not None:
+                raise error
+            return np.ones(384, dtype="float32"), {}
+
+        request = RequestFactory().get(f"/find_recommended_cities{query}")
+        with mock.patch.object(views, "read_user_inputs", read_user_inputs), \
+                mock.patch.object(views, "aget_user_overall_embedding", aget_user_overall_embedding):
+            response = asyncio.run(views.find_recommended_cities(request))
+        return response.status_code, json.loads(response.content)
+
+    def test_non_finite_deadline_uses_the_default(self):
+        from apiresponse.views import deadline_for
+
+        for value in ("nan", "inf", "-inf", "soon"):
+            with self.subTest(deadline_ms=value):
+                request = RequestFactory().get("/", {"deadline_ms": value})
+                self.assertEqual(deadline_for(request), settings.RECOMMEND_DEADLINE_S)
+        self.assertEqual(deadline_for(RequestFactory().get("/", {"deadline_ms": "500"})), 0.5)
+
+    def test_no_embedding_is_a_bad_request(self):
+        from src.embedding_extract.implicit_user_embedding import NoUserEmbedding
+
+        status, body = self.get("?deadline_ms=nan", NoUserEmbedding("No valid image or text embeddings found!"))
+        self.assertEqual(status, 400)
+        self.assertEqual(body["pipeline"]["budget_ms"], round(settings.RECOMMEND_DEADLINE_S * 1000))
+
+    def test_internal_value_error_is_a_server_error(self):
+        with self.assertLogs("apiresponse.views", "ERROR"):
+            status, body = self.get(error=ValueError("shapes (3,) and (4,) not aligned"))
+        self.assertEqual(status, 500)
+        self.assertNotIn("shapes", body["error"])
+
+    def test_bad_max_distance_is_a_bad_request(self):
+        for value in ("far", "nan", "-5"):
+            with self.subTest(max_distance_km=value):
+                status, body = self.get(f"?max_distance_km={value}&departure_location=Toronto")
+                self.assertEqual(status, 400)
+                self.assertIn("max_distance_km", body["error"])
+
+    def stream_events(self, image_step):
+        """ Event names of the recommendation stream when the image step is `image_step` and the prompt works """
+        from apiresponse import views
+
+        def text_step():
+            return np.ones(384, dtype="float32"), {}
+
+        async def collect():
+            request = RequestFactory().get("/stream_recommended_cities")
+            return [event async for event in views.recommendation_events(request, dict(self.INPUTS))]
+
+        with mock.patch.object(views, "embedding_tasks", return_value=(image_step, text_step)), \
+                mock.patch.object(views, "recommend_cities", return_value=[("Lisbon", 0.9)]), \
+                mock.patch.object(views, "get_result_cache", return_value=None), \
+                mock.patch.object(views, "clear_user_inputs"):
+            events = asyncio.run(collect())
+        return [event.split("\n", 1)[0].removeprefix("event: ") for event in events]
+
+    def test_stream_ranks_the_prompt_when_images_fail(self):
+        def failing_image_step():
+            raise RuntimeError("CLIP crashed")
+
+        with self.assertLogs("apiresponse.views", "ERROR"):
+            self.assertEqual(self.stream_events(failing_image_step), ["text", "final"])
+        self.assertEqual(self.stream_events(lambda: None), ["text", "final"])  # no decodable upload
+        self.assertEqual(self.stream_events(lambda: np.ones(512, dtype="float32")), ["image", "text", "final"])
+
+
+class InferencePoolProtocolTests(SimpleTestCase):
+    """ Requests, replies and health checks of an inference worker served in this process with a stub model """
+
+    def setUp(self):
+        import socketserver
+        import threading
+        from multiprocessing import shared_memory
+        from src.embedding_extract import inference_pool
+
+        self.pool = inference_pool
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        for patcher in (
+            mock.patch.object(inference_pool, "run_task", side_effect=self.run_task),
+            # worker and client share this process's resource tracker, the client unregisters the buffer
+            mock.patch.object(inference_pool, "attach_shared_memory", lambda name: shared_memory.SharedMemory(name=name)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        socket_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(socket_dir.cleanup)
+        self.socket_path = os.path.join(socket_dir.name, inference_pool.SOCKET_PATTERN.format(0))
+        server = socketserver.ThreadingUnixStreamServer(self.socket_path, inference_pool.WorkerHandler)
+        server.daemon_threads = True
+        server.inference_lock = threading.Lock()
+        server.busy_since = None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.client = inference_pool.InferenceClient(socket_dir.name)
+        self.addCleanup(self.client.drop, self.socket_path)
+
+    def run_task(self, message):
+        if message["op"] == "image":
+            return np.arange(6, dtype="float32").reshape(2, 3), {}
+        if message["op"] == "text":
+            return np.ones(4, dtype="float32"), {"criteria": {"budget": message["prompt"]}}
+        if message["op"] == "criteria":
+            self.release.wait(5)  # a model call that hangs until released
+            return None, {}
+        raise ValueError(f"Unknown operation {message['op']!r}")
+
+    def test_embeddings_come_back_through_shared_memory(self):
+        np.testing.assert_array_equal(self.client.image_embedding("/uploads"), np.arange(6).reshape(2, 3))
+        embedding, criteria = self.client.text_embedding("low budget")
+        np.testing.assert_array_equal(embedding, np.ones(4))
+        self.assertEqual(criteria, {"budget": "low budget"})
+
+    def test_failed_request_is_reported(self):
+        with self.assertLogs(self.pool.logger, "ERROR"), self.assertRaisesRegex(RuntimeError, "Unknown operation"):
+            self.client.call({"op": "unknown"})
+        self.assertTrue(self.pool.ping(self.socket_path))  # the worker keeps serving
+
+    def test_wedged_worker_fails_health_checks(self):
+        import socket
+
+        with mock.patch.object(self.pool, "REQUEST_TIMEOUT_S", 0.05), \
+                socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            self.assertTrue(self.pool.ping(self.socket_path))
+            sock.connect(self.socket_path)
+            self.pool.send_message(sock, {"op": "criteria", "criteria": {"budget": "low"}})
+            time.sleep(0.2)
+            self.assertFalse(self.pool.ping(self.socket_path))
+            self.release.set()
+            self.assertTrue(self.pool.recv_message(sock)["ok"])
+            self.assertTrue(self.pool.ping(self.socket_path))
+
+    def test_supervisor_restarts_wedged_worker(self):
+        pool = self.pool.InferencePool(os.path.dirname(self.socket_path), 1, cores_per_worker=1)
+        slot = pool.slots[0]
+        slot.process, slot.ready = mock.Mock(is_alive=mock.Mock(return_value=True)), True
+        with mock.patch.object(self.pool, "ping", return_value=False), \
+                mock.patch.object(pool, "schedule_restart") as schedule_restart:
+            for _ in range(self.pool.MAX_FAILED_CHECKS):
+                pool.check(slot)
+        schedule_restart.assert_called_once()
+
+
+class CityCatalogTests(SimpleTestCase):
+    """ Write-ahead log, snapshot switch and edits shared by several processes of the city catalog """
+
+    DIM = 8
+
+    def setUp(self):
+        from src.faiss_indexing import city_catalog
+
+        self.module = city_catalog
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.catalog_dir = work_dir.name
+        self.rng = np.random.default_rng(0)
+        records = [{"name": f"City {city_id}"} for city_id in range(5)]
+        self.module.CityCatalog.build(self.catalog_dir, self.rng.normal(size=(5, self.DIM)), records)
+
+    def open(self, **kwargs):
+        return self.module.CityCatalog.open(self.catalog_dir, **kwargs)
+
+    def vector(self):
+        return self.rng.normal(size=self.DIM).astype("float32")
+
+    def assertConsistent(self, catalog):
+        self.assertEqual(catalog.index.ntotal, len(catalog.metadata))
+        self.assertGreater(catalog.next_id, max(catalog.metadata))
+
+    def test_upsert_and_remove_survive_reopen(self):
+        catalog = self.open()
+        lisbon = catalog.upsert({"name": "Lisbon"}, self.vector())
+        catalog.remove(2)
+        self.assertEqual(catalog.upsert({"name": "Lisbon", "metadata": {"country": "Portugal"}}, self.vector()), lisbon)
+
+        reopened = self.open()
+        self.assertEqual(reopened.city_id("Lisbon"), lisbon)
+        self.assertEqual(reopened.get(lisbon)["country"], "Portugal")
+        self.assertIsNone(reopened.get(2))
+        self.assertEqual(reopened.upsert({"name": "Porto"}, self.vector()), lisbon + 1)  # ids are never reused
+        self.assertConsistent(reopened)
+
+    def test_wal_replay_after_crash(self):
+        catalog = self.open()
+        lisbon = catalog.upsert({"name": "Lisbon"}, self.vector())
+        catalog.remove(0)
+        # the process dies before any checkpoint; a torn entry is left at the end of the log
+        with open(catalog.wal_path, "a", encoding="utf-8") as f:
+            f.write('{"op": "upsert", "id": 9')
+
+        reopened = self.open()
+        self.assertEqual(reopened.city_id("Lisbon"), lisbon)
+        self.assertIsNone(reopened.get(0))
+        self.assertEqual(reopened.version, catalog.version)
+        porto = reopened.upsert({"name": "Porto"}, self.vector())  # cuts the torn entry off first
+        self.assertEqual(self.open().city_id("Porto"), porto)
+        self.assertConsistent(self.open())
+
+    def test_snapshot_switches_only_with_the_state_file(self):
+        catalog = self.open()
+        catalog.upsert({"name": "Lisbon"}, self.vector())
+        write_json = self.module.atomic_write_json
+
+        def crash_before_state(path, data):
+            if path.endswith(self.module.CATALOG_STATE_FILE):
+                raise OSError("crashed")
+            write_json(path, data)
+
+        with mock.patch.object(self.module, "atomic_write_json", crash_before_state), self.assertRaises(OSError):
+            catalog.checkpoint()
+
+        reopened = self.open()  # the previous snapshot and the log, no city twice
+        self.assertEqual(reopened.generation, 1)
+        self.assertEqual(len(reopened.metadata), 6)
+        self.assertConsistent(reopened)
+
+        reopened.checkpoint()
+        self.assertEqual(self.open().generation, 2)
+        self.assertFalse(os.path.exists(reopened.wal_path))
+        self.assertFalse(any(os.path.exists(path) for path in self.module.snapshot_paths(self.catalog_dir, 1)))
+        self.assertConsistent(self.open())
+
+    def test_processes_see_each_others_edits(self):
+        writer, server = self.open(), self.open()
+        lisbon = writer.upsert({"name": "Lisbon"}, self.vector())
+        porto = server.upsert({"name": "Porto"}, self.vector())  # catches up first: no id allocated twice
+        self.assertNotEqual(lisbon, porto)
+
+        writer.refresh()
+        self.assertEqual(writer.city_id("Porto"), porto)
+        version = server.version
+        writer.remove(lisbon)
+        writer.checkpoint()
+        server.refresh()
+        self.assertIsNone(server.city_id("Lisbon"))
+        self.assertGreater(server.version, version)  # invalidates the result cache
+        self.assertEqual(server.generation, writer.generation)
+        self.assertConsistent(server)
+
+    def test_concurrent_writers_allocate_distinct_ids(self):
+        import threading
+
+        catalogs = [self.open(checkpoint_every=7) for _ in range(3)]
+        ids = [[] for _ in catalogs]
+
+        def add_cities(number):
+            for city in range(10):
+                ids[number].append(catalogs[number].upsert({"name": f"City {number}-{city}"}, self.vector()))
+
+        threads = [threading.Thread(target=add_cities, args=(number,)) for number in range(len(catalogs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        all_ids = [city_id for added in ids for city_id in added]
+        self.assertEqual(len(set(all_ids)), 30)
+        reopened = self.open()
+        self.assertEqual(len(reopened.metadata), 35)
+        self.assertConsistent(reopened)
@@ -7,5 +7,9 @@ urlpatterns = [
     path('upload_image/', views.upload_image, name='upload_image'),
     path('upload_prompt/', views.upload_prompt, name='upload_prompt'),
     path('set_alpha_beta/', views.set_alpha_beta, name='set_alpha_beta'),
-    path('find_recommended_cities/', views.find_recommended_cities, name='find_recommended_cities')
+    path('find_recommended_cities/', views.find_recommended_cities, name='find_recommended_cities'),
+    path('stream_recommended_cities/', views.stream_recommended_cities, name='stream_recommended_cities'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('profiles/', views.profiles, name='profiles'),
+    path('profiles/<str:capture_id>/', views.profile_capture, name='profile_capture'),
 ]
@@ -1,7 +1,9 @@
 # django tools
-from django.http import JsonResponse
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_protect, csrf_exempt
-from .models import EmbeddingConfig
+from .blend_weights import asession_weights, set_session_weights
 
 # utilities
 import json
@@ -9,19 +11,62 @@ from constants import KnownDirs, HTTP, Config
 import os
 import sys
 import shutil 
+import asyncio
+import logging
+import math
+from functools import lru_cache, partial
+import numpy as np
     
-# core functionality
-from FlightScraper import SearchFlights
-
 # debugging tools
 import time
 
 # database and embedding tools
 sys.path.append('..')
-from src.embedding_extract.implicit_user_embedding import get_user_overall_embedding
-from src.faiss_indexing.extract_city import recommend_cities
+from src.embedding_extract.implicit_user_embedding import (
+    NoUserEmbedding, aget_user_overall_embedding, get_inference_executor, embedding_tasks, combine_user_embeddings,
+)
+from src.deadline import DeadlineExceeded, current_deadline, end_deadline, start_deadline
+from src.embedding_extract.inference_pool import InferenceUnavailable
+from src.faiss_indexing.extract_city import recommend_cities, get_catalog, get_result_cache
+from src.faiss_indexing.multi_vector import AGGREGATIONS
+from src.memory_usage import memory_usage
+from src.profiling import COLLAPSED_EXTENSION, list_captures
+from src.tracing import in_context, prometheus_text
+
+logger = logging.getLogger(__name__)
+
+class InvalidParameter(ValueError):
+    """ A query parameter the client sent cannot be used; answered with 400 """
+
+async def run_blocking(func, *args, **kwargs):
+    """ Runs a CPU-bound or blocking call on the shared, bounded inference executor """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_inference_executor(), in_context(partial(func, *args, **kwargs)))
 
-os.makedirs(KnownDirs.IMAGE_DIR, exist_ok=True)
+@lru_cache(maxsize=1)
+def get_flight_search():
+    """ Flight graph shared by all requests, with the nearest airports of every catalog city resolved once """
+    from FlightScraper import SearchFlights  # pandas / networkx / sklearn, loaded on first use
+    return SearchFlights(fetch_from_web=True, cities=list(get_catalog().metadata.values()))
+
+@lru_cache(maxsize=4)
+def city_geo_index(catalog, version):
+    """ Spatial index over the catalog cities labelled by city id, rebuilt when the catalog version changes """
+    from GeoIndex import GeoIndex
+
+    attributes = catalog.attributes
+    return GeoIndex(np.arange(len(attributes)), attributes.column("lat"), attributes.column("lng"))
+
+def cities_near(departure_location, radius_km):
+    """ Mask over catalog city ids within radius_km of the departure location, None if it cannot be located """
+    coordinates = get_flight_search().locate_city(departure_location)
+    if coordinates is None:
+        return None
+    catalog = get_catalog()
+    mask = np.zeros(len(catalog.attributes), dtype=bool)
+    nearby = [city_id for city_id, _ in city_geo_index(catalog, catalog.version).within(*coordinates, radius_km)]
+    mask[nearby] = True
+    return mask
 
 @csrf_exempt
 def upload_image(request):
@@ -30,7 +75,8 @@ def upload_image(request):
             return JsonResponse({"error": "No image uploaded."}, status=HTTP.BAD_REQUEST)
 
     image = request.FILES["image"]
-    print(f"Received image: {image.name}")  # Print image name to debug
+    logger.debug("Received image %s", image.name)
+    os.makedirs(KnownDirs.IMAGE_DIR, exist_ok=True)
     image_path = os.path.join(KnownDirs.IMAGE_DIR, image.name)
     
     if not image.name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp')):
@@ -51,6 +97,7 @@ def upload_prompt(request):
         data = json.loads(request.body)
         prompt = data.get("prompt", "")
         
+        os.makedirs(os.path.dirname(KnownDirs.TEXT_FILE_PATH), exist_ok=True)
         with open(KnownDirs.TEXT_FILE_PATH, "w") as f:
             f.write(prompt)
             
@@ -61,7 +108,7 @@ def upload_prompt(request):
     
 @csrf_exempt
 def set_alpha_beta(request):
-    """ Post the alpha value (find and set the beta value) """
+    """ Post the alpha value (find and set the beta value) for this session """
     if not request.method == "POST":
         return JsonResponse({"error": "Invalid request method."}, status=HTTP.METHOD_NOT_ALLOWED)
     try:
@@ -72,19 +119,14 @@ def set_alpha_beta(request):
         if not (alpha + beta == 1 and 0 <= alpha <= 1 and 0 <= beta <= 1):
             return JsonResponse({"error": "Alpha and Beta must sum to 1."}, status=HTTP.BAD_REQUEST)
 
-        config, _ = EmbeddingConfig.objects.get_or_create(id=1)
-        config.alpha, config.beta = alpha, beta
-        config.save()
+        set_session_weights(request.session, alpha, beta)
 
         return JsonResponse({"success": f"Alpha set to {alpha}, beta set to {beta}."}, status=HTTP.OK)
     except (ValueError, json.JSONDecodeError):
         return JsonResponse({"error": "Invalid alpha/beta values."}, status=HTTP.BAD_REQUEST)
 
-@csrf_exempt
-def find_recommended_cities(request):
-    if not request.method == "GET":
-        return JsonResponse({"error": "Invalid request method."}, status=HTTP.METHOD_NOT_ALLOWED)
-    
+async def read_user_inputs(request):
+    """ Uploaded images folder, prompt text and alpha/beta to blend them with; (None, error response) if unusable """
     image_path = KnownDirs.IMAGE_DIR
     prompt_path = KnownDirs.TEXT_FILE_PATH
     
@@ -96,40 +138,228 @@ def find_recommended_cities(request):
     
     # if nothing was populated, give up
     if not prompt_exists and not images_exist:
-        return JsonResponse({"error": "No images or prompt to read"}, status=HTTP.BAD_REQUEST)
+        return None, JsonResponse({"error": "No images or prompt to read"}, status=HTTP.BAD_REQUEST)
 
     a,b = Config.ALPHA_DEFAULT, Config.BETA_DEFAULT
     try:
-        grabbedConfig = EmbeddingConfig.objects.first()
-        if grabbedConfig:
-            a,b = grabbedConfig.alpha, grabbedConfig.beta        
-        if images_exist and not prompt_path:
+        a,b = await asession_weights(request.session)
+        if images_exist and not prompt_exists:
             a,b = Config.IMAGE_ONLY_AB
         elif prompt_exists and not images_exist:
             a,b = Config.PROMPT_ONLY_AB
     except:
-        return JsonResponse({"error": "Error fetching alpha/beta from database"}, status=HTTP.INTERNAL_SERVER_ERROR)
+        return None, JsonResponse({"error": "Error fetching alpha/beta from database"}, status=HTTP.INTERNAL_SERVER_ERROR)
+
+    prompt = ""
+    if prompt_exists:
+        with open(prompt_path, "r") as f:
+            prompt = f.read()
+
+    image_folder = os.path.abspath(image_path) if images_exist else None
+    return {"image_folder": image_folder, "prompt": prompt, "alpha": a, "beta": b}, None
+
+def clear_user_inputs():
+    """ Deletes the uploaded images and prompt once they have been used """
+    image_path = KnownDirs.IMAGE_DIR
+    prompt_path = KnownDirs.TEXT_FILE_PATH
+
+    # Clean up media directory
+    if os.path.exists(image_path):
+        shutil.rmtree(image_path)  # Deletes all images
+        os.makedirs(image_path)  # Recreate empty folder
+
+    # Delete the prompt file if it exists
+    if os.path.exists(prompt_path):
+        os.remove(prompt_path)
+
+async def distance_filter_for(request, criteria):
+    """ Mask of cities within max_distance_km of the departure location, if the request asks for one """
+    max_distance_km = request.GET.get("max_distance_km")
+    departure_location = request.GET.get("departure_location") or criteria.get("departure_location")
+    if max_distance_km and departure_location:
+        try:
+            radius_km = float(max_distance_km)
+        except ValueError:
+            radius_km = math.nan
+        if not math.isfinite(radius_km) or radius_km < 0:
+            raise InvalidParameter("max_distance_km must be a non-negative number.")
+        return await run_blocking(cities_near, departure_location, radius_km)
+    return None
+
+def deadline_for(request):
+    """ The request's time budget in seconds: RECOMMEND_DEADLINE_S, or less if it asks with ?deadline_ms= """
+    try:
+        requested_s = float(request.GET["deadline_ms"]) / 1000
+    except (KeyError, ValueError):
+        return settings.RECOMMEND_DEADLINE_S
+    if not math.isfinite(requested_s):
+        return settings.RECOMMEND_DEADLINE_S
+    return min(max(requested_s, 0.0), settings.RECOMMEND_DEADLINE_S)
+
+@csrf_exempt
+async def find_recommended_cities(request):
+    """
+    Recommends cities within the request's deadline. When time runs short the pipeline degrades
+    (image-only, cached or rule-based criteria, capped T5 generation); "pipeline" in the response
+    says which path each stage took.
+
+    ?aggregation=max|sum keeps every image and criterion vector and scores cities by late
+    interaction instead of one mean vector (default: USER_AGGREGATION).
+    """
+    if not request.method == "GET":
+        return JsonResponse({"error": "Invalid request method."}, status=HTTP.METHOD_NOT_ALLOWED)
+
+    aggregation = request.GET.get("aggregation", settings.USER_AGGREGATION)
+    if aggregation != "mean" and aggregation not in AGGREGATIONS:
+        return JsonResponse({"error": f"aggregation must be one of mean, {', '.join(AGGREGATIONS)}."},
+                            status=HTTP.BAD_REQUEST)
+
+    inputs, error_response = await read_user_inputs(request)
+    if error_response:
+        return error_response
     
+    token = start_deadline(deadline_for(request))
+    deadline = current_deadline()
     try:
-        user_embedding = get_user_overall_embedding(KnownDirs.API_DIR + image_path, KnownDirs.API_DIR + prompt_path, a, b)
-        recommended_cities = recommend_cities(user_embedding, top_k=Config.TOP_K)
-        
-        # Clean up media directory
-        if os.path.exists(image_path):
-            shutil.rmtree(image_path)  # Deletes all images
-            os.makedirs(image_path)  # Recreate empty folder
-
-        # Delete the prompt file if it exists
-        if os.path.exists(prompt_path):
-            os.remove(prompt_path)
+        # CLIP and T5 run concurrently on the shared executor
+        user_embedding, criteria = await aget_user_overall_embedding(
+            inputs["image_folder"], inputs["prompt"], inputs["alpha"], inputs["beta"], return_criteria=True,
+            aggregation=None if aggregation == "mean" else aggregation,
+        )
+        deadline.note("aggregation", aggregation)
+
+        # Optionally keep only cities within max_distance_km of where the user departs from
+        distance_filter = await distance_filter_for(request, criteria)
+
+        recommended_cities = await run_blocking(
+            recommend_cities, user_embedding, top_k=Config.TOP_K, criteria=criteria, filter=distance_filter,
+            cache=get_result_cache(),
+        )
         
-        return JsonResponse({"recommended_cities": recommended_cities}, status=HTTP.OK)
+        clear_user_inputs()
+        return JsonResponse({"recommended_cities": recommended_cities, "pipeline": deadline.report()}, status=HTTP.OK)
+
+    except asyncio.CancelledError:
+        # The client went away: queued stages are dropped and the uploads are kept for a retry
+        logger.info("Client disconnected, abandoning find_recommended_cities")
+        raise
+    except (DeadlineExceeded, InferenceUnavailable) as e:
+        # the uploads are kept for a retry
+        logger.warning(f"find_recommended_cities degraded to an error: {e}")
+        return JsonResponse({"error": str(e), "pipeline": deadline.report()}, status=HTTP.SERVICE_UNAVAILABLE)
+    except (NoUserEmbedding, InvalidParameter) as e:
+        return JsonResponse({"error": str(e), "pipeline": deadline.report()}, status=HTTP.BAD_REQUEST)
+    except Exception as e:
+        logger.exception("find_recommended_cities failed")
+        return JsonResponse({"error": "Error processing the embeddings", "pipeline": deadline.report()},
+                            status=HTTP.INTERNAL_SERVER_ERROR)
+    finally:
+        end_deadline(token)
+
+def sse_event(event, data):
+    """ One server-sent event """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def route_summary(graph, departure_location, city):
+    """ Airports on the way from the departure location to a city, or why there is no route """
+    path = graph.find_path_between_cities(departure_location, city)
+    if isinstance(path, str):
+        return {"error": path}
+    return {"airports": path, "stops": max(len(path) - 2, 0)}
+
+async def recommendation_events(request, inputs):
+    """
+    Yields the rankings as they become available: image-only as soon as CLIP finishes, then the
+    text-refined blend once T5/MiniLM finish, then the final ranking with route summaries. When the
+    images give no embedding there is no image-only ranking and the prompt is ranked alone
+    """
+    start = time.perf_counter()
+    stage_start = start
+    loop = asyncio.get_running_loop()
+    executor = get_inference_executor()
+    extract_image_embedding, extract_text_embedding = embedding_tasks(inputs["image_folder"], inputs["prompt"])
+
+    def timing():
+        nonlocal stage_start
+        now = time.perf_counter()
+        stage_ms, stage_start = (now - stage_start) * 1000, now
+        return {"stage_ms": round(stage_ms, 1), "elapsed_ms": round((now - start) * 1000, 1)}
+
+    # Both models start right away, CLIP is usually done long before T5
+    image_future = loop.run_in_executor(executor, in_context(extract_image_embedding)) if extract_image_embedding else None
+    text_future = loop.run_in_executor(executor, in_context(extract_text_embedding)) if extract_text_embedding else None
+    try:
+        image_embedding = None
+        if image_future:
+            try:
+                image_embedding = await image_future
+            except Exception:
+                if text_future is None:
+                    raise
+                # like find_recommended_cities: no "image" event, the prompt alone is ranked
+                logger.exception("Image embedding failed, continuing with the prompt only")
+        if image_embedding is not None:
+            image_only = await run_blocking(
+                recommend_cities, combine_user_embeddings(image_embedding, None, 1, 0), top_k=Config.TOP_K
+            )
+            yield sse_event("image", {"recommended_cities": image_only, **timing()})
 
+        text_embedding, criteria = (await text_future) if text_future else (None, {})
+        user_embedding = combine_user_embeddings(image_embedding, text_embedding, inputs["alpha"], inputs["beta"])
+        distance_filter = await distance_filter_for(request, criteria)
+        recommended_cities = await run_blocking(
+            recommend_cities, user_embedding, top_k=Config.TOP_K, criteria=criteria, filter=distance_filter,
+            cache=get_result_cache(),
+        )
+        if text_future:
+            yield sse_event("text", {"recommended_cities": recommended_cities, "criteria": criteria, **timing()})
+
+        # Routes from where the user departs to every recommended city, looked up concurrently
+        routes = {}
+        departure_location = request.GET.get("departure_location") or criteria.get("departure_location")
+        if departure_location:
+            graph = await run_blocking(get_flight_search)
+            summaries = await asyncio.gather(
+                *(run_blocking(route_summary, graph, departure_location, city) for city, _ in recommended_cities)
+            )
+            routes = {city: summary for (city, _), summary in zip(recommended_cities, summaries)}
+        clear_user_inputs()
+        yield sse_event("final", {
+            "recommended_cities": recommended_cities, "departure_location": departure_location, "routes": routes,
+            **timing(),
+        })
+
+    except asyncio.CancelledError:
+        logger.info("Client disconnected, abandoning stream_recommended_cities")
+        raise
+    except (NoUserEmbedding, InvalidParameter) as e:
+        yield sse_event("error", {"error": str(e), **timing()})
     except Exception as e:
-        return JsonResponse({"error": "Error processing the embeddings"}, status=HTTP.INTERNAL_SERVER_ERROR)
+        logger.exception("Streaming recommendations failed")
+        yield sse_event("error", {"error": "Error processing the embeddings", **timing()})
+    finally:
+        # drop stages that have not started yet if the stream ended early
+        for future in (image_future, text_future):
+            if future is not None and not future.done():
+                future.cancel()
+
+@csrf_exempt
+async def stream_recommended_cities(request):
+    """ find_recommended_cities as server-sent events: "image", "text" and "final" rankings, each with stage timings """
+    if not request.method == "GET":
+        return JsonResponse({"error": "Invalid request method."}, status=HTTP.METHOD_NOT_ALLOWED)
+
+    inputs, error_response = await read_user_inputs(request)
+    if error_response:
+        return error_response
+
+    response = StreamingHttpResponse(recommendation_events(request, inputs), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # keep reverse proxies from holding events back
+    return response
     
 @csrf_exempt
-def find_airport_path(request):
+async def find_airport_path(request):
     """
     Given a list of cities, return the optimal airport path between cities in sequence.
     """
@@ -143,11 +373,11 @@ def find_airport_path(request):
         if len(cities) < 2:
             return JsonResponse({"error": "At least two cities are required."}, status=HTTP.BAD_REQUEST)
 
-        # Initialize FlightScraper logic
-        graph = SearchFlights(fetch_from_web=True)
+        # Shared FlightScraper logic
+        graph = await run_blocking(get_flight_search)
 
         # Find the flight path
-        path_result = graph.find_path_between_multiple_cities(cities)
+        path_result = await run_blocking(graph.find_path_between_multiple_cities, cities)
 
         # If the function returns an error string
         if isinstance(path_result, str):
@@ -156,13 +386,16 @@ def find_airport_path(request):
         # Return a structured response
         return JsonResponse({"city_airport_paths": path_result}, status=HTTP.OK)
     
+    except asyncio.CancelledError:
+        logger.info("Client disconnected, abandoning find_airport_path")
+        raise
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON input."}, status=HTTP.BAD_REQUEST)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=HTTP.INTERNAL_SERVER_ERROR)
 
 @csrf_exempt
-def find_two_city_path(request):
+async def find_two_city_path(request):
     """
     Given a list of cities, find the fastest airport route from the first city to each other city.
     """
@@ -176,20 +409,56 @@ def find_two_city_path(request):
         if len(cities) < 2:
             return JsonResponse({"error": "At least two cities are required."}, status=HTTP.BAD_REQUEST)
         
-        # Initialize FlightScraper logic
-        graph = SearchFlights(fetch_from_web=True)
+        # Shared FlightScraper logic
+        graph = await run_blocking(get_flight_search)
 
+        # Look up the routes to every other city concurrently
         city1 = cities[0]
-        tpath = {}
-        for city2 in cities[1:]:
-            # Find the flight path
-            path_result = graph.find_path_between_cities(city1, city2)
-            tpath.update( { city2 : path_result } )
+        path_results = await asyncio.gather(
+            *(run_blocking(graph.find_path_between_cities, city1, city2) for city2 in cities[1:])
+        )
+        tpath = dict(zip(cities[1:], path_results))
             
         # Return a structured response
         return JsonResponse({"cities":tpath}, status=HTTP.OK)
 
+    except asyncio.CancelledError:
+        logger.info("Client disconnected, abandoning find_two_city_path")
+        raise
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON input."}, status=HTTP.BAD_REQUEST)
     except Exception as e:
-        return JsonResponse({"error": str(e)}, status=HTTP.INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return JsonResponse({"error": str(e)}, status=HTTP.INTERNAL_SERVER_ERROR)
+
+
+def metrics(request):
+    """ Stage latency histograms, cache counters and worker memory in the Prometheus text format """
+    cache_stats = get_result_cache().stats()
+    gauges = {f"result_cache_{name}": value for name, value in cache_stats.items()}
+    # this worker's memory, private = not shared copy-on-write with the master or other workers
+    gauges.update({f"process_{name}_bytes": value for name, value in (memory_usage() or {}).items()})
+    return HttpResponse(prometheus_text(gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@staff_member_required
+def profiles(request):
+    """ Most recent profiler captures (see ProfilingMiddleware), newest first """
+    try:
+        limit = int(request.GET.get("limit", 50))
+    except ValueError:
+        limit = -1
+    if limit < 0:
+        return JsonResponse({"error": "limit must be a non-negative integer."}, status=HTTP.BAD_REQUEST)
+    return JsonResponse({"captures": list_captures(settings.PROFILE_DIR, limit)}, status=HTTP.OK)
+
+@staff_member_required
+def profile_capture(request, capture_id):
+    """ Collapsed stacks of one capture, for flamegraph.pl or speedscope """
+    if not capture_id.replace("-", "").replace("_", "").isalnum():
+        raise Http404("Unknown capture")
+    path = os.path.join(settings.PROFILE_DIR, capture_id + COLLAPSED_EXTENSION)
+    if not os.path.exists(path):
+        raise Http404("Unknown capture")
+    with open(path, "r") as f:
+        response = HttpResponse(f.read(), content_type="text/plain; charset=utf-8")
+    response["Content-Disposition"] = f'inline; filename="{capture_id}{COLLAPSED_EXTENSION}"'
+    return response
@@ -3,6 +3,10 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The recommendation and routing views are async, so serving through ASGI (e.g.
+``uvicorn config.asgi:application``) keeps many requests in flight per worker while the
+model stages run on the shared inference executor.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'apiresponse.middleware.ServerTimingMiddleware',  # stage timings and /api/metrics histograms
+    'apiresponse.middleware.ProfilingMiddleware',  # only active with PROFILE_REQUESTS
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -51,6 +54,26 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Add a Server-Timing header with the pipeline stages to every response (?server_timing=1 per request)
+SERVER_TIMING = DEBUG
+
+# Sampling profiler for slow requests (PROFILE_REQUESTS=1), captures listed at /api/profiles/
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "0") == "1"
+PROFILE_SLOW_REQUEST_S = float(os.environ.get("PROFILE_SLOW_REQUEST_S", 2.0))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0.01))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", str(BASE_DIR / "Profiles"))
+PROFILE_MAX_CAPTURES = 200
+
+# Sessions (per-user alpha/beta) live in a signed cookie, no database read or write per request
+SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
+
+# How find_recommended_cities represents a user: "mean" (one pooled vector) or "max" / "sum"
+# (every image and criterion vector, scored by late interaction); per request with ?aggregation=
+USER_AGGREGATION = os.environ.get("USER_AGGREGATION", "mean")
+
+# Time budget of find_recommended_cities; clients may ask for less with ?deadline_ms=
+RECOMMEND_DEADLINE_S = float(os.environ.get("RECOMMEND_DEADLINE_S", 8.0))
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -7,10 +7,20 @@ class FlightScraper:
     URL_ROUTES_FILE_NAME = 'routes.dat'
     
     DATA_CSV_FLIGHT_DETAILS_FORMAT = ["id", "name", "city", "country", "iata", "icao", "lat", "lon", "alt", "timezone", "dst", "tz", "type", "source"]
-    DATA_CSV_FLIGHT_DETAILS_COLUMNS = [1, 2, 3, 4]  
+    DATA_CSV_FLIGHT_DETAILS_COLUMNS = [1, 2, 3, 4, 6, 7]  # name, city, country, iata, lat, lon
     DATA_CSV_ROUTES_DETAILS_FORMAT = ["airline", "airline_id", "source_airport", "source_airport_id", "destination_airport", "destination_airport_id", "codeshare", "stops", "equipment"]
     DATA_CSV_ROUTES_DETAILS_COLUMNS = [2, 4] 
+
+    # Country spellings of departure locations ("Toronto, Canada", "London, UK") -> OpenFlights country names
+    COUNTRY_ALIASES = {"usa": "united states", "us": "united states", "u.s.": "united states", "uk": "united kingdom",
+                       "england": "united kingdom", "uae": "united arab emirates"}
+    FUZZY_CITY_CUTOFF = 0.85  # difflib ratio for accepting a misspelled city name
     
+class Geo:
+    EARTH_RADIUS_KM = 6371.0088
+    AIRPORTS_PER_CITY = 3  # airports precomputed for each catalog city
+    AIRPORT_RADIUS_KM = 100  # an airport further away than this does not serve the city
+
 class HTTP:
     OK = 200
     CREATED = 201
@@ -18,6 +28,7 @@ class HTTP:
     NOT_FOUND = 404
     METHOD_NOT_ALLOWED = 405
     INTERNAL_SERVER_ERROR = 500
+    SERVICE_UNAVAILABLE = 503
 
 class KnownDirs:
     IMAGE_DIR = "Media/images/"
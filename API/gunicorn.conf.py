@@ -0,0 +1,33 @@
+"""
+gunicorn settings for serving the API with several workers per box.
+
+    cd API && gunicorn config.asgi:application -c gunicorn.conf.py
+
+The master imports the app and loads the catalog, flight graph and models once before forking
+(see apiresponse/preload.py); the workers share those pages copy-on-write. Check what each
+worker really costs with `python manage.py worker_memory`.
+"""
+import os
+
+bind = os.environ.get("BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1))
+worker_class = os.environ.get("WORKER_CLASS", "uvicorn.workers.UvicornWorker")  # the views are async
+timeout = int(os.environ.get("WORKER_TIMEOUT", 120))
+pidfile = os.environ.get("GUNICORN_PIDFILE", "/tmp/tripadvisory-gunicorn.pid")
+
+# Load the app, and with it every read-only artifact, in the master
+preload_app = os.environ.get("PRELOAD", "1") == "1"
+# Not needed when the models run in the separate inference pool (src/embedding_extract/inference_pool.py)
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "0" if os.environ.get("INFERENCE_SOCKET_DIR") else "1") == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        from apiresponse.preload import preload_artifacts
+        preload_artifacts(models=PRELOAD_MODELS)
+        server.log.info("Artifacts preloaded in the master, forking workers")
+
+
+def post_fork(server, worker):
+    from apiresponse.preload import after_fork
+    after_fork(workers)
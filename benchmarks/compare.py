@@ -0,0 +1,54 @@
+"""
+Before/after table of two benchmark result files written by micro.py or macro.py.
+
+    python benchmarks/compare.py before.json after.json
+    python benchmarks/compare.py before.json after.json --fail-above 1.10
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("p50_ms", "p99_ms")
+
+
+def load(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare(before, after, metrics=METRICS):
+    """ [(name, {metric: (before, after, after / before)})] for the benchmarks present in both runs. """
+    before_results = {result["name"]: result for result in before["results"]}
+    rows = []
+    for result in after["results"]:
+        old = before_results.get(result["name"])
+        if old is None:
+            continue
+        rows.append((result["name"], {
+            metric: (old[metric], result[metric], result[metric] / old[metric] if old[metric] else float("inf"))
+            for metric in metrics
+        }))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--fail-above", type=float, default=None,
+                        help="Exit with status 1 if any p50 ratio (after / before) exceeds this.")
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    print(f"before: {before.get('commit')} ({before.get('timestamp')})   after: {after.get('commit')} ({after.get('timestamp')})\n")
+    print(f"{'benchmark':40s} " + " ".join(f"{metric + ' before':>14s} {metric + ' after':>14s} {'ratio':>7s}" for metric in METRICS))
+
+    regressions = []
+    for name, values in compare(before, after):
+        print(f"{name:40s} " + " ".join(f"{old:14.3f} {new:14.3f} {ratio:6.2f}x" for old, new, ratio in values.values()))
+        if args.fail_above is not None and values["p50_ms"][2] > args.fail_above:
+            regressions.append(name)
+
+    if regressions:
+        print(f"\n❌ Slower than {args.fail_above}x at p50: {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,154 @@
+"""
+Offline fixtures for the benchmarks: a synthetic OpenFlights dataset, a city catalog and user uploads.
+"""
+import json
+import os
+import random
+import string
+import sys
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'API')))
+from src.faiss_indexing.city_catalog import CityCatalog
+from src.synthetic_data.synthetic_city_gen import CITY_VECTOR_NOISE, attribute_direction, generate_cities
+from src.synthetic_data.synthetic_prompt_generator import generate_sample
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+US_CITIES_FILE = os.path.join(REPO_ROOT, "data", "experimental_data", "us_cities.json")
+GRAPH_PKL_FILE = "airport_flight_graph.pkl"
+AIRPORTS_PKL_FILE = "airports_data.pkl"
+ROUTES_PKL_FILE = "routes_data.pkl"
+
+
+def load_us_cities():
+    with open(US_CITIES_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iata_code(i):
+    """ Unique 3-letter code for airport number i (i < 26**3). """
+    letters = string.ascii_uppercase
+    return letters[i // 676 % 26] + letters[i // 26 % 26] + letters[i % 26]
+
+
+def synthetic_openflights(num_airports=7000, routes_per_airport=10, seed=0):
+    """
+    Airports and routes shaped like the OpenFlights data `SearchFlights` downloads.
+
+    Every city of `us_cities.json` gets one or two airports a few km from its centre (named
+    after the city); the rest are spread over the globe. Each airport has routes to its nearest
+    neighbours and to a few hubs, so paths need several hops like real itineraries.
+
+    Returns:
+        tuple: (airports DataFrame [name, city, country, iata, lat, lon], routes DataFrame [source_airport, destination_airport])
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for city in load_us_cities():
+        lat, lng = city["metadata"].get("lat"), city["metadata"].get("lng")
+        if lat is None or lng is None:
+            continue
+        for _ in range(rng.integers(1, 3)):
+            rows.append((f"{city['name']} Airport", city["name"], "United States",
+                         lat + rng.normal(0, 0.1), lng + rng.normal(0, 0.1)))
+    while len(rows) < num_airports:
+        number = len(rows)
+        rows.append((f"Airport {number}", f"City {number}", "Elsewhere",
+                     float(np.degrees(np.arcsin(rng.uniform(-1, 1)))), float(rng.uniform(-180, 180))))
+
+    airports = pd.DataFrame(rows, columns=["name", "city", "country", "lat", "lon"])
+    airports.insert(3, "iata", [iata_code(i) for i in range(len(airports))])
+
+    # Routes: nearest neighbours on the unit sphere plus random hub connections, both directions
+    lat, lon = np.radians(airports["lat"].to_numpy()), np.radians(airports["lon"].to_numpy())
+    points = np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    hubs = rng.choice(len(airports), max(1, len(airports) // 50), replace=False)
+    near = routes_per_airport // 2
+    sources, destinations = [], []
+    for start in range(0, len(points), 1024):
+        similarity = points[start:start + 1024] @ points.T
+        neighbours = np.argpartition(-similarity, near + 1, axis=1)[:, 1:near + 1]
+        for offset, row in enumerate(neighbours):
+            source = start + offset
+            targets = list(row) + list(rng.choice(hubs, routes_per_airport - near))
+            for target in targets:
+                if target != source:
+                    sources += [source, target]
+                    destinations += [target, source]
+    codes = airports["iata"].to_numpy()
+    routes = pd.DataFrame({"source_airport": codes[sources], "destination_airport": codes[destinations]})
+    return airports, routes.drop_duplicates().reset_index(drop=True)
+
+
+def write_openflights_pickles(pickle_dir, **kwargs):
+    """ Writes the synthetic airports / routes where `SearchFlights` looks for its pickles; returns their paths. """
+    os.makedirs(pickle_dir, exist_ok=True)
+    airports, routes = synthetic_openflights(**kwargs)
+    paths = {name: os.path.join(pickle_dir, filename) for name, filename in (
+        ("graph_pkl_file", GRAPH_PKL_FILE), ("airports_pkl_file", AIRPORTS_PKL_FILE), ("routes_pkl_file", ROUTES_PKL_FILE))}
+    airports.to_pickle(paths["airports_pkl_file"])
+    routes.to_pickle(paths["routes_pkl_file"])
+    if os.path.exists(paths["graph_pkl_file"]):
+        os.remove(paths["graph_pkl_file"])
+    return paths
+
+
+def catalog_records(num_cities=None, seed=0):
+    """ City records for a catalog: the real US cities, topped up with synthetic ones to `num_cities`. """
+    records = [{"name": city["name"], **city["metadata"]} for city in load_us_cities()]
+    if num_cities and num_cities > len(records):
+        records += [{"name": city["name"], **city["metadata"]}
+                    for city in generate_cities(num_cities - len(records), seed=seed)]
+    return records[:num_cities] if num_cities else records
+
+
+def text_values(record):
+    """ All string attribute values of a city record (lists and per-season dicts flattened), name excluded. """
+    values = []
+    for key, value in record.items():
+        if key == "name":
+            continue
+        for item in value.values() if isinstance(value, dict) else value if isinstance(value, list) else [value]:
+            if isinstance(item, str):
+                values.append(f"{key}={item}")
+    return values
+
+
+def record_vectors(records, dim=512, seed=0, noise=CITY_VECTOR_NOISE):
+    """
+    Attribute-driven unit vectors for city records of any shape, like `synthetic_city_vectors`:
+    the sum of one fixed random direction per attribute value plus noise.
+    """
+    directions, rng = {}, np.random.default_rng(seed)
+    vectors = np.zeros((len(records), dim), dtype="float32")
+    for row, record in enumerate(records):
+        values = text_values(record)
+        for value in values:
+            if value not in directions:
+                directions[value] = attribute_direction(value, dim, seed)
+            vectors[row] += directions[value]
+        vectors[row] += rng.standard_normal(dim, dtype="float32") * noise * np.sqrt(max(len(values), 1) / dim)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_catalog(catalog_dir, num_cities=10_000, dim=512, index_config=None, seed=0):
+    """ Catalog of `num_cities` cities with synthetic attribute-driven vectors. """
+    records = catalog_records(num_cities, seed=seed)
+    return CityCatalog.build(catalog_dir, record_vectors(records, dim=dim, seed=seed), records, index_config=index_config)
+
+
+def write_user_uploads(media_dir, num_images=4, seed=0, size=(640, 480)):
+    """ The images and prompt `find_recommended_cities` reads: random JPEGs and a synthetic prompt. """
+    from PIL import Image
+
+    image_dir = os.path.join(media_dir, "images")
+    os.makedirs(image_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for i in range(num_images):
+        pixels = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(image_dir, f"upload_{i}.jpg"), quality=90)
+    prompt = generate_sample(random.Random(seed))["prompt"]
+    with open(os.path.join(media_dir, "prompt.txt"), "w") as f:
+        f.write(prompt)
+    return image_dir, prompt
@@ -0,0 +1,74 @@
+"""
+Timing helpers and the JSON result format shared by the benchmark scripts.
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def time_calls(func, repeat, warmup=3, setup=None):
+    """
+    Latency of `repeat` calls in milliseconds, after `warmup` untimed calls.
+
+    Args:
+        func (callable): Called with the result of `setup()` if given, else without arguments.
+        setup (callable, optional): Untimed per-call setup, e.g. picking a random query.
+    """
+    for _ in range(warmup):
+        func(setup()) if setup else func()
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        func(argument) if setup else func()
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return latencies
+
+
+def summarize(name, latencies_ms, **extra):
+    """ One result row: count, mean, p50/p95/p99 and calls per second, plus any extra fields. """
+    latencies_ms = np.asarray(latencies_ms, dtype=float)
+    result = {
+        "name": name,
+        "n": int(len(latencies_ms)),
+        "mean_ms": round(float(latencies_ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 4),
+        "ops_per_s": round(1000 / float(latencies_ms.mean()), 2) if latencies_ms.mean() > 0 else None,
+        **extra,
+    }
+    print(f"{name:40s} p50={result['p50_ms']:9.3f}ms p99={result['p99_ms']:9.3f}ms "
+          f"mean={result['mean_ms']:9.3f}ms n={result['n']}")
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(output_path, suite, results, params):
+    """ Saves results with the commit and machine they were measured on, for `compare.py`. """
+    payload = {
+        "suite": suite,
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    with open(output_path, "w") as f:
+        json.dump(payload, f, indent=2)
+    print(f"\n✅ Results saved to {output_path}")
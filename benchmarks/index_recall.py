@@ -0,0 +1,123 @@
+"""
+Recall-vs-latency benchmark for the city catalog index kinds.
+
+Builds every index kind from `src/faiss_indexing/index_factory.py` over synthetic city vectors
+(`src/synthetic_data/synthetic_city_gen.py`) and reports, for each search parameter setting,
+recall@k against the exact flat index plus p50/p99 single-query latency.
+
+    python benchmarks/index_recall.py --sizes 10000 100000 1000000 --output index_recall.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import faiss
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.faiss_indexing.index_factory import (
+    INDEX_KINDS, METRICS, STORAGE_MODES, resolve_index_config, build_index, train_index, apply_search_params,
+)
+from src.synthetic_data.synthetic_city_gen import generate_cities, synthetic_city_vectors
+
+SEARCH_SWEEPS = {
+    "flat": [{}],
+    "ivf_flat": [{"nprobe": nprobe} for nprobe in (1, 4, 16, 64)],
+    "ivf_pq": [{"nprobe": nprobe} for nprobe in (1, 4, 16, 64)],
+    "hnsw": [{"efSearch": ef} for ef in (16, 32, 64, 128)],
+}
+
+
+def make_queries(vectors, num_queries, seed):
+    """ Queries are perturbed catalog vectors, like users whose taste is close to some cities. """
+    rng = np.random.default_rng(seed + 1)
+    queries = vectors[rng.choice(len(vectors), num_queries, replace=False)].copy()
+    queries += rng.standard_normal(queries.shape, dtype="float32") * (0.5 / np.sqrt(vectors.shape[1]))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries
+
+
+def recall_at_k(found_ids, true_ids):
+    """ Mean fraction of the exact top-k that the approximate search returned. """
+    hits = sum(len(set(found[found >= 0]) & set(true)) for found, true in zip(found_ids, true_ids))
+    return hits / true_ids.size
+
+
+def single_query_latencies(index, queries, k):
+    """ Per-query latency in milliseconds, one `search` call per query like the API does. """
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        index.search(queries[i:i + 1], k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return latencies
+
+
+def index_size_mb(index):
+    """ Serialized size of an index in MB. """
+    return faiss.serialize_index(index).nbytes / 1e6
+
+
+def benchmark_size(n_vectors, dim, k, num_queries, kinds, seed, metric="ip", storage="fp32"):
+    """ Runs every index kind and parameter setting on one catalog size. """
+    print(f"\n=== {n_vectors} vectors, dim {dim}, metric {metric}, storage {storage} ===")
+    vectors = synthetic_city_vectors(generate_cities(n_vectors, seed=seed), dim=dim, seed=seed)
+    queries = make_queries(vectors, num_queries, seed)
+
+    exact = faiss.IndexFlat(dim, METRICS[metric])
+    exact.add(vectors)
+    _, true_ids = exact.search(queries, k)
+
+    results = []
+    for kind in kinds:
+        config = resolve_index_config({"kind": kind, "metric": metric, "storage": storage}, dim, n_vectors)
+        index = build_index(config, dim)
+        start = time.perf_counter()
+        train_index(index, vectors, seed=seed)
+        index.add(vectors)
+        build_s = time.perf_counter() - start
+
+        for params in SEARCH_SWEEPS[kind]:
+            apply_search_params(index, params)
+            _, found_ids = index.search(queries, k)
+            latencies = single_query_latencies(index, queries, k)
+            result = {
+                "n_vectors": n_vectors,
+                "kind": kind,
+                "config": dict(config, **params),
+                "recall_at_k": round(recall_at_k(found_ids, true_ids), 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+                "build_s": round(build_s, 2),
+                "size_mb": round(index_size_mb(index), 1),
+            }
+            results.append(result)
+            print(f"{kind:9s} {json.dumps(params):20s} recall@{k}={result['recall_at_k']:.3f} "
+                  f"p50={result['p50_ms']:.3f}ms p99={result['p99_ms']:.3f}ms "
+                  f"build={result['build_s']}s size={result['size_mb']}MB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k vs latency for the city index kinds.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--kinds", nargs="+", choices=INDEX_KINDS, default=list(INDEX_KINDS))
+    parser.add_argument("--metric", choices=METRICS, default="ip")
+    parser.add_argument("--storage", choices=STORAGE_MODES, default="fp32")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write all results to this JSON file.")
+    args = parser.parse_args()
+
+    all_results = []
+    for n_vectors in args.sizes:
+        all_results.extend(benchmark_size(n_vectors, args.dim, args.k, args.queries, args.kinds, args.seed,
+                                          metric=args.metric, storage=args.storage))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"dim": args.dim, "k": args.k, "metric": args.metric, "storage": args.storage,
+                       "results": all_results}, f, indent=2)
+        print(f"\n✅ Results saved to {args.output}")
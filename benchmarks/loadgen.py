@@ -0,0 +1,233 @@
+"""
+Load generator replaying trip-planning sessions against a running server (see serve.py).
+
+A session is what the front end does for one user: upload_image xN, upload_prompt,
+set_alpha_beta, find_recommended_cities, then find_airport_path through the recommendations.
+
+    closed loop: --users clients each run sessions back to back (optionally paced with --rate)
+    open loop:   sessions arrive as a Poisson process at --rate per second, whatever the server does
+
+Latencies are corrected for coordinated omission: when a session starts later than it was
+scheduled (all clients busy, or the previous session overran its pacing slot), the wait is
+added to its first request, as a real user arriving on schedule would have experienced it.
+
+    python benchmarks/loadgen.py --mode closed --users 8 --duration 60 --output load.json
+    python benchmarks/loadgen.py --mode open --rate 2 --duration 120 --slo find_recommended_cities:p99=5000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.fixtures import load_us_cities, write_user_uploads
+from benchmarks.harness import write_results
+from src.synthetic_data.synthetic_prompt_generator import generate_sample
+from src.tracing import Histogram
+
+SESSION_STEPS = ("upload_image", "upload_prompt", "set_alpha_beta", "find_recommended_cities", "find_airport_path")
+ALPHAS = (0.25, 0.5, 0.75)
+REQUEST_TIMEOUT_S = 120
+
+
+class LatencyRecorder:
+    """ Per-endpoint latency histograms and error counts, shared by all client threads. """
+
+    def __init__(self):
+        self.histograms = {name: Histogram() for name in SESSION_STEPS + ("session",)}
+        self.errors = dict.fromkeys(self.histograms, 0)
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, ok):
+        self.histograms[name].record(seconds)
+        if not ok:
+            with self.lock:
+                self.errors[name] += 1
+
+    def summary(self, wall_s):
+        """ Result rows in the format of `harness.summarize`, plus throughput and error rate. """
+        results = []
+        for name, hist in self.histograms.items():
+            if hist.count == 0:
+                continue
+            result = {
+                "name": name,
+                "n": hist.count,
+                "mean_ms": round(hist.total_s / hist.count * 1000, 4),
+                **{f"p{q}_ms": round(hist.percentile(q / 100) * 1000, 4) for q in (50, 95, 99)},
+                "max_ms": round(hist.max_s * 1000, 4),
+                "throughput_rps": round(hist.count / wall_s, 3),
+                "error_rate": round(self.errors[name] / hist.count, 4),
+            }
+            print(f"{name:28s} n={result['n']:6d} p50={result['p50_ms']:9.1f}ms p95={result['p95_ms']:9.1f}ms "
+                  f"p99={result['p99_ms']:9.1f}ms {result['throughput_rps']:7.2f}/s errors={result['error_rate']:.2%}")
+            results.append(result)
+        return results
+
+
+class SessionScript:
+    """ One user's trip-planning session; `run` replays it and records every request. """
+
+    def __init__(self, base_url, image_paths, city_names, rng):
+        self.base_url = base_url.rstrip("/")
+        self.image_paths = image_paths
+        self.city_names = city_names
+        self.rng = rng
+        self.recommendations = None
+
+    def steps(self, http):
+        """ (endpoint, callable returning the response) in session order. """
+        url = lambda endpoint: f"{self.base_url}/{endpoint}/"
+        for image_path in self.image_paths:
+            def upload(image_path=image_path):
+                with open(image_path, "rb") as f:
+                    return http.post(url("upload_image"), files={"image": f}, timeout=REQUEST_TIMEOUT_S)
+            yield "upload_image", upload
+        prompt = generate_sample(self.rng)["prompt"]
+        yield "upload_prompt", lambda: http.post(url("upload_prompt"), json={"prompt": prompt}, timeout=REQUEST_TIMEOUT_S)
+        alpha = self.rng.choice(ALPHAS)
+        yield "set_alpha_beta", lambda: http.post(url("set_alpha_beta"), json={"alpha": alpha, "beta": 1 - alpha}, timeout=REQUEST_TIMEOUT_S)
+        yield "find_recommended_cities", lambda: http.get(url("find_recommended_cities"), timeout=REQUEST_TIMEOUT_S)
+        yield "find_airport_path", lambda: http.post(url("find_airport_path"), json={"cities": self.route()}, timeout=REQUEST_TIMEOUT_S)
+
+    def route(self):
+        """ From a random departure city through the top two recommendations, if there were any. """
+        recommended = [city for city, _ in (self.recommendations or [])][:2]
+        return [self.rng.choice(self.city_names)] + (recommended or self.rng.sample(self.city_names, 2))
+
+    def run(self, http, recorder, scheduled_start):
+        self.recommendations = None
+        session_start, session_ok = scheduled_start, True
+        for endpoint, send in self.steps(http):
+            start = time.perf_counter()
+            try:
+                response = send()
+                ok = response.status_code < 400
+                if endpoint == "find_recommended_cities" and ok:
+                    self.recommendations = response.json().get("recommended_cities")
+            except (requests.RequestException, ValueError):
+                ok = False
+            # the first request also waited for the session to start
+            recorder.record(endpoint, time.perf_counter() - min(start, scheduled_start), ok)
+            scheduled_start, session_ok = float("inf"), session_ok and ok
+        recorder.record("session", time.perf_counter() - session_start, session_ok)
+
+
+def closed_loop(make_session, recorder, users, duration_s, rate=None):
+    """
+    `users` clients run sessions back to back. With `rate` (sessions per second over all
+    clients) each client keeps a fixed schedule and a late session is charged its delay.
+    """
+    start = time.perf_counter()
+    deadline = start + duration_s
+    interval = users / rate if rate else None
+
+    def client(user):
+        http, session = requests.Session(), make_session(user)
+        scheduled = start + (interval * user / users if interval else 0)
+        while scheduled < deadline:
+            now = time.perf_counter()
+            if interval and scheduled > now:
+                time.sleep(scheduled - now)
+            session.run(http, recorder, scheduled if interval else time.perf_counter())
+            scheduled = scheduled + interval if interval else time.perf_counter()
+
+    threads = [threading.Thread(target=client, args=(user,), daemon=True) for user in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def open_loop(make_session, recorder, rate, duration_s, max_sessions, seed=0):
+    """
+    Sessions arrive as a Poisson process at `rate` per second; at most `max_sessions` run at
+    once and the rest queue, with the queueing charged to their first request.
+    """
+    rng = np.random.default_rng(seed)
+    local = threading.local()
+
+    def run_session(number, scheduled):
+        if not hasattr(local, "http"):
+            local.http = requests.Session()
+        make_session(number).run(local.http, recorder, scheduled)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_sessions) as pool:
+        scheduled, number = start, 0
+        while True:
+            scheduled += rng.exponential(1 / rate)
+            if scheduled >= start + duration_s:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run_session, number, scheduled)
+            number += 1
+    return time.perf_counter() - start
+
+
+def parse_slo(text):
+    """ "endpoint:p99=2000" -> (endpoint, "p99_ms", 2000.0) """
+    endpoint, objective = text.split(":", 1)
+    percentile, limit_ms = objective.split("=", 1)
+    return endpoint, f"{percentile}_ms", float(limit_ms)
+
+
+def check_slos(results, slos):
+    """ Names of the objectives the run missed. """
+    by_name = {result["name"]: result for result in results}
+    missed = []
+    for endpoint, metric, limit_ms in slos:
+        result = by_name.get(endpoint)
+        if result is None or result[metric] > limit_ms:
+            missed.append(f"{endpoint} {metric}={result[metric] if result else 'n/a'} > {limit_ms}")
+    return missed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay trip-planning sessions against a running API.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000/api")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--users", type=int, default=4, help="Closed loop: concurrent clients.")
+    parser.add_argument("--rate", type=float, default=None, help="Sessions per second (required for --mode open).")
+    parser.add_argument("--max-sessions", type=int, default=256, help="Open loop: sessions in flight at most.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to keep starting sessions.")
+    parser.add_argument("--images", type=int, default=3, help="Images uploaded per session.")
+    parser.add_argument("--slo", action="append", default=[], type=parse_slo,
+                        help="Objective like find_recommended_cities:p99=5000 (ms); exit 1 if missed. Repeatable.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write all results to this JSON file.")
+    args = parser.parse_args()
+    if args.mode == "open" and not args.rate:
+        parser.error("--mode open needs --rate")
+
+    city_names = [city["name"] for city in load_us_cities()]
+    with tempfile.TemporaryDirectory() as upload_dir:
+        image_dir, _ = write_user_uploads(upload_dir, num_images=args.images, seed=args.seed)
+        image_paths = [os.path.join(image_dir, name) for name in sorted(os.listdir(image_dir))]
+        make_session = lambda number: SessionScript(args.base_url, image_paths, city_names, random.Random(args.seed + number))
+
+        recorder = LatencyRecorder()
+        if args.mode == "closed":
+            wall_s = closed_loop(make_session, recorder, args.users, args.duration, args.rate)
+        else:
+            wall_s = open_loop(make_session, recorder, args.rate, args.duration, args.max_sessions, args.seed)
+
+    results = recorder.summary(wall_s)
+    if args.output:
+        params = {**vars(args), "slo": [list(slo) for slo in args.slo]}
+        write_results(args.output, f"load_{args.mode}", results, params)
+
+    missed = check_slos(results, args.slo)
+    if missed:
+        print(f"\n❌ Missed SLOs: {'; '.join(missed)}")
+        sys.exit(1)
+    if args.slo:
+        print("\n✅ All SLOs met")
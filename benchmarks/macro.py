@@ -0,0 +1,173 @@
+"""
+Macro-benchmarks driving the Django endpoints through the async test client at fixed concurrency.
+
+Everything runs offline in a temporary working directory: the synthetic OpenFlights pickles, a
+synthetic city catalog, uploaded images and prompt, and the stand-in models (needs torch,
+transformers and clip; `--endpoints` without the recommendation endpoints does not load them).
+
+    python benchmarks/macro.py --concurrency 8 --requests 200 --output macro.json
+    python benchmarks/macro.py --endpoints find_two_city_path find_airport_path --output routes.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(REPO_ROOT)
+from benchmarks.fixtures import build_catalog, load_us_cities, write_openflights_pickles, write_user_uploads
+from benchmarks.harness import summarize, write_results
+
+MODEL_ENDPOINTS = ("find_recommended_cities", "stream_recommended_cities")
+ENDPOINTS = MODEL_ENDPOINTS + ("find_two_city_path", "find_airport_path", "metrics")
+
+
+def prepare_workdir(work_dir, catalog_size, num_airports, num_images, seed, uploads=True):
+    """
+    Lays out the working directory the views expect (Pickles/, Media/) plus a catalog, and
+    makes it the current directory. Must run before the views are imported.
+    """
+    write_openflights_pickles(os.path.join(work_dir, "Pickles"), num_airports=num_airports, seed=seed)
+    catalog_dir = os.path.join(work_dir, "catalog")
+    build_catalog(catalog_dir, num_cities=catalog_size, seed=seed)
+    if uploads:
+        write_user_uploads(os.path.join(work_dir, "Media"), num_images=num_images, seed=seed)
+    os.environ["CITY_CATALOG_DIR"] = catalog_dir
+    os.chdir(work_dir)
+
+
+def setup_django():
+    """ Configures the project settings with a throwaway test database; returns the runner teardown state. """
+    sys.path.insert(0, os.path.join(REPO_ROOT, "API"))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    return runner, runner.setup_databases()
+
+
+def prepare_views(endpoints, result_cache, keep_uploads=True):
+    """
+    Stand-in models, the flight graph built ahead of timing and, with keep_uploads, the same uploads
+    for every request. Without result_cache the semantic result cache and the T5 criteria cache are
+    off, so every request runs the whole pipeline.
+    """
+    from apiresponse import views
+    from src.embedding_extract import implicit_user_embedding
+    from src.faiss_indexing.extract_city import get_result_cache
+
+    if set(endpoints) & set(MODEL_ENDPOINTS):
+        from benchmarks import stand_ins
+        stand_ins.install()
+    if keep_uploads:
+        # every request reads the same uploads, the real views delete them after use
+        views.clear_user_inputs = lambda: None
+    if not result_cache:
+        get_result_cache().threshold = float("inf")
+        implicit_user_embedding.CRITERIA_CACHE_SIZE = 0  # every prompt is the same prompt.txt
+    views.get_flight_search()
+
+
+def request_factory(endpoint, city_names, rng):
+    """ Coroutine function issuing one request to an endpoint; returns the status code. """
+    async def find_recommended_cities(client):
+        return (await client.get("/api/find_recommended_cities/")).status_code
+
+    async def stream_recommended_cities(client):
+        response = await client.get("/api/stream_recommended_cities/", {"departure_location": rng.choice(city_names)})
+        async for _ in response.streaming_content:
+            pass
+        return response.status_code
+
+    async def find_two_city_path(client):
+        body = {"cities": rng.sample(city_names, 4)}
+        return (await client.post("/api/find_two_city_path/", body, content_type="application/json")).status_code
+
+    async def find_airport_path(client):
+        body = {"cities": rng.sample(city_names, 3)}
+        return (await client.post("/api/find_airport_path/", body, content_type="application/json")).status_code
+
+    async def metrics(client):
+        return (await client.get("/api/metrics/")).status_code
+
+    return locals()[endpoint]
+
+
+async def drive(send, concurrency, num_requests):
+    """
+    `num_requests` calls of `send` from `concurrency` clients, each sending its next request as
+    soon as the previous one returns.
+
+    Returns:
+        tuple: (latencies in ms, status codes, wall-clock seconds)
+    """
+    from django.test import AsyncClient
+
+    latencies, statuses, remaining = [], [], [num_requests]
+
+    async def client_loop():
+        client = AsyncClient()
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                status = await send(client)
+            except Exception:
+                status = None
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses.append(status)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def run(endpoints, concurrency, num_requests, warmup, seed):
+    city_names = [city["name"] for city in load_us_cities()]
+    results = []
+    for endpoint in endpoints:
+        send = request_factory(endpoint, city_names, random.Random(seed))
+        asyncio.run(drive(send, 1, warmup))
+        latencies, statuses, wall_s = asyncio.run(drive(send, concurrency, num_requests))
+        errors = sum(status is None or status >= 400 for status in statuses)
+        results.append(summarize(
+            endpoint, np.array(latencies), concurrency=concurrency, throughput_rps=round(len(latencies) / wall_s, 2),
+            error_rate=round(errors / len(statuses), 4),
+        ))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks of the Django endpoints.")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100, help="Timed requests per endpoint.")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--catalog-size", type=int, default=10_000)
+    parser.add_argument("--airports", type=int, default=7000)
+    parser.add_argument("--images", type=int, default=4, help="Uploaded images per recommendation request.")
+    parser.add_argument("--result-cache", action="store_true", help="Keep the semantic result and T5 criteria caches on (identical uploads would all hit them).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write all results to this JSON file.")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_workdir(work_dir, args.catalog_size, args.airports, args.images, args.seed)
+        runner, old_config = setup_django()
+        try:
+            prepare_views(args.endpoints, args.result_cache)
+            results = run(args.endpoints, args.concurrency, args.requests, args.warmup, args.seed)
+        finally:
+            runner.teardown_databases(old_config)
+            os.chdir(REPO_ROOT)
+
+    if output:
+        write_results(output, "macro", results, vars(args))
@@ -0,0 +1,144 @@
+"""
+Micro-benchmarks for each stage of the recommendation and routing pipelines.
+
+Runs offline on CPU against the synthetic OpenFlights fixture, a synthetic city catalog and,
+with --models, the tiny stand-in models.
+
+    python benchmarks/micro.py --output micro.json
+    python benchmarks/micro.py --models --catalog-size 100000 --output micro.json
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.fixtures import build_catalog, load_us_cities, write_openflights_pickles, write_user_uploads
+from benchmarks.harness import summarize, time_calls, write_results
+from src.embedding_extract.implicit_user_embedding import blend_user_embeddings, combine_user_embeddings
+from src.faiss_indexing.extract_city import rank_cities
+from src.faiss_indexing.result_cache import SemanticResultCache
+from FlightScraper import SearchFlights
+
+CRITERIA = {"budget": "budget travel ($20 per day)", "safety_preference": "low-crime area"}
+FILTER = "crime_rating < 60 and population > 100000"
+
+
+def routing_benchmarks(work_dir, num_airports, seed):
+    """ Graph build, single and multi-city path search and nearest-airport lookups. """
+    paths = write_openflights_pickles(os.path.join(work_dir, "Pickles"), num_airports=num_airports, seed=seed)
+    cities = [{"name": city["name"], **city["metadata"]} for city in load_us_cities()]
+    flights = SearchFlights(fetch_from_web=False, cities=cities, **paths)
+    names = [city["name"] for city in cities if city.get("lat") is not None]
+    rng = random.Random(seed)
+
+    results = [summarize("graph_build", time_calls(flights._build_flight_graph, repeat=5, warmup=1),
+                         airports=len(flights.airports_df), routes=len(flights.routes_df))]
+    results.append(summarize("path_search", time_calls(
+        lambda pair: flights.find_path_between_cities(*pair), repeat=200, setup=lambda: rng.sample(names, 2))))
+
+    def multi_city(route):
+        SearchFlights._get_shortest_airport_path.cache_clear()
+        flights.find_path_between_multiple_cities(route)
+    results.append(summarize("path_search_multi_4_cities", time_calls(
+        multi_city, repeat=50, setup=lambda: rng.sample(names, 4))))
+
+    np_rng = np.random.default_rng(seed)
+    results.append(summarize("nearest_airports", time_calls(
+        lambda location: flights.nearest_airports(*location), repeat=1000,
+        setup=lambda: (np_rng.uniform(25, 48), np_rng.uniform(-124, -67)))))
+    return results
+
+
+def index_benchmarks(work_dir, catalog_size, seed):
+    """ Single, batched and filtered FAISS search, re-ranking, embedding blend and the result cache. """
+    catalog = build_catalog(os.path.join(work_dir, "catalog"), num_cities=catalog_size, seed=seed)
+    rng = np.random.default_rng(seed)
+    random_query = lambda: rng.standard_normal(512).astype("float32")
+
+    results = [summarize("index_search_single", time_calls(
+        lambda query: catalog.search(query, 5), repeat=1000, setup=random_query), catalog_size=catalog_size)]
+    batch = rng.standard_normal((1000, 512)).astype("float32")
+    latencies = time_calls(lambda: catalog.search(batch, 5), repeat=10, warmup=1)
+    results.append(summarize("index_search_batch_1000", latencies, catalog_size=catalog_size,
+                             per_query_ms=round(float(np.median(latencies)) / len(batch), 5)))
+    catalog.filter_mask(FILTER)  # compile once
+    results.append(summarize("index_search_filtered", time_calls(
+        lambda query: catalog.search(query, 5, filter=FILTER), repeat=500, setup=random_query), filter=FILTER))
+    results.append(summarize("rank_with_rerank", time_calls(
+        lambda query: rank_cities(query, 5, catalog, criteria=CRITERIA), repeat=500, setup=random_query)))
+
+    image_embedding, text_embedding = random_query(), rng.standard_normal(384).astype("float32")
+    results.append(summarize("embedding_blend", time_calls(
+        lambda: combine_user_embeddings(image_embedding, text_embedding, 0.5, 0.5), repeat=10_000)))
+    image_batch, text_batch = batch, rng.standard_normal((len(batch), 384)).astype("float32")
+    alphas = rng.choice([0.0, 0.25, 0.5, 0.75, 1.0], len(batch))
+    latencies = time_calls(lambda: blend_user_embeddings(image_batch, text_batch, alphas, 1 - alphas), repeat=100)
+    results.append(summarize("embedding_blend_batch_1000", latencies,
+                             per_user_ms=round(float(np.median(latencies)) / len(batch), 5)))
+
+    cache = SemanticResultCache()
+    for _ in range(1000):
+        cache.put(random_query(), [("city", 1.0)], version=catalog.version)
+    query = random_query()
+    cache.put(query, [("city", 1.0)], version=catalog.version)
+    results.append(summarize("result_cache_hit", time_calls(
+        lambda: cache.get(query, version=catalog.version), repeat=1000), entries=1001))
+    return results
+
+
+def decode_benchmarks(work_dir, seed, width=8000, height=6000):
+    """ Decoding a large phone photo at full resolution vs. draft-reduced to the CLIP input size. """
+    from PIL import Image
+    from src.embedding_extract.image_embeddings_extraction import decode_image
+
+    rng = np.random.default_rng(seed)
+    photo_path = os.path.join(work_dir, "photo.jpg")
+    noise = Image.fromarray(rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8))
+    noise.resize((width, height), Image.BICUBIC).save(photo_path, quality=90)
+
+    return [
+        summarize("image_decode_full", time_calls(lambda: Image.open(photo_path).convert("RGB"), repeat=5, warmup=1),
+                  pixels=width * height),
+        summarize("image_decode_draft", time_calls(lambda: decode_image(photo_path), repeat=5, warmup=1),
+                  pixels=width * height),
+    ]
+
+
+def model_benchmarks(work_dir, seed):
+    """ CLIP encode, T5 extraction and MiniLM encode with the stand-in models. """
+    from benchmarks import stand_ins
+    from src.embedding_extract.image_embeddings_extraction import encode_image_files
+    from src.model.evaluate import extract_user_criteria, user_preferences_to_embedding
+
+    stand_ins.install()
+    image_dir, prompt = write_user_uploads(os.path.join(work_dir, "Media"), num_images=4, seed=seed)
+    image_paths = [os.path.join(image_dir, name) for name in sorted(os.listdir(image_dir))]
+    criteria = extract_user_criteria(prompt)
+
+    return [
+        summarize("clip_encode_4_images", time_calls(lambda: encode_image_files(image_paths), repeat=10, warmup=1)),
+        summarize("t5_extract_criteria", time_calls(lambda: extract_user_criteria(prompt), repeat=5, warmup=1)),
+        summarize("minilm_encode_criteria", time_calls(lambda: user_preferences_to_embedding(criteria), repeat=50)),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage micro-benchmarks.")
+    parser.add_argument("--catalog-size", type=int, default=10_000)
+    parser.add_argument("--airports", type=int, default=7000)
+    parser.add_argument("--models", action="store_true", help="Also time the stand-in models (needs torch, transformers, clip).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write all results to this JSON file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = routing_benchmarks(work_dir, args.airports, args.seed)
+        results += index_benchmarks(work_dir, args.catalog_size, args.seed)
+        results += decode_benchmarks(work_dir, args.seed)
+        if args.models:
+            results += model_benchmarks(work_dir, args.seed)
+
+    if args.output:
+        write_results(args.output, "micro", results, vars(args))
@@ -0,0 +1,129 @@
+"""
+Quality and latency of multi-vector users (late interaction, max / sum) against the mean-pooled
+single vector.
+
+Each synthetic user has several distinct tastes (a beach trip, a mountain trip, ...), each the
+vector of a random catalog city, and uploads a few noisy views of every taste (photos,
+criteria). The cities relevant to the user are the exact top-k neighbours of any of its
+tastes. Reported per representation:
+
+    precision@k      fraction of the returned cities that are relevant
+    taste_coverage   fraction of the user's tastes with at least one of their cities returned
+
+plus the p50/p99 latency of `rank_cities`, and the slowdown of each multi-vector mode over
+the mean vector (the API budget is 2x, see --max-slowdown).
+
+    python benchmarks/multi_vector.py --catalog-size 100000 --tastes 2 --output multi_vector.json
+"""
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.fixtures import catalog_records, record_vectors
+from benchmarks.harness import summarize, time_calls, write_results
+from src.embedding_extract.implicit_user_embedding import combine_user_vectors, combine_user_embeddings
+from src.faiss_indexing.city_catalog import CityCatalog
+from src.faiss_indexing.extract_city import rank_cities
+from src.faiss_indexing.multi_vector import AGGREGATIONS, late_interaction_search
+
+VIEW_NOISE = 0.5  # norm of the perturbation of each view relative to its unit taste vector
+LATENCY_ROUNDS = 5
+
+
+def make_users(vectors, num_users, tastes, views_per_taste, k, seed):
+    """
+    Returns:
+        list: (sub-vectors (tastes * views_per_taste, dim), relevant city ids per taste) per user.
+    """
+    rng = np.random.default_rng(seed + 1)
+    dim = vectors.shape[1]
+    users = []
+    for _ in range(num_users):
+        taste_vectors = vectors[rng.choice(len(vectors), tastes, replace=False)]
+        relevant = [set(np.argpartition(-(vectors @ taste), k)[:k]) for taste in taste_vectors]
+        views = np.repeat(taste_vectors, views_per_taste, axis=0)
+        views += rng.standard_normal(views.shape, dtype="float32") * (VIEW_NOISE / np.sqrt(dim))
+        users.append((views / np.linalg.norm(views, axis=1, keepdims=True), relevant))
+    return users
+
+
+def quality(found_ids, relevant):
+    """ (precision@k, taste coverage) of one user's result. """
+    found = set(int(city_id) for city_id in found_ids if city_id >= 0)
+    union = set().union(*relevant)
+    return len(found & union) / max(len(found_ids), 1), float(np.mean([bool(found & taste) for taste in relevant]))
+
+
+def run(catalog_size, num_users, tastes, views_per_taste, k, seed, work_dir):
+    records = catalog_records(catalog_size, seed=seed)
+    vectors = record_vectors(records, seed=seed)
+    catalog = CityCatalog.build(work_dir, vectors, records)
+    users = make_users(vectors, num_users, tastes, views_per_taste, k, seed)
+
+    representations = {"mean": lambda views: combine_user_embeddings(views.mean(axis=0), None, 1, 0)}
+    for aggregation in AGGREGATIONS:
+        representations[aggregation] = lambda views, aggregation=aggregation: combine_user_vectors(
+            views, None, 1, 0, aggregation
+        )
+
+    queries, quality_scores = {}, {}
+    for name, represent in representations.items():
+        queries[name] = [represent(views) for views, _ in users]
+        scores = []
+        for query, (_, relevant) in zip(queries[name], users):
+            if name == "mean":
+                _, found_ids = catalog.search(query, k)
+            else:
+                _, found_ids = late_interaction_search(catalog, query.vectors, k, query.weights, query.aggregation)
+            scores.append(quality(found_ids[0], relevant))
+        quality_scores[name] = np.mean(scores, axis=0)
+
+    # time the representations in interleaved rounds so machine drift affects all of them alike
+    latencies, rng = {name: [] for name in representations}, np.random.default_rng(seed)
+    for _ in range(LATENCY_ROUNDS):
+        for name in representations:
+            latencies[name].extend(time_calls(
+                lambda query: rank_cities(query, k, catalog), repeat=max(200, num_users) // LATENCY_ROUNDS,
+                setup=lambda: queries[name][rng.integers(num_users)]
+            ))
+
+    results = []
+    for name in representations:
+        precision, coverage = quality_scores[name]
+        results.append(summarize(f"rank_{name}", latencies[name], precision_at_k=round(float(precision), 4),
+                                 taste_coverage=round(float(coverage), 4), sub_queries=tastes * views_per_taste))
+
+    mean_p50 = results[0]["p50_ms"]
+    for result in results[1:]:
+        result["slowdown_vs_mean"] = round(result["p50_ms"] / mean_p50, 2)
+    print(f"\n{'representation':16s} {'precision@' + str(k):>13s} {'coverage':>9s} {'p50 ms':>9s} {'slowdown':>9s}")
+    for result in results:
+        print(f"{result['name']:16s} {result['precision_at_k']:13.3f} {result['taste_coverage']:9.3f} "
+              f"{result['p50_ms']:9.3f} {result.get('slowdown_vs_mean', 1.0):9.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-vector (late interaction) vs mean-pooled users.")
+    parser.add_argument("--catalog-size", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--tastes", type=int, default=2, help="Distinct tastes per user.")
+    parser.add_argument("--views", type=int, default=3, help="Sub-vectors (photos, criteria) per taste.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-slowdown", type=float, default=None,
+                        help="Exit with status 1 if a multi-vector mode's p50 exceeds the mean vector's by this factor.")
+    parser.add_argument("--output", default=None, help="Write all results to this JSON file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run(args.catalog_size, args.users, args.tastes, args.views, args.k, args.seed, work_dir)
+
+    if args.output:
+        write_results(args.output, "multi_vector", results, vars(args))
+    too_slow = [r["name"] for r in results if args.max_slowdown and r.get("slowdown_vs_mean", 1) > args.max_slowdown]
+    if too_slow:
+        print(f"❌ Slower than {args.max_slowdown}x the mean vector: {', '.join(too_slow)}")
+        sys.exit(1)
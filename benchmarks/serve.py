@@ -0,0 +1,57 @@
+"""
+Runs the API on a local port with the stand-in models and the offline fixtures, as a target for loadgen.py.
+
+Serves through uvicorn (ASGI) when it is installed, otherwise through Django's threaded WSGI server.
+The database is a throwaway in-memory test database and the uploads are cleared after every
+recommendation, exactly like in production.
+
+    python benchmarks/serve.py --port 8000
+"""
+import argparse
+import os
+import sys
+import tempfile
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.macro import ENDPOINTS, REPO_ROOT, prepare_views, prepare_workdir, setup_django
+
+
+def serve(host, port):
+    try:
+        import uvicorn
+    except ImportError:
+        uvicorn = None
+
+    if uvicorn is not None:
+        from django.core.asgi import get_asgi_application
+        uvicorn.run(get_asgi_application(), host=host, port=port, log_level="warning")
+    else:
+        from django.core.servers.basehttp import run
+        from django.core.wsgi import get_wsgi_application
+        print("⚠️ uvicorn is not installed, serving through the threaded WSGI server")
+        run(host, port, get_wsgi_application(), threading=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the API offline with stand-in models.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--catalog-size", type=int, default=10_000)
+    parser.add_argument("--airports", type=int, default=7000)
+    parser.add_argument("--result-cache", action="store_true", help="Keep the semantic result and T5 criteria caches on.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_workdir(work_dir, args.catalog_size, args.airports, num_images=0, seed=args.seed, uploads=False)
+        runner, old_config = setup_django()
+        from django.conf import settings
+        settings.ALLOWED_HOSTS = [args.host, "localhost"]  # the test environment only allows "testserver"
+        try:
+            prepare_views(ENDPOINTS, args.result_cache, keep_uploads=False)
+            print(f"✅ Serving on http://{args.host}:{args.port}/api/")
+            serve(args.host, args.port)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            runner.teardown_databases(old_config)
+            os.chdir(REPO_ROOT)
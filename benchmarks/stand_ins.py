@@ -0,0 +1,132 @@
+"""
+Tiny randomly initialized stand-ins for the T5, MiniLM and CLIP models.
+
+They have the real architectures (a 2-layer T5, a 1-layer BERT with MiniLM's 384-d output
+and a 2-layer ViT CLIP with a 512-d embedding) but no pretrained weights or tokenizer files,
+so the pipeline runs offline on CPU with realistic shapes. `install()` swaps them in for the
+loaders in `evaluate.py` and `image_embeddings_extraction.py`.
+"""
+import os
+import random
+import re
+import sys
+import zlib
+import numpy as np
+import torch
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.synthetic_data.synthetic_prompt_generator import generate_sample
+
+SEED = 0
+T5_VOCAB_SIZE = 4096
+MINILM_VOCAB_SIZE = 8192
+MINILM_DIM = 384
+CLIP_RESOLUTION = 224
+
+
+class HashTokenizer:
+    """
+    Word-level tokenizer hashing words into a fixed vocabulary (0 = pad, 1 = eos, 2 = unk).
+
+    Callable like a Hugging Face tokenizer for the arguments the pipeline uses.
+    """
+
+    def __init__(self, vocab_size):
+        self.vocab_size = vocab_size
+
+    def encode_text(self, text, max_length=512):
+        words = re.findall(r"\w+|[^\w\s]", text.lower())[:max_length - 1]
+        return [3 + zlib.crc32(word.encode()) % (self.vocab_size - 3) for word in words] + [1]
+
+    def __call__(self, texts, return_tensors="pt", padding=True, truncation=True, max_length=512):
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        ids = [self.encode_text(text, max_length) for text in texts]
+        width = max(len(row) for row in ids)
+        input_ids = torch.zeros((len(ids), width), dtype=torch.long)
+        attention_mask = torch.zeros((len(ids), width), dtype=torch.long)
+        for row, row_ids in enumerate(ids):
+            input_ids[row, :len(row_ids)] = torch.tensor(row_ids)
+            attention_mask[row, :len(row_ids)] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+class T5StandInTokenizer(HashTokenizer):
+    """
+    Decoding random token ids yields nothing parseable, so `decode` returns a structured output
+    in the fine-tuned model's format, drawn from the synthetic generator and seeded by the ids.
+    """
+
+    def decode(self, ids, skip_special_tokens=True):
+        sample = generate_sample(random.Random(zlib.crc32(np.asarray(ids).tobytes())))
+        return ", ".join(f'"{key}": "{value}"' for key, value in sample["output"].items())
+
+
+def stand_in_t5():
+    """ (model, tokenizer, device) like `evaluate.load_t5_model`, with a 2-layer random T5. """
+    from transformers import T5Config, T5ForConditionalGeneration
+
+    torch.manual_seed(SEED)
+    config = T5Config(
+        vocab_size=T5_VOCAB_SIZE, d_model=64, d_kv=16, d_ff=128, num_layers=2, num_decoder_layers=2,
+        num_heads=4, pad_token_id=0, eos_token_id=1, decoder_start_token_id=0,
+    )
+    model = T5ForConditionalGeneration(config)
+    model.eval()
+    return model, T5StandInTokenizer(T5_VOCAB_SIZE), torch.device("cpu")
+
+
+class StandInSentenceModel:
+    """ The `SentenceTransformer` methods the pipeline uses, over a 1-layer random BERT with mean pooling. """
+
+    def __init__(self):
+        from transformers import BertConfig, BertModel
+
+        torch.manual_seed(SEED)
+        config = BertConfig(
+            vocab_size=MINILM_VOCAB_SIZE, hidden_size=MINILM_DIM, num_hidden_layers=1, num_attention_heads=12,
+            intermediate_size=4 * MINILM_DIM, max_position_embeddings=512,
+        )
+        self.model = BertModel(config)
+        self.model.eval()
+        self.tokenizer = HashTokenizer(MINILM_VOCAB_SIZE)
+
+    def get_sentence_embedding_dimension(self):
+        return MINILM_DIM
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False):
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(sentences[start:start + batch_size], max_length=256)
+            with torch.no_grad():
+                hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).float()
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1)
+            if normalize_embeddings:
+                pooled = torch.nn.functional.normalize(pooled, dim=-1)
+            batches.append(pooled.numpy())
+        return np.concatenate(batches) if batches else np.empty((0, MINILM_DIM), dtype="float32")
+
+
+def stand_in_clip():
+    """ (model, preprocess) like `load_clip_model`, with a 2-layer random ViT CLIP. """
+    from clip.clip import _transform
+    from clip.model import CLIP
+
+    torch.manual_seed(SEED)
+    model = CLIP(
+        embed_dim=512, image_resolution=CLIP_RESOLUTION, vision_layers=2, vision_width=64, vision_patch_size=32,
+        context_length=77, vocab_size=49408, transformer_width=64, transformer_heads=1, transformer_layers=1,
+    )
+    model.eval()
+    return model, _transform(CLIP_RESOLUTION)
+
+
+def install():
+    """ Replaces the model loaders of the pipeline with the stand-ins (once per process). """
+    from functools import lru_cache
+    import src.embedding_extract.image_embeddings_extraction as image_embeddings_extraction
+    import src.model.evaluate as evaluate
+
+    t5, sentence_model, clip_model = lru_cache(None)(stand_in_t5), StandInSentenceModel(), lru_cache(None)(stand_in_clip)
+    evaluate.load_t5_model = lambda *args, **kwargs: t5()
+    evaluate.load_sentence_model = lambda *args, **kwargs: sentence_model
+    image_embeddings_extraction.load_clip_model = lambda *args, **kwargs: clip_model()
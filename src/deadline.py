@@ -0,0 +1,70 @@
+"""
+Per-request time budgets.
+
+    token = start_deadline(5.0)
+    try:
+        ...  # stages call current_deadline() and pick cheaper paths when time is short
+    finally:
+        end_deadline(token)
+
+The deadline lives in a context variable, so like the request trace it follows the request
+into executor threads bound with `tracing.in_context`. Stages record the path they took on it
+(`note`), which the view reports back with the response.
+"""
+import contextvars
+import time
+
+_current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """ The request ran out of time before any usable result was available. """
+
+
+class Deadline:
+    """ A point in time the request must answer by, and the pipeline paths taken to get there. """
+
+    def __init__(self, budget_s):
+        self.budget_s = budget_s
+        self.start = time.monotonic()
+        self.expires_at = self.start + budget_s
+        self.path = {}
+
+    def remaining(self):
+        """ Seconds left, never negative. """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def note(self, stage, path):
+        """ Records which path a stage took, e.g. note("text", "rule_based"). """
+        self.path[stage] = path
+
+    def report(self):
+        """ The paths taken and the time used, for the response. """
+        return {**self.path, "budget_ms": round(self.budget_s * 1000), "elapsed_ms": round(self.elapsed() * 1000, 1)}
+
+
+def start_deadline(budget_s):
+    """ Gives the current request `budget_s` seconds; returns a token for `end_deadline`. """
+    return _current_deadline.set(Deadline(budget_s))
+
+
+def end_deadline(token):
+    _current_deadline.reset(token)
+
+
+def current_deadline():
+    """ The current request's Deadline, None outside a request with a budget. """
+    return _current_deadline.get()
+
+
+def note(stage, path):
+    """ `Deadline.note` on the current deadline, if there is one. """
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.note(stage, path)
@@ -1,55 +1,197 @@
+import hashlib
+import multiprocessing
 import os
-import clip
-import torch
+import sys
+import threading
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from PIL import Image
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.tracing import span
 
-def extract_clip_image_embeddings(image_folder, model_name="ViT-B/16", device=None):
+CLIP_MODEL_NAME = "ViT-B/16"
+CLIP_INPUT_SIZE = 224  # CLIP resizes the shorter side to this and center-crops, nothing finer survives
+
+# Largest image accepted, checked from the header before any pixel is decoded
+MAX_SOURCE_PIXELS = int(os.environ.get("MAX_SOURCE_PIXELS", 50_000_000))
+# Processes decoding images in parallel; 0 decodes in the calling thread. Web workers decode in
+# their own thread by default, inference workers set a pool on their own cores (`set_decode_workers`),
+# so the decoders on a box never outnumber its cores however many web workers there are.
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", 0))
+
+_decode_workers = DECODE_WORKERS
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+def default_device():
+    """ Returns 'cuda' when available, otherwise 'cpu'. """
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+@lru_cache(maxsize=None)
+def load_clip_model(model_name=CLIP_MODEL_NAME, device=None):
     """
-    Extracts CLIP image embeddings from all images in a given folder and returns the aggregated 512D embedding.
+    Loads a CLIP model and its preprocessing transform once per process.
+
+    Returns:
+        tuple: (model, preprocess)
+    """
+    import clip
+
+    with span("model_load.clip"):
+        model, preprocess = clip.load(model_name, device or default_device())
+        model.eval()
+    return model, preprocess
+
+def decode_image(image_path, min_side=CLIP_INPUT_SIZE, max_pixels=MAX_SOURCE_PIXELS):
+    """
+    Opens an image scaled down so that its shorter side is `min_side`. JPEGs are reduced in the
+    DCT domain while decoding (`draft`), so a 48MP photo is never held at full resolution.
+
+    Raises:
+        ValueError: If the image has more than `max_pixels` pixels.
+    """
+    with Image.open(image_path) as image:  # reads the header only
+        width, height = image.size
+        if width * height > max_pixels:
+            raise ValueError(f"{width}x{height} image exceeds {max_pixels} pixels")
+        scale = min_side / min(width, height)
+        if scale >= 1:
+            return image.convert("RGB")
+        target = (max(min_side, round(width * scale)), max(min_side, round(height * scale)))
+        image.draft("RGB", target)  # largest 1/2, 1/4 or 1/8 JPEG reduction still at least `target`
+        image = image.convert("RGB")
+    return image if image.size == target else image.resize(target, Image.BICUBIC)
+
+def decode_or_error(image_path):
+    """ `decode_image` for the decode pool. Returns (image, None) or (None, error message). """
+    try:
+        return decode_image(image_path), None
+    except Exception as e:
+        return None, str(e)
+
+def set_decode_workers(workers):
+    """ Sets the size of this process's decode pool, before its first use. """
+    global _decode_workers
+    _decode_workers = workers
+
+def get_decode_pool():
+    """ The process-wide image decoding pool; spawned so no torch or OpenMP state is forked. """
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ProcessPoolExecutor(max_workers=_decode_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _decode_pool
+
+def discard_decode_pool(pool):
+    """ Shuts down a broken pool; the next call starts a fresh one unless another thread already did. """
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is pool:
+            _decode_pool = None
+    pool.shutdown(wait=False)
+
+def decode_images(image_paths):
+    """
+    Decodes images in the decode pool, or in this thread for a single image or no decode workers.
+
+    Returns:
+        list: (image, error message) per path, one of them None.
+    """
+    if _decode_workers <= 0 or len(image_paths) < 2:
+        return [decode_or_error(image_path) for image_path in image_paths]
+    pool = get_decode_pool()
+    try:
+        return list(pool.map(decode_or_error, image_paths))
+    except BrokenProcessPool:
+        # A decoder died (out of memory on a pathological file)
+        discard_decode_pool(pool)
+        return [(None, "decoder process died")] * len(image_paths)
+
+def unique_image_files(image_paths):
+    """ Drops files whose content (SHA-256) repeats an earlier one, so a photo uploaded twice counts once. """
+    seen, unique_paths = set(), []
+    for image_path in image_paths:
+        try:
+            with open(image_path, "rb") as f:
+                digest = hashlib.file_digest(f, "sha256").digest()
+        except OSError:
+            unique_paths.append(image_path)  # reported when decoding
+            continue
+        if digest not in seen:
+            seen.add(digest)
+            unique_paths.append(image_path)
+    return unique_paths
+
+def encode_image_files(image_paths, model_name=CLIP_MODEL_NAME, device=None, batch_size=32):
+    """
+    Encodes a list of image files with CLIP in batches.
+
+    Files that cannot be decoded or exceed MAX_SOURCE_PIXELS are skipped and reported.
 
     Args:
-        image_folder (str): Path to the folder containing images.
-        model_name (str): CLIP model variant to use. Default is 'ViT-B/32'.
+        image_paths (list): Paths of the images to encode.
+        model_name (str): CLIP model variant to use.
         device (str, optional): Device to use ('cuda' or 'cpu'). Default is auto-detect.
+        batch_size (int): Number of images per forward pass.
 
     Returns:
-        np.ndarray: Aggregated 512D image embedding (mean-pooled across all images).
+        tuple: (list of successfully encoded paths, np.ndarray of normalized embeddings (N, 512))
     """
-    # Auto-detect device
-    if device is None:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+    import torch
 
-    # Load CLIP model
-    model, preprocess = clip.load(model_name, device)
+    device = device or default_device()
+    model, preprocess = load_clip_model(model_name, device)
 
-    # Initialize list to store embeddings
-    image_embeddings = []
+    encoded_paths, batches = [], []
+    for start in range(0, len(image_paths), batch_size):
+        batch_paths, batch_inputs = [], []
+        with span("image_decode"):
+            paths = image_paths[start:start + batch_size]
+            for image_path, (image, error) in zip(paths, decode_images(paths)):
+                if error is not None:
+                    print(f"Error processing {os.path.basename(image_path)}: {error}")
+                    continue
+                batch_inputs.append(preprocess(image))
+                batch_paths.append(image_path)
 
-    # Process each image in the folder
-    for filename in os.listdir(image_folder):
-        image_path = os.path.join(image_folder, filename)
+        if not batch_inputs:
+            continue
 
-        try:
-            # Open and preprocess the image
-            image = Image.open(image_path).convert("RGB")
-            image_input = preprocess(image).unsqueeze(0).to(device)
+        # Compute the image embeddings
+        with span("clip_encode"), torch.no_grad():
+            image_features = model.encode_image(torch.stack(batch_inputs).to(device))
+            image_features /= image_features.norm(dim=-1, keepdim=True)  # Normalize embedding
 
-            # Compute the image embedding
-            with torch.no_grad():
-                image_feature = model.encode_image(image_input)
-                image_feature /= image_feature.norm(dim=-1, keepdim=True)  # Normalize embedding
+        encoded_paths.extend(batch_paths)
+        batches.append(image_features.float().cpu().numpy())
 
-            # Convert to numpy and store
-            image_embeddings.append(image_feature.cpu().numpy().flatten())
+    embeddings = np.concatenate(batches) if batches else np.empty((0, 0), dtype="float32")
+    return encoded_paths, embeddings
 
-            #print(f"Processed: {filename}")
+def extract_clip_image_embeddings(image_folder, model_name=CLIP_MODEL_NAME, device=None, multi_vector=False):
+    """
+    Extracts CLIP image embeddings from all images in a given folder and returns the aggregated 512D embedding.
+    Identical files are encoded once.
+
+    Args:
+        image_folder (str): Path to the folder containing images.
+        model_name (str): CLIP model variant to use. Default is 'ViT-B/16'.
+        device (str, optional): Device to use ('cuda' or 'cpu'). Default is auto-detect.
+        multi_vector (bool): Return the (num_images, 512) per-image embeddings instead of their mean.
 
-        except Exception as e:
-            print(f"Error processing {filename}: {e}")
+    Returns:
+        np.ndarray: Aggregated 512D image embedding (mean-pooled across all images).
+    """
+    image_paths = unique_image_files([os.path.join(image_folder, filename) for filename in sorted(os.listdir(image_folder))])
+    _, image_embeddings = encode_image_files(image_paths, model_name=model_name, device=device)
+    if multi_vector:
+        return image_embeddings if len(image_embeddings) else None
 
     # Aggregate embeddings (mean-pooling across all images)
-    if image_embeddings:
+    if len(image_embeddings):
         aggregated_embedding = np.mean(image_embeddings, axis=0)  # Shape: (512,)
     else:
         aggregated_embedding = None
@@ -66,4 +208,4 @@ if image_embedding_vector is not None:
     #print("Sample Embedding Values:", image_embedding_vector[:5])  # Print first 5 values
 else:
     print("⚠️ No valid images found in the folder.")
-'''
\ No newline at end of file
+'''
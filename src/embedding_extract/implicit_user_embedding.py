@@ -1,67 +1,348 @@
 import os
-from datasets import load_from_disk
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import numpy as np
 from datetime import datetime
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-import sys
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.deadline import DeadlineExceeded, current_deadline, note
 from src.embedding_extract.image_embeddings_extraction import extract_clip_image_embeddings
-from src.model.evaluate import evaluate_t5
+from src.model.evaluate import evaluate_t5, rule_based_criteria, user_preferences_to_embedding
+from src.embedding_extract.inference_pool import get_inference_client
+from src.tracing import in_context
+
+logger = logging.getLogger(__name__)
 
 # Get the absolute path of the current script's directory
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-def get_user_overall_embedding(image_folder_path, prompt, alpha, beta):
+# Threads shared by all requests for the CPU-bound model stages; bounded so concurrent
+# requests queue instead of oversubscribing the cores
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", max(2, min(8, os.cpu_count() or 1))))
+
+
+# Time kept back from the model stages for blending, ranking and answering (seconds)
+RANKING_RESERVE_S = float(os.environ.get("RANKING_RESERVE_S", 0.25))
+# T5 is not started with less time than this left; the prompt is parsed by rules instead
+T5_MIN_BUDGET_S = float(os.environ.get("T5_MIN_BUDGET_S", 1.0))
+# Prompts whose complete (uncapped) T5 result is kept, so a prompt sent again skips T5
+CRITERIA_CACHE_SIZE = int(os.environ.get("CRITERIA_CACHE_SIZE", 1024))
+
+_criteria_cache = OrderedDict()
+_criteria_cache_lock = threading.Lock()
+
+# A user kept as several sub-query vectors (one per image and per criterion) with their weights,
+# scored by late interaction with `aggregation` ("max" or "sum", see faiss_indexing/multi_vector.py)
+UserVectors = namedtuple("UserVectors", ["vectors", "weights", "aggregation"])
+
+
+class NoUserEmbedding(ValueError):
+    """ Neither the images nor the prompt gave an embedding to recommend from. """
+
+
+@lru_cache(maxsize=None)
+def get_inference_executor():
+    """ The process-wide bounded executor for image encoding, T5 extraction and other blocking work. """
+    return ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+
+
+def cached_text_embedding(prompt, multi_vector=False):
+    """ (embedding, criteria) of an earlier complete T5 run on the same prompt, or None. """
+    with _criteria_cache_lock:
+        if (prompt, multi_vector) in _criteria_cache:
+            _criteria_cache.move_to_end((prompt, multi_vector))
+            return _criteria_cache[prompt, multi_vector]
+    return None
+
+
+def cache_text_embedding(prompt, result, multi_vector=False):
+    with _criteria_cache_lock:
+        _criteria_cache[prompt, multi_vector] = result
+        _criteria_cache.move_to_end((prompt, multi_vector))
+        while len(_criteria_cache) > CRITERIA_CACHE_SIZE:
+            _criteria_cache.popitem(last=False)
+
+
+def rule_based_text_embedding(prompt, client=None, multi_vector=False):
+    """ (embedding or None, criteria) from the rule-based parse and MiniLM, no T5. """
+    criteria = rule_based_criteria(prompt)
+    if not criteria:
+        return None, criteria
+    if client:
+        return client.criteria_embedding(criteria, multi_vector=multi_vector), criteria
+    return user_preferences_to_embedding(criteria, multi_vector=multi_vector), criteria
+
+
+def text_embedding_within_deadline(prompt, client=None, multi_vector=False):
     """
-    Extracts user overall embedding by running image and text embedding extraction in parallel.
-    If either image or text folder is missing, only the available embedding is used.
+    (embedding, criteria) for the prompt by the best path the current deadline still allows,
+    decided when the step actually starts (after any wait in the executor queue):
+
+    - "cached": an earlier complete T5 result for the same prompt
+    - "t5": full T5 generation; "t5_capped" when generation was cut at the time left
+    - "rule_based": vocabulary matching, when too little time is left to start T5
+
+    The path taken is noted on the deadline. Without a deadline T5 always runs to completion.
     """
-    start_time = datetime.now()
-    image_embedding, text_embedding = None, None
+    cached = cached_text_embedding(prompt, multi_vector)
+    if cached is not None:
+        note("text", "cached")
+        return cached
 
+    deadline = current_deadline()
+    max_time = None if deadline is None else deadline.remaining() - RANKING_RESERVE_S
+    if max_time is not None and max_time < T5_MIN_BUDGET_S:
+        note("text", "rule_based")
+        return rule_based_text_embedding(prompt, client, multi_vector)
+
+    start = time.perf_counter()
+    if client:
+        embedding, criteria = client.text_embedding(prompt, max_time=max_time, multi_vector=multi_vector)
+    else:
+        embedding, criteria = evaluate_t5(prompt, return_criteria=True, max_time=max_time, multi_vector=multi_vector)
+    if max_time is not None and time.perf_counter() - start >= max_time:
+        note("text", "t5_capped")  # partial criteria, not cached
+    else:
+        note("text", "t5")
+        cache_text_embedding(prompt, (embedding, criteria), multi_vector)
+    return embedding, criteria
+
+
+def embedding_tasks(image_folder_path, prompt, multi_vector=False):
+    """
+    The image and text extraction steps that apply to a request, each None when its input is missing.
+    They run on the inference pool when INFERENCE_SOCKET_DIR is set, in this process otherwise,
+    and the text step adapts to the request's deadline (see `text_embedding_within_deadline`).
+    With `multi_vector` they return per-image / per-criterion vectors instead of their means.
+
+    Returns:
+        tuple: (image task returning an embedding, text task returning (embedding, criteria))
+    """
+    client = get_inference_client()
     # Convert relative paths to absolute paths
-    image_folder_path = os.path.abspath(os.path.join(SCRIPT_DIR, image_folder_path))
+    if image_folder_path:
+        image_folder_path = os.path.abspath(os.path.join(SCRIPT_DIR, image_folder_path))
     # Extract image embedding only if the folder exists
-    if os.path.exists(image_folder_path):
+    if image_folder_path and os.path.exists(image_folder_path):
         def extract_image_embedding():
-            return extract_clip_image_embeddings(image_folder_path)
+            if client:
+                return client.image_embedding(image_folder_path, multi_vector=multi_vector)
+            return extract_clip_image_embeddings(image_folder_path, multi_vector=multi_vector)
     else:
         extract_image_embedding = None  # No image embedding
-        print("No image folder found")
-    # Extract text embedding only if the text dataset exists
+        logger.debug("No image folder found")
+    # Extract text embedding only if there is a prompt
     if prompt:
         def extract_text_embedding():
-            return evaluate_t5(prompt)
-        print(prompt)
+            return text_embedding_within_deadline(prompt, client, multi_vector)
     else:
         extract_text_embedding = None  # No text embedding
-        print("No prompt provided")
+        logger.debug("No prompt provided")
+    return extract_image_embedding, extract_text_embedding
 
-    # Run tasks in parallel if both exist
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        future_image = executor.submit(extract_image_embedding) if extract_image_embedding else None
-        future_text = executor.submit(extract_text_embedding) if extract_text_embedding else None
 
-        image_embedding = future_image.result() if future_image else None
-        text_embedding = future_text.result() if future_text else None
+def get_user_overall_embedding(image_folder_path, prompt, alpha, beta, return_criteria=False, aggregation=None):
+    """
+    Extracts user overall embedding by running image and text embedding extraction in parallel.
+    If either image or text folder is missing, only the available embedding is used.
+
+    With `return_criteria`, returns (embedding, criteria) where criteria is the dict of travel
+    criteria extracted by T5 (empty without a prompt).
+
+    With `aggregation` ("max" or "sum"), the user is returned as `UserVectors` instead: every
+    image and criterion vector, to be scored by late interaction rather than averaged.
+    """
+    extract_image_embedding, extract_text_embedding = embedding_tasks(
+        image_folder_path, prompt, multi_vector=aggregation is not None
+    )
+
+    # Run tasks in parallel on the shared executor if both exist
+    executor = get_inference_executor()
+    future_image = executor.submit(in_context(extract_image_embedding)) if extract_image_embedding else None
+    future_text = executor.submit(in_context(extract_text_embedding)) if extract_text_embedding else None
+
+    image_embedding = future_image.result() if future_image else None
+    text_embedding, criteria = future_text.result() if future_text else (None, {})
+
+    final_user_embedding = combine_user_representation(image_embedding, text_embedding, alpha, beta, aggregation)
+    if return_criteria:
+        return final_user_embedding, criteria
+    return final_user_embedding
 
-    #image_embedding = extract_image_embedding()
-    #text_embedding = extract_text_embedding()
+
+async def aget_user_overall_embedding(image_folder_path, prompt, alpha, beta, return_criteria=False,
+                                      aggregation=None):
+    """
+    Async `get_user_overall_embedding`: image encoding and text extraction run concurrently on
+    the shared executor while the event loop keeps serving other requests.
+
+    If the awaiting task is cancelled (e.g. the client disconnected), steps that have not
+    started yet are dropped from the executor queue. Under a request deadline the steps are
+    awaited only as long as it allows (see `steps_within_deadline`).
+    """
+    extract_image_embedding, extract_text_embedding = embedding_tasks(
+        image_folder_path, prompt, multi_vector=aggregation is not None
+    )
+    loop = asyncio.get_running_loop()
+    executor = get_inference_executor()
+    image_future = loop.run_in_executor(executor, in_context(extract_image_embedding)) if extract_image_embedding else None
+    text_future = loop.run_in_executor(executor, in_context(extract_text_embedding)) if extract_text_embedding else None
+
+    deadline = current_deadline()
+    if deadline is None:
+        async def skipped(result):
+            return result
+
+        image_embedding, (text_embedding, criteria) = await asyncio.gather(
+            image_future or skipped(None), text_future or skipped((None, {})),
+        )
+    else:
+        image_embedding, text_embedding, criteria = await steps_within_deadline(
+            image_future, text_future, prompt, deadline, multi_vector=aggregation is not None
+        )
+
+    final_user_embedding = combine_user_representation(image_embedding, text_embedding, alpha, beta, aggregation)
+    if return_criteria:
+        return final_user_embedding, criteria
+    return final_user_embedding
+
+
+_TIMED_OUT = object()
+_FAILED = object()
+
+
+async def result_by(future, timeout):
+    """ The step's result, or _TIMED_OUT if it is not done within `timeout` (it is then cancelled). """
+    try:
+        return await asyncio.wait_for(future, max(0.0, timeout))
+    except asyncio.TimeoutError:
+        return _TIMED_OUT
+
+
+async def steps_within_deadline(image_future, text_future, prompt, deadline, multi_vector=False):
+    """
+    Awaits the image and text steps until the deadline minus RANKING_RESERVE_S and degrades
+    instead of waiting longer:
+
+    - T5 late: image-only ranking; the criteria for filtering and re-ranking come from the
+      rule-based parse. Without images the rule-based embedding is used, within the reserve.
+    - T5 (or the inference pool) failed: image-only ranking with the rule-based criteria, or
+      the rule-based embedding without images.
+    - CLIP late or failed: text-only ranking.
+
+    Steps that miss the deadline are cancelled if they have not started. The paths are noted on
+    the deadline.
+
+    Returns:
+        tuple: (image embedding or None, text embedding or None, criteria)
+
+    Raises:
+        DeadlineExceeded: Neither step, nor the rule-based fallback, produced an embedding in time.
+    """
+    image_embedding, late = None, False
+    if image_future is not None:
+        try:
+            image_embedding = await result_by(image_future, deadline.remaining() - RANKING_RESERVE_S)
+            late = image_embedding is _TIMED_OUT
+            note("image", "timed_out" if late else "clip")
+        except Exception:
+            if text_future is None:
+                raise
+            logger.exception("Image embedding failed, continuing with the prompt only")
+            note("image", "failed")
+        if image_embedding is _TIMED_OUT:
+            image_embedding = None
+
+    text_embedding, criteria = None, {}
+    if text_future is not None:
+        try:
+            result = await result_by(text_future, deadline.remaining() - RANKING_RESERVE_S)
+        except Exception:
+            logger.exception("Text extraction failed, continuing with the rule-based criteria")
+            note("text", "failed")
+            result = _FAILED
+        if result is not _TIMED_OUT and result is not _FAILED:
+            text_embedding, criteria = result  # path noted by text_embedding_within_deadline
+        elif image_embedding is not None:
+            if result is _TIMED_OUT:
+                late = True
+                note("text", "timed_out")
+            criteria = rule_based_criteria(prompt)
+        else:
+            late = True
+            note("text", "rule_based")
+            # on the loop's default executor: the inference threads may all be stuck on late T5 runs
+            try:
+                result = await result_by(
+                    asyncio.get_running_loop().run_in_executor(
+                        None, in_context(rule_based_text_embedding), prompt, get_inference_client(), multi_vector
+                    ),
+                    RANKING_RESERVE_S,
+                )
+            except Exception:
+                logger.exception("Rule-based text embedding failed")
+                result = _FAILED
+            if result is not _TIMED_OUT and result is not _FAILED:
+                text_embedding, criteria = result
+
+    if late and image_embedding is None and text_embedding is None:
+        raise DeadlineExceeded(f"No embedding was ready within {deadline.budget_s:.1f}s")
+    return image_embedding, text_embedding, criteria
+
+
+def combine_user_representation(image_embedding, text_embedding, alpha, beta, aggregation=None):
+    """ `combine_user_embeddings`, or `combine_user_vectors` when an aggregation is given. """
+    if aggregation is None:
+        return combine_user_embeddings(image_embedding, text_embedding, alpha, beta)
+    return combine_user_vectors(image_embedding, text_embedding, alpha, beta, aggregation)
+
+
+def combine_user_vectors(image_vectors, text_vectors, alpha, beta, aggregation="max"):
+    """
+    Multi-vector counterpart of `combine_user_embeddings`: every image and criterion vector is
+    kept as a normalized sub-query, zero-padded to a common dimension. alpha and beta are split
+    evenly over the image and the text vectors; a missing (or zero-weight) side leaves the other
+    with the full weight.
+
+    Returns:
+        UserVectors: (vectors (n, dim), weights (n,) summing to 1, aggregation)
+    """
+    sides = [(np.atleast_2d(vectors), weight) for vectors, weight in ((image_vectors, alpha), (text_vectors, beta))
+             if vectors is not None and len(vectors)]
+    if not sides:
+        raise NoUserEmbedding("❌ No valid image or text embeddings found!")
+    sides = [side for side in sides if side[1] > 0] or sides
+    if len(sides) == 1:
+        sides = [(sides[0][0], 1.0)]
+
+    dim = max(vectors.shape[1] for vectors, _ in sides)
+    sub_queries = np.concatenate([
+        np.pad(vectors / np.linalg.norm(vectors, axis=1, keepdims=True), ((0, 0), (0, dim - vectors.shape[1])))
+        for vectors, _ in sides
+    ]).astype("float32")
+    weights = np.concatenate([np.full(len(vectors), weight / len(vectors)) for vectors, weight in sides])
+    return UserVectors(sub_queries, (weights / weights.sum()).astype("float32"), aggregation)
+
+
+def combine_user_embeddings(image_embedding, text_embedding, alpha, beta):
+    """ Normalizes, pads and blends the available image and text embeddings. """
     # If only one type of embedding is available, return it directly
     if image_embedding is None and text_embedding is not None:
         return normalize_embedding(text_embedding)
     elif text_embedding is None and image_embedding is not None:
         return normalize_embedding(image_embedding)
     elif image_embedding is None and text_embedding is None:
-        raise ValueError("❌ No valid image or text embeddings found!")
+        raise NoUserEmbedding("❌ No valid image or text embeddings found!")
 
     # Normalize embeddings
     image_embedding = normalize_embedding(image_embedding)
     text_embedding = normalize_embedding(text_embedding)
-    print(image_embedding.shape, text_embedding.shape)
     # Ensure both embeddings have the same dimension
     pad_image_embedding, pad_text_embedding = pad_embeddings(image_embedding, text_embedding)
 
@@ -93,6 +374,43 @@ def compute_final_user_embedding(alpha, beta, pad_image_embedding, pad_text_embe
     return alpha * pad_image_embedding + beta * pad_text_embedding
 
 
+def blend_user_embeddings(image_embeddings, text_embeddings, alphas, betas):
+    """
+    `combine_user_embeddings` for many users (sessions) in one vectorized step; used by
+    `batch_recommend` to blend stored image embeddings with the users' criteria.
+
+    Args:
+        image_embeddings (np.ndarray): (n, image_dim), a NaN row where a user has no images.
+        text_embeddings (np.ndarray): (n, text_dim), a NaN row where a user has no prompt.
+        alphas (np.ndarray): (n,) image weights.
+        betas (np.ndarray): (n,) text weights.
+
+    Returns:
+        np.ndarray: (n, max(image_dim, text_dim)), zero-padded like `pad_embeddings`; a user with
+        only one embedding gets it normalized, a user with neither gets a NaN row.
+    """
+    image_embeddings = np.asarray(image_embeddings, dtype="float32")
+    text_embeddings = np.asarray(text_embeddings, dtype="float32")
+    num_users = len(image_embeddings)
+    dim = max(image_embeddings.shape[1], text_embeddings.shape[1])
+
+    def normalized_padded(embeddings):
+        present = ~np.isnan(embeddings).any(axis=1)
+        padded = np.zeros((num_users, dim), dtype="float32")
+        norms = np.linalg.norm(embeddings[present], axis=1, keepdims=True)
+        padded[present, :embeddings.shape[1]] = embeddings[present] / norms
+        return padded, present
+
+    images, has_image = normalized_padded(image_embeddings)
+    texts, has_text = normalized_padded(text_embeddings)
+    # a missing side gives the other one the full weight
+    alphas = np.where(has_text, alphas, 1.0) * has_image
+    betas = np.where(has_image, betas, 1.0) * has_text
+    blended = alphas[:, None].astype("float32") * images + betas[:, None].astype("float32") * texts
+    blended[~(has_image | has_text)] = np.nan
+    return blended
+
+
 # Example usage
 if __name__ == "__main__":
     image_folder_path = "../../data/images"
@@ -0,0 +1,414 @@
+"""
+Pool of inference processes serving CLIP image embeddings and T5 / MiniLM text embeddings to
+the web workers over local Unix sockets.
+
+    python src/embedding_extract/inference_pool.py --socket-dir /tmp/tripadvisory-inference --workers 2 --cores-per-worker 4
+
+Each worker process is pinned to its own cores, runs torch with a matching thread count and
+loads the models once. Web processes use the pool when INFERENCE_SOCKET_DIR points at the same
+directory (see `get_inference_client`), so web concurrency and inference capacity scale
+independently. Requests and replies are length-prefixed JSON; embeddings are not serialized
+but written by the worker straight into a shared-memory buffer owned by the client connection.
+
+The supervisor pings every worker periodically and restarts it, with backoff, when it exits,
+stops answering, or has been stuck on one request for longer than REQUEST_TIMEOUT_S (pings are
+answered on their own connection, so a worker wedged inside a model call still answers them).
+"""
+import argparse
+import glob
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from functools import lru_cache
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.tracing import span
+
+SOCKET_DIR = os.environ.get("INFERENCE_SOCKET_DIR")
+DEFAULT_SOCKET_DIR = "/tmp/tripadvisory-inference"
+SOCKET_PATTERN = "worker-{}.sock"
+HEADER = struct.Struct("!I")  # big-endian message length
+RESULT_BUFFER_BYTES = 1 << 20  # per connection, room for 512 per-image CLIP vectors (multi-vector users)
+REQUEST_TIMEOUT_S = 120
+
+HEALTH_INTERVAL_S = 5
+HEALTH_TIMEOUT_S = 2
+MAX_FAILED_CHECKS = 3
+STARTUP_TIMEOUT_S = 600  # loading the models can take minutes on a cold disk
+MAX_RESTART_DELAY_S = 30
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceUnavailable(RuntimeError):
+    """ No inference worker could be reached. """
+
+
+# ---------------------------------------------------------------- protocol
+
+def send_message(sock, message):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_exact(sock, size):
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock):
+    (size,) = HEADER.unpack(recv_exact(sock, HEADER.size))
+    return json.loads(recv_exact(sock, size))
+
+
+def attach_shared_memory(name):
+    """
+    Opens a buffer created by another process. It is unregistered from this process's resource
+    tracker, which would otherwise unlink it under the owner when this process exits.
+    """
+    buffer = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(buffer._name, "shared_memory")
+    return buffer
+
+
+# ---------------------------------------------------------------- worker process
+
+def run_task(message):
+    """
+    Runs one inference request.
+
+    Returns:
+        tuple: (embedding or None, extra reply fields)
+    """
+    op = message.get("op")
+    if op == "image":
+        from src.embedding_extract.image_embeddings_extraction import extract_clip_image_embeddings
+        return extract_clip_image_embeddings(message["image_folder"], multi_vector=message.get("multi_vector", False)), {}
+    if op == "text":
+        from src.model.evaluate import evaluate_t5
+        embedding, criteria = evaluate_t5(
+            message["prompt"], return_criteria=True, max_time=message.get("max_time"),
+            multi_vector=message.get("multi_vector", False),
+        )
+        return embedding, {"criteria": criteria}
+    if op == "criteria":
+        from src.model.evaluate import user_preferences_to_embedding
+        return user_preferences_to_embedding(message["criteria"], multi_vector=message.get("multi_vector", False)), {}
+    raise ValueError(f"Unknown operation {op!r}")
+
+
+class WorkerHandler(socketserver.BaseRequestHandler):
+    """ One client connection: requests are answered in order, inference one at a time per process. """
+
+    def handle(self):
+        buffers = {}
+        try:
+            while True:
+                try:
+                    message = recv_message(self.request)
+                except (ConnectionError, OSError):
+                    return
+                if message.get("op") == "ping":
+                    send_message(self.request, self.health())
+                    continue
+                send_message(self.request, self.answer(message, buffers))
+        finally:
+            for buffer in buffers.values():
+                buffer.close()
+
+    def health(self):
+        """ Ping reply: not ok once the request being served has run longer than REQUEST_TIMEOUT_S. """
+        busy_since = self.server.busy_since
+        busy_s = 0.0 if busy_since is None else time.monotonic() - busy_since
+        return {"ok": busy_s <= REQUEST_TIMEOUT_S, "pid": os.getpid(), "busy_s": round(busy_s, 1)}
+
+    def answer(self, message, buffers):
+        try:
+            with self.server.inference_lock:
+                self.server.busy_since = time.monotonic()
+                try:
+                    embedding, extra = run_task(message)
+                finally:
+                    self.server.busy_since = None
+            reply = {"ok": True, "shape": None, **extra}
+            if embedding is not None:
+                embedding = np.ascontiguousarray(embedding, dtype="float32")
+                name = message["buffer"]
+                if name not in buffers:
+                    buffers[name] = attach_shared_memory(name)
+                if embedding.nbytes > buffers[name].size:
+                    raise ValueError(f"Embedding of {embedding.nbytes} bytes does not fit the result buffer")
+                np.ndarray(embedding.shape, dtype="float32", buffer=buffers[name].buf)[...] = embedding
+                reply["shape"] = list(embedding.shape)
+            return reply
+        except Exception as e:
+            logger.exception("Inference request failed")
+            return {"ok": False, "error": str(e)}
+
+
+def worker_main(socket_path, cores, torch_threads, preload=True):
+    """ Entry point of an inference process: pin, load the models, then serve until killed. """
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s worker[{os.getpid()}] %(levelname)s %(message)s")
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    os.environ["OMP_NUM_THREADS"] = str(torch_threads)
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    # decode uploads on this worker's cores (pool processes inherit the affinity)
+    from src.embedding_extract.image_embeddings_extraction import set_decode_workers
+    set_decode_workers(len(cores) if cores else torch_threads)
+
+    if preload:
+        from src.embedding_extract.image_embeddings_extraction import load_clip_model
+        from src.model.evaluate import load_sentence_model, load_t5_model
+        load_clip_model()
+        load_t5_model()
+        load_sentence_model()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, WorkerHandler)
+    server.daemon_threads = True
+    server.inference_lock = threading.Lock()
+    server.busy_since = None  # when the request holding inference_lock started
+    logger.info(f"Serving on {socket_path} with cores {sorted(cores) if cores else 'all'}, {torch_threads} torch threads")
+    server.serve_forever()
+
+
+# ---------------------------------------------------------------- supervisor
+
+class WorkerSlot:
+    """ One worker position of the pool and the process currently filling it. """
+
+    def __init__(self, index, socket_path, cores):
+        self.index = index
+        self.socket_path = socket_path
+        self.cores = cores
+        self.process = None
+        self.started_at = 0.0
+        self.ready = False
+        self.failed_checks = 0
+        self.restarts = 0
+        self.restart_at = 0.0
+
+
+def ping(socket_path, timeout=HEALTH_TIMEOUT_S):
+    """ True if the worker behind the socket answers a ping in time. """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            send_message(sock, {"op": "ping"})
+            return recv_message(sock).get("ok", False)
+    except (OSError, ConnectionError, ValueError):
+        return False
+
+
+class InferencePool:
+    """
+    Starts `num_workers` inference processes, each on its own `cores_per_worker` cores, and
+    keeps them healthy.
+    """
+
+    def __init__(self, socket_dir, num_workers, cores_per_worker=None, torch_threads=None, preload=True):
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        cores_per_worker = cores_per_worker or max(1, len(cpus) // num_workers)
+        self.socket_dir = socket_dir
+        self.torch_threads = torch_threads or cores_per_worker
+        self.preload = preload
+        self.context = multiprocessing.get_context("spawn")  # fresh interpreters, no forked torch / OpenMP state
+        self.slots = [
+            WorkerSlot(index, os.path.join(socket_dir, SOCKET_PATTERN.format(index)),
+                       {cpus[(index * cores_per_worker + offset) % len(cpus)] for offset in range(cores_per_worker)})
+            for index in range(num_workers)
+        ]
+
+    def start_worker(self, slot):
+        slot.process = self.context.Process(
+            target=worker_main, args=(slot.socket_path, slot.cores, self.torch_threads, self.preload),
+            name=f"inference-worker-{slot.index}",  # not daemonic: it starts the image decode pool
+        )
+        slot.process.start()
+        slot.started_at, slot.ready, slot.failed_checks = time.monotonic(), False, 0
+        logger.info(f"Started inference worker {slot.index} (pid {slot.process.pid})")
+
+    def stop_worker(self, slot):
+        if slot.process is not None and slot.process.is_alive():
+            slot.process.terminate()
+            slot.process.join(5)
+            if slot.process.is_alive():
+                slot.process.kill()
+                slot.process.join()
+        if os.path.exists(slot.socket_path):
+            os.remove(slot.socket_path)  # clients stop routing to it right away
+
+    def schedule_restart(self, slot, reason):
+        logger.warning(f"Inference worker {slot.index} {reason}, restarting")
+        self.stop_worker(slot)
+        slot.restarts += 1
+        slot.restart_at = time.monotonic() + min(2 ** (slot.restarts - 1), MAX_RESTART_DELAY_S)
+        slot.process = None
+
+    def check(self, slot):
+        """ One supervision step for a slot: restart it when it died or stopped answering. """
+        now = time.monotonic()
+        if slot.process is None:
+            if now >= slot.restart_at:
+                self.start_worker(slot)
+            return
+        if not slot.process.is_alive():
+            self.schedule_restart(slot, f"exited with code {slot.process.exitcode}")
+        elif ping(slot.socket_path):
+            slot.ready, slot.failed_checks = True, 0
+            if now - slot.started_at > MAX_RESTART_DELAY_S * 2:
+                slot.restarts = 0  # stable again, reset the backoff
+        elif slot.ready or now - slot.started_at > STARTUP_TIMEOUT_S:
+            slot.failed_checks += 1
+            if slot.failed_checks >= MAX_FAILED_CHECKS:
+                self.schedule_restart(slot, f"failed {slot.failed_checks} health checks")
+
+    def status(self):
+        return [{"index": slot.index, "pid": slot.process.pid if slot.process else None, "ready": slot.ready,
+                 "cores": sorted(slot.cores), "restarts": slot.restarts} for slot in self.slots]
+
+    def run(self, stop_event):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        for slot in self.slots:
+            self.start_worker(slot)
+        try:
+            while not stop_event.wait(HEALTH_INTERVAL_S):
+                for slot in self.slots:
+                    self.check(slot)
+        finally:
+            for slot in self.slots:
+                self.stop_worker(slot)
+
+
+# ---------------------------------------------------------------- client (web side)
+
+class InferenceClient:
+    """
+    Web-side handle on the pool. Each thread keeps one connection and one result buffer per
+    worker; requests go round-robin over the workers whose sockets exist, and move on to the
+    next worker when one cannot be reached. A worker dying mid-request fails that request.
+    """
+
+    def __init__(self, socket_dir):
+        self.socket_dir = socket_dir
+        self.local = threading.local()
+        self.counter = itertools.count()
+
+    def socket_paths(self):
+        return sorted(glob.glob(os.path.join(self.socket_dir, SOCKET_PATTERN.format("*"))))
+
+    def connection(self, socket_path):
+        connections = self.local.__dict__.setdefault("connections", {})
+        if socket_path not in connections:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(REQUEST_TIMEOUT_S)
+            try:
+                sock.connect(socket_path)
+            except OSError:
+                sock.close()
+                raise
+            connections[socket_path] = (sock, shared_memory.SharedMemory(create=True, size=RESULT_BUFFER_BYTES))
+        return connections[socket_path]
+
+    def drop(self, socket_path):
+        sock, buffer = self.local.__dict__.get("connections", {}).pop(socket_path, (None, None))
+        if sock is not None:
+            sock.close()
+            buffer.close()
+            buffer.unlink()
+
+    def call(self, message):
+        """
+        Sends a request to the next reachable worker.
+
+        Returns:
+            tuple: (embedding copied out of the shared buffer or None, reply)
+        """
+        socket_paths = self.socket_paths()
+        first = next(self.counter)
+        for attempt in range(len(socket_paths)):
+            socket_path = socket_paths[(first + attempt) % len(socket_paths)]
+            try:
+                sock, buffer = self.connection(socket_path)
+                send_message(sock, {**message, "buffer": buffer.name})
+            except OSError:  # gone, or restarted since this thread last used it
+                self.drop(socket_path)
+                continue
+            try:
+                reply = recv_message(sock)
+            except (OSError, ConnectionError, ValueError):
+                # not retried elsewhere: a request that crashed one worker would crash the next one too
+                self.drop(socket_path)
+                raise InferenceUnavailable(f"Inference worker {socket_path} failed during the request")
+            if not reply.get("ok"):
+                raise RuntimeError(f"Inference failed: {reply.get('error')}")
+            shape = reply.get("shape")
+            # copied out because the buffer is reused by the connection's next request
+            embedding = np.ndarray(shape, dtype="float32", buffer=buffer.buf).copy() if shape is not None else None
+            return embedding, reply
+        raise InferenceUnavailable(f"No inference worker reachable in {self.socket_dir}")
+
+    def image_embedding(self, image_folder, multi_vector=False):
+        """ Like `extract_clip_image_embeddings`, computed by the pool. """
+        with span("inference_rpc.image"):
+            return self.call({"op": "image", "image_folder": image_folder, "multi_vector": multi_vector})[0]
+
+    def text_embedding(self, prompt, max_time=None, multi_vector=False):
+        """ Like `evaluate_t5(prompt, return_criteria=True, ...)`, computed by the pool. """
+        with span("inference_rpc.text"):
+            embedding, reply = self.call(
+                {"op": "text", "prompt": prompt, "max_time": max_time, "multi_vector": multi_vector}
+            )
+        return embedding, reply.get("criteria", {})
+
+    def criteria_embedding(self, criteria, multi_vector=False):
+        """ Like `user_preferences_to_embedding`, computed by the pool. """
+        with span("inference_rpc.criteria"):
+            return self.call({"op": "criteria", "criteria": criteria, "multi_vector": multi_vector})[0]
+
+
+@lru_cache(maxsize=1)
+def get_inference_client():
+    """ Client for the pool at INFERENCE_SOCKET_DIR, or None to run the models in this process. """
+    return InferenceClient(SOCKET_DIR) if SOCKET_DIR else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the inference worker pool.")
+    parser.add_argument("--socket-dir", default=SOCKET_DIR or DEFAULT_SOCKET_DIR)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--cores-per-worker", type=int, default=None, help="Default: the available cores split evenly.")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Default: --cores-per-worker.")
+    parser.add_argument("--no-preload", action="store_true", help="Load the models on the first request instead.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s supervisor %(levelname)s %(message)s")
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    pool = InferencePool(args.socket_dir, args.workers, args.cores_per_worker, args.torch_threads, not args.no_preload)
+    print(f"✅ Inference pool in {args.socket_dir}; start the web workers with INFERENCE_SOCKET_DIR={args.socket_dir}")
+    pool.run(stop)
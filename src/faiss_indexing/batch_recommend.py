@@ -0,0 +1,239 @@
+"""
+Offline recommendations for many stored users at once.
+
+    python src/faiss_indexing/batch_recommend.py users.npy recommendations.jsonl --catalog-dir data/catalog
+    python src/faiss_indexing/batch_recommend.py criteria.jsonl recommendations.parquet --top-k 10
+    python src/faiss_indexing/batch_recommend.py criteria.jsonl recommendations.jsonl --image-embeddings images.npy
+"""
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.faiss_indexing.city_catalog import CityCatalog
+from src.faiss_indexing.rerank import DEFAULT_RERANK_M, criteria_to_weights, rerank
+
+DEFAULT_CHUNK_SIZE = 4096
+OUTPUT_FORMATS = ("jsonl", "parquet")
+# Image / text weights of users whose criteria record has no "alpha" / "beta"
+DEFAULT_ALPHA = 0.5
+DEFAULT_BETA = 0.5
+# Criteria record keys that describe the user rather than their preferences
+USER_KEYS = ("user_id", "alpha", "beta")
+
+
+def criteria_to_embeddings(criteria_list, batch_size=256):
+    """ Embeds raw criteria dicts like `extract_user_criteria` returns them, in one encoder pass. """
+    from src.model.evaluate import batch_preferences_to_embeddings
+    return batch_preferences_to_embeddings(
+        [{key: value for key, value in criteria.items() if key not in USER_KEYS} for criteria in criteria_list],
+        batch_size=batch_size,
+    )
+
+
+def blend_chunk(image_embeddings, criteria_list):
+    """
+    Blends each user's image embedding with their embedded criteria, like a live request does.
+
+    Args:
+        image_embeddings (np.ndarray): (n, image_dim), a NaN row where a user has no images.
+        criteria_list (list, optional): n criteria dicts, with optional per-user "alpha" / "beta".
+
+    Returns:
+        np.ndarray: (n, dim) user embeddings from `blend_user_embeddings`.
+    """
+    from src.embedding_extract.implicit_user_embedding import blend_user_embeddings
+    image_embeddings = np.asarray(image_embeddings, dtype="float32")
+    if criteria_list is None:
+        criteria_list = [{}] * len(image_embeddings)
+        text_embeddings = np.full((len(image_embeddings), 1), np.nan, dtype="float32")
+    else:
+        text_embeddings = criteria_to_embeddings(criteria_list)
+    alphas = np.array([float(criteria.get("alpha", DEFAULT_ALPHA)) for criteria in criteria_list])
+    betas = np.array([float(criteria.get("beta", DEFAULT_BETA)) for criteria in criteria_list])
+    return blend_user_embeddings(image_embeddings, text_embeddings, alphas, betas)
+
+
+def recommend_chunk(catalog, embeddings, top_k, criteria_list=None, filter=None, rerank_m=DEFAULT_RERANK_M):
+    """
+    Recommends cities for one chunk of users with a single matrix `search` call.
+
+    Args:
+        catalog (CityCatalog): Catalog to search.
+        embeddings (np.ndarray): (n, dim) user embeddings; rows with NaNs get no recommendations.
+        top_k (int): Cities per user.
+        criteria_list (list, optional): One criteria dict per user, used for re-ranking.
+        filter (str or np.ndarray, optional): Attribute filter for every user in the chunk.
+        rerank_m (int): Candidates re-ranked per user when criteria are given.
+
+    Returns:
+        list: One list of (city name, score) per user.
+    """
+    embeddings = np.asarray(embeddings, dtype="float32")
+    valid = ~np.isnan(embeddings).any(axis=1)
+    results = [[] for _ in range(len(embeddings))]
+    if not valid.any():
+        return results
+
+    k = max(top_k, rerank_m) if criteria_list else top_k
+    similarities, city_ids = catalog.search(embeddings[valid], k, filter=filter)
+    if criteria_list:
+        weights = np.stack([criteria_to_weights(criteria) for criteria, ok in zip(criteria_list, valid) if ok])
+        city_ids, similarities = rerank(city_ids, similarities, catalog.attributes, weights, top_k)
+
+    names = {city_id: record["name"] for city_id, record in catalog.metadata.items()}
+    for row, ids, scores in zip(np.flatnonzero(valid), city_ids[:, :top_k], similarities[:, :top_k]):
+        results[row] = [(names[city_id], float(score)) for city_id, score in zip(ids.tolist(), scores.tolist())
+                        if city_id != -1]
+    return results
+
+
+def batch_recommend(embeddings=None, criteria_list=None, top_k=5, catalog=None, filter=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE, workers=None, rerank_m=DEFAULT_RERANK_M, image_embeddings=None):
+    """
+    Recommends cities for many users, yielding results chunk by chunk in input order.
+
+    Users are given as an embedding matrix, as raw criteria dicts (embedded with the sentence
+    model and also used for re-ranking), or both. With `image_embeddings`, each user's image
+    embedding is blended with their embedded criteria as in a live request. Each chunk is one batched FAISS search, which
+    already spreads over all cores; the worker threads overlap preparing, re-ranking and
+    formatting chunks with the search of the next one. At most `2 * workers` chunks are in flight.
+
+    Args:
+        embeddings (np.ndarray, optional): (N, dim) user embeddings, may be a memory map.
+        criteria_list (list, optional): N criteria dicts.
+        top_k (int): Cities per user.
+        catalog (CityCatalog, optional): Catalog to search. Defaults to the one in the working directory.
+        filter (str or np.ndarray, optional): Attribute filter applied to every user.
+        chunk_size (int): Users per search call.
+        workers (int, optional): Worker threads. Defaults to the number of cores.
+        rerank_m (int): Candidates re-ranked per user when criteria are given.
+        image_embeddings (np.ndarray, optional): (N, image_dim) image embeddings aligned with
+            `criteria_list`, a NaN row where a user has no images; may be a memory map.
+
+    Yields:
+        tuple: (first row of the chunk, list of [(city name, score), ...] per user)
+    """
+    if embeddings is None and criteria_list is None and image_embeddings is None:
+        raise ValueError("Either embeddings, criteria or image embeddings are required")
+    if embeddings is not None and image_embeddings is not None:
+        raise ValueError("Image embeddings are blended with the criteria, not with precomputed embeddings")
+    if image_embeddings is not None and criteria_list is not None and len(image_embeddings) != len(criteria_list):
+        raise ValueError(f"{len(image_embeddings)} image embeddings for {len(criteria_list)} criteria records")
+    if catalog is None:
+        from src.faiss_indexing.extract_city import get_catalog
+        catalog = get_catalog()
+    num_users = len(next(users for users in (embeddings, image_embeddings, criteria_list) if users is not None))
+    workers = workers or os.cpu_count() or 1
+
+    def run_chunk(start):
+        chunk_criteria = criteria_list[start:start + chunk_size] if criteria_list is not None else None
+        if embeddings is not None:
+            chunk = embeddings[start:start + chunk_size]
+        elif image_embeddings is not None:
+            chunk = blend_chunk(image_embeddings[start:start + chunk_size], chunk_criteria)
+        else:
+            chunk = criteria_to_embeddings(chunk_criteria)
+        return start, recommend_chunk(catalog, chunk, top_k, chunk_criteria, filter=filter, rerank_m=rerank_m)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start in range(0, num_users, chunk_size):
+            pending.append(executor.submit(run_chunk, start))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def user_ids_for(criteria_list, num_users):
+    """ The `user_id` of each criteria record, or the row number. """
+    if criteria_list is None:
+        return [str(row) for row in range(num_users)]
+    return [str(criteria.get("user_id", row)) for row, criteria in enumerate(criteria_list)]
+
+
+def write_recommendations(chunks, user_ids, output_path, fmt=None):
+    """
+    Streams chunked results to JSONL (one user per line) or Parquet (one row group per chunk).
+
+    Returns:
+        int: Number of users written.
+    """
+    fmt = fmt or ("parquet" if output_path.endswith(".parquet") else "jsonl")
+    tmp_path = output_path + ".tmp"
+    written = 0
+
+    if fmt == "jsonl":
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for start, results in chunks:
+                for offset, cities in enumerate(results):
+                    f.write(json.dumps({
+                        "user_id": user_ids[start + offset],
+                        "cities": [{"name": name, "score": score} for name, score in cities],
+                    }) + "\n")
+                written += len(results)
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        city_type = pa.list_(pa.struct([("name", pa.string()), ("score", pa.float32())]))
+        schema = pa.schema([("user_id", pa.string()), ("cities", city_type)])
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for start, results in chunks:
+                writer.write_table(pa.table({
+                    "user_id": user_ids[start:start + len(results)],
+                    "cities": [[{"name": name, "score": score} for name, score in cities] for cities in results],
+                }, schema=schema))
+                written += len(results)
+
+    os.replace(tmp_path, output_path)
+    return written
+
+
+def load_users(input_path):
+    """ Loads a .npy embedding matrix (memory mapped) or a JSONL file of criteria dicts. """
+    if input_path.endswith(".npy"):
+        return np.load(input_path, mmap_mode="r"), None
+    with open(input_path, "r", encoding="utf-8") as f:
+        return None, [json.loads(line) for line in f if line.strip()]
+
+
+def run(input_path, output_path, catalog_dir=".", top_k=5, chunk_size=DEFAULT_CHUNK_SIZE, workers=None,
+        filter=None, fmt=None, image_embeddings_path=None):
+    """ Batch recommendations from a users file (and optional image embeddings) to a JSONL / Parquet file. """
+    embeddings, criteria_list = load_users(input_path)
+    image_embeddings = np.load(image_embeddings_path, mmap_mode="r") if image_embeddings_path else None
+    num_users = len(embeddings) if embeddings is not None else len(criteria_list)
+    chunks = batch_recommend(embeddings, criteria_list, top_k=top_k, catalog=CityCatalog.open(catalog_dir),
+                             filter=filter, chunk_size=chunk_size, workers=workers,
+                             image_embeddings=image_embeddings)
+    written = write_recommendations(chunks, user_ids_for(criteria_list, num_users), output_path, fmt)
+    print(f"✅ Recommendations for {written} users written to {output_path}")
+    return written
+
+
+def add_arguments(parser):
+    """ Command line options shared by this script and the `batch_recommend` management command. """
+    parser.add_argument("input", help="Users: a .npy embedding matrix or a .jsonl file of criteria dicts.")
+    parser.add_argument("output", help="Output .jsonl or .parquet file.")
+    parser.add_argument("--catalog-dir", default=".")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--filter", default=None, help='Attribute filter, e.g. "crime_rating < 50".')
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=None, help="Defaults to the output extension.")
+    parser.add_argument("--image-embeddings", default=None,
+                        help="A .npy matrix of image embeddings, one row per criteria record (NaN row: no images), "
+                             'blended with the criteria using each record\'s "alpha" / "beta".')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommend cities for many stored users.")
+    add_arguments(parser)
+    args = parser.parse_args()
+    run(args.input, args.output, catalog_dir=args.catalog_dir, top_k=args.top_k, chunk_size=args.chunk_size,
+        workers=args.workers, filter=args.filter, fmt=args.format, image_embeddings_path=args.image_embeddings)
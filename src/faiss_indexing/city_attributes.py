@@ -0,0 +1,243 @@
+import ast
+import operator
+from functools import lru_cache
+import faiss
+import numpy as np
+
+NUMERIC_FIELDS = [
+    "purchase_power", "health_care", "pollution", "quality_of_life", "crime_rating",
+    "population", "lat", "lng",
+]
+CATEGORICAL_FIELDS = ["landscape", "country", "cuisine"]
+SEASONS = ["winter", "spring", "summer", "fall"]
+SEASONAL_FIELDS = {"weather": SEASONS}  # per-season categorical fields, referenced as weather[summer]
+MISSING_CODE = -1
+
+COMPARISONS = {
+    ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+}
+
+
+def column_names():
+    """ Flat column names: numeric, categorical and one per seasonal sub-field ("weather.summer"). """
+    seasonal = [f"{field}.{season}" for field, seasons in SEASONAL_FIELDS.items() for season in seasons]
+    return NUMERIC_FIELDS, CATEGORICAL_FIELDS + seasonal
+
+
+class CityAttributes:
+    """
+    Columnar copy of the filterable city attributes, one row per city id.
+
+    Numeric fields are float32 (NaN when missing). Categorical fields are dictionary encoded
+    as int16 codes with a per-column vocabulary (-1 when missing), so filters compare
+    integer arrays instead of strings.
+    """
+
+    def __init__(self, metadata, num_rows):
+        """
+        Args:
+            metadata (dict): {city_id: metadata record} as kept by `CityCatalog`.
+            num_rows (int): Number of rows (at least max city id + 1).
+        """
+        numeric, categorical = column_names()
+        dtype = [(name, "f4") for name in numeric] + [(name, "i2") for name in categorical]
+        self.table = np.zeros(num_rows, dtype=dtype)
+        for name in numeric:
+            self.table[name] = np.nan
+        for name in categorical:
+            self.table[name] = MISSING_CODE
+        self.present = np.zeros(num_rows, dtype=bool)
+        self.vocab = {name: {} for name in categorical}
+        self._normalized = {}
+
+        for city_id, record in metadata.items():
+            self.present[city_id] = True
+            row = self.table[city_id:city_id + 1]
+            for name in numeric:
+                value = record.get(name)
+                if isinstance(value, (int, float)):
+                    row[name] = value
+            for name in categorical:
+                value = self._lookup(record, name)
+                if isinstance(value, str):
+                    row[name] = self.vocab[name].setdefault(value.lower(), len(self.vocab[name]))
+
+    @staticmethod
+    def _lookup(record, name):
+        if "." in name:
+            field, sub_field = name.split(".", 1)
+            value = record.get(field)
+            return value.get(sub_field) if isinstance(value, dict) else None
+        return record.get(name)
+
+    def __len__(self):
+        return len(self.table)
+
+    def column(self, name):
+        if name not in self.table.dtype.names:
+            raise ValueError(f"Unknown city attribute '{name}'")
+        return self.table[name]
+
+    def normalized(self, names):
+        """
+        Min-max scaled numeric columns as one (num_rows, len(names)) float32 matrix.
+
+        Values lie in [0, 1]; missing values are set to the neutral 0.5. Cached per column set.
+        """
+        names = tuple(names)
+        if names not in self._normalized:
+            matrix = np.empty((len(self), len(names)), dtype="float32")
+            for col, name in enumerate(names):
+                column = self.column(name)
+                finite = column[np.isfinite(column)]
+                low, high = (finite.min(), finite.max()) if len(finite) else (0.0, 1.0)
+                scaled = (column - low) / (high - low) if high > low else np.full_like(column, 0.5)
+                matrix[:, col] = np.where(np.isfinite(scaled), scaled, 0.5)
+            self._normalized[names] = matrix
+        return self._normalized[names]
+
+    def codes(self, name, values):
+        """ Dictionary codes of categorical values; unknown values map to a code that never matches. """
+        vocab = self.vocab[name]
+        return np.array([vocab.get(str(value).lower(), -2) for value in values], dtype=np.int16)
+
+    def filter_mask(self, expression):
+        """
+        Evaluates a filter expression over all rows at once.
+
+        Example: "crime_rating < 50 and weather[summer] in {warm, hot}"
+
+        Returns:
+            np.ndarray: Boolean mask indexed by city id.
+        """
+        return compile_filter(expression)(self) & self.present
+
+
+def field_name(node):
+    """ Column name referenced by an expression node: `crime_rating` or `weather[summer]`. """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name):
+        key = node.slice
+        if isinstance(key, ast.Name):
+            return f"{node.value.id}.{key.id}"
+        if isinstance(key, ast.Constant) and isinstance(key.value, str):
+            return f"{node.value.id}.{key.value}"
+    return None
+
+
+def literal_value(node):
+    """ Constant of an expression node; bare names are read as strings (`hot` == "hot"). """
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+        return -node.operand.value
+    raise ValueError(f"Unsupported value in filter: {ast.dump(node)}")
+
+
+def compile_comparison(left, op, right):
+    """ Compiles `field <op> value` (either order) into a function of CityAttributes. """
+    name = field_name(left)
+    if name is None:
+        # value <op> field, e.g. "40 < crime_rating"
+        swapped = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+        name = field_name(right)
+        if name is None or type(op) not in swapped:
+            raise ValueError("A comparison needs an attribute on one side")
+        left, op, right = right, swapped[type(op)](), left
+
+    if isinstance(op, (ast.In, ast.NotIn)):
+        if not isinstance(right, (ast.Set, ast.List, ast.Tuple)):
+            raise ValueError("'in' needs a set of values, e.g. weather[summer] in {warm, hot}")
+        values = [literal_value(element) for element in right.elts]
+        negate = isinstance(op, ast.NotIn)
+
+        def evaluate(attributes):
+            column = attributes.column(name)
+            if name in attributes.vocab:
+                mask = np.isin(column, attributes.codes(name, values))
+            else:
+                mask = np.isin(column, np.array(values, dtype=column.dtype))
+            return ~mask if negate else mask
+        return evaluate
+
+    if type(op) not in COMPARISONS:
+        raise ValueError(f"Unsupported comparison: {type(op).__name__}")
+    compare, value = COMPARISONS[type(op)], literal_value(right)
+
+    def evaluate(attributes):
+        column = attributes.column(name)
+        if name in attributes.vocab:
+            if not isinstance(op, (ast.Eq, ast.NotEq)):
+                raise ValueError(f"'{name}' is categorical, only ==, != and in are supported")
+            return compare(column, attributes.codes(name, [value])[0])
+        return compare(column, np.float32(value))  # NaN compares False
+    return evaluate
+
+
+def compile_node(node):
+    """ Recursively compiles an expression AST into a function returning a boolean mask. """
+    if isinstance(node, ast.BoolOp):
+        parts = [compile_node(value) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+
+        def evaluate(attributes):
+            mask = parts[0](attributes)
+            for part in parts[1:]:
+                mask = combine(mask, part(attributes))
+            return mask
+        return evaluate
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        inner = compile_node(node.operand)
+        return lambda attributes: ~inner(attributes)
+
+    if isinstance(node, ast.Compare):
+        # Chained comparisons: "40 < crime_rating < 60"
+        parts, left = [], node.left
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(compile_comparison(left, op, right))
+            left = right
+
+        def evaluate(attributes):
+            mask = parts[0](attributes)
+            for part in parts[1:]:
+                mask = mask & part(attributes)
+            return mask
+        return evaluate
+
+    raise ValueError(f"Unsupported filter expression: {ast.dump(node)}")
+
+
+@lru_cache(maxsize=256)
+def compile_filter(expression):
+    """
+    Compiles a filter expression into a vectorized function of `CityAttributes`.
+
+    Supports and / or / not, parentheses, <, <=, >, >=, ==, != (also chained) and
+    `in` / `not in` over sets. Seasonal fields are written as weather[summer].
+
+    Returns:
+        callable: attributes -> boolean mask indexed by city id.
+    """
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid filter expression '{expression}': {e.msg}") from e
+    return compile_node(tree.body)
+
+
+def mask_to_selector(mask):
+    """
+    Packs a boolean id mask into a FAISS `IDSelectorBitmap`.
+
+    `IDSelectorBitmap` takes the bitmap length in bytes; ids past the mask are not members. The
+    packed bits are attached to the selector so they live as long as it does.
+    """
+    bits = np.packbits(mask.astype(bool), bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(bits), faiss.swig_ptr(bits))
+    selector.bits_ref = bits
+    return selector
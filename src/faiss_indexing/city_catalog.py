@@ -0,0 +1,542 @@
+import argparse
+import base64
+import fcntl
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+import faiss
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.faiss_indexing.index_factory import (
+    resolve_index_config, build_index, with_id_mapping, train_index, apply_search_params, supports_remove,
+    normalize_rows, scores_to_cosine, search_parameters,
+)
+from src.faiss_indexing.city_attributes import CityAttributes, mask_to_selector
+
+INDEX_FILE = "city_embeddings.index"
+CITY_METADATA_FILE = "city_metadata.json"
+SNAPSHOT_INDEX_FILE = "city_embeddings.{generation:06d}.index"
+SNAPSHOT_METADATA_FILE = "city_metadata.{generation:06d}.json"
+CATALOG_STATE_FILE = "catalog_state.json"
+WAL_FILE = "catalog.wal"
+LOCK_FILE = "catalog.lock"
+LEGACY_CITY_NAMES_FILE = "city_names.json"
+
+
+def atomic_write_json(path, data):
+    """ Writes JSON to a temporary file and renames it over `path`. """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def atomic_write_index(index, path):
+    """ Writes a FAISS index to a temporary file and renames it over `path`. """
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def snapshot_paths(catalog_dir, generation):
+    """ Index and metadata files of a snapshot generation; None is the unversioned layout of older catalogs. """
+    if generation is None:
+        return os.path.join(catalog_dir, INDEX_FILE), os.path.join(catalog_dir, CITY_METADATA_FILE)
+    return (os.path.join(catalog_dir, SNAPSHOT_INDEX_FILE.format(generation=generation)),
+            os.path.join(catalog_dir, SNAPSHOT_METADATA_FILE.format(generation=generation)))
+
+
+def read_state(catalog_dir):
+    """ Contents of the state file naming the live snapshot, {} for a catalog without one. """
+    state_path = os.path.join(catalog_dir, CATALOG_STATE_FILE)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@contextmanager
+def catalog_file_lock(catalog_dir, shared=False):
+    """
+    Holds an `flock` on the catalog's lock file: exclusive for writers, shared for readers.
+
+    A reader of a catalog directory it cannot write to goes without the lock, since nobody can
+    be editing that catalog.
+    """
+    lock_path = os.path.join(catalog_dir, LOCK_FILE)
+    try:
+        if not shared:
+            os.makedirs(catalog_dir, exist_ok=True)
+        lock_file = open(lock_path, "a")
+    except OSError:
+        if not shared:
+            raise
+        yield
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def file_signature(path):
+    """ (inode, size, mtime) of a file, None if it does not exist; changes whenever it is replaced or appended to. """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def count_log_entries(wal_path):
+    """ Number of entries in a write-ahead log, 0 if there is none. """
+    if not os.path.exists(wal_path):
+        return 0
+    with open(wal_path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def encode_vector(vector):
+    """ Packs a float32 vector as base64 for the write-ahead log. """
+    return base64.b64encode(np.asarray(vector, dtype="float32").tobytes()).decode("ascii")
+
+
+def decode_vector(data):
+    """ Inverse of `encode_vector`. """
+    return np.frombuffer(base64.b64decode(data), dtype="float32")
+
+
+class CityCatalog:
+    """
+    FAISS city index with stable city ids and a metadata table keyed by the same ids.
+
+    The index is addressed by city id (`IndexIDMap2`, or the ids stored in the IVF lists),
+    so a city can be added, replaced or removed in place
+    instead of rebuilding everything. Every change is appended to a write-ahead log before it
+    is applied; `checkpoint()` folds the log into a fresh snapshot of the index and metadata.
+    Each snapshot is written under a new generation number and only becomes the live one when
+    the state file naming it is replaced, so a crash mid-checkpoint leaves the previous
+    snapshot, which agrees with the log, in place.
+
+    Several processes can share a catalog directory. Writers hold an exclusive `flock` on it
+    while they catch up with the disk, log, apply and checkpoint, so ids are never allocated
+    twice; readers call `refresh()` to pick up a newer snapshot or log entries appended by others.
+
+    The index type (Flat, IVF-Flat, IVF-PQ or HNSW), metric, vector storage (fp32, fp16 or
+    8-bit scalar quantized) and search parameters come from an index config (see
+    `index_factory.py`) that is persisted with the snapshot. Vectors and queries are
+    L2-normalized, so search scores are cosine similarities.
+    """
+
+    def __init__(self, catalog_dir, index, metadata, next_id=0, version=0, index_config=None, checkpoint_every=1000,
+                 generation=None):
+        self.catalog_dir = catalog_dir
+        self.generation = generation  # snapshot the state file points to, None before the first checkpoint
+        self.index = index
+        self.index_config = resolve_index_config(index_config, index.d, index.ntotal)
+        self.index_config["metric"] = "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+        self.metadata = metadata  # {city_id (int): record dict with at least "name"}
+        self.next_id = next_id
+        self.version = version
+        self.checkpoint_every = checkpoint_every
+        self.pending_ops = 0
+        self.wal_offset = 0  # bytes of the log already applied
+        self.disk_signature = None  # state file and log as last caught up with
+        self.lock = threading.RLock()
+        self.name_to_id = {record["name"]: city_id for city_id, record in metadata.items()}
+        self._attributes = None
+        self._attributes_version = None
+
+    @property
+    def dim(self):
+        return self.index.d
+
+    @property
+    def wal_path(self):
+        return os.path.join(self.catalog_dir, WAL_FILE)
+
+    def _disk_signature(self):
+        return (file_signature(os.path.join(self.catalog_dir, CATALOG_STATE_FILE)), file_signature(self.wal_path))
+
+    @staticmethod
+    def new_index(embeddings, ids, index_config):
+        """
+        Builds, trains and fills an index addressed by city id.
+
+        Args:
+            embeddings (np.ndarray): (N, dim) vectors; also used as the training sample.
+            ids (np.ndarray): (N,) int64 city ids.
+            index_config (dict): Resolved index config.
+
+        Returns:
+            faiss.Index: The filled index with its search parameters applied.
+        """
+        embeddings = normalize_rows(embeddings)
+        index = with_id_mapping(build_index(index_config, embeddings.shape[1]), index_config)
+        train_index(index, embeddings)
+        index.add_with_ids(embeddings, ids)
+        return apply_search_params(index, index_config)
+
+    @classmethod
+    def build(cls, catalog_dir, embeddings, records, index_config=None):
+        """
+        Creates a catalog from scratch and writes its first snapshot.
+
+        Args:
+            catalog_dir (str): Directory the catalog lives in.
+            embeddings (np.ndarray): (N, dim) city embeddings.
+            records (list): N metadata records, each with a "name" key.
+            index_config (dict, optional): Index kind and parameters. Defaults to an exact flat index.
+
+        Returns:
+            CityCatalog: The new catalog.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        ids = np.arange(len(records), dtype=np.int64)
+        index_config = resolve_index_config(index_config, embeddings.shape[1], len(records))
+        index = cls.new_index(embeddings, ids, index_config)
+        catalog = cls(catalog_dir, index, dict(zip(ids.tolist(), records)), next_id=len(records),
+                      index_config=index_config)
+        with catalog_file_lock(catalog_dir):
+            # replaces a catalog already in the directory: its generation and version keep counting up
+            state = read_state(catalog_dir)
+            catalog.generation = state.get("snapshot")
+            catalog.version = state.get("version", 0) + count_log_entries(catalog.wal_path) + 1
+            catalog._checkpoint()
+        return catalog
+
+    @classmethod
+    def open(cls, catalog_dir, **kwargs):
+        """
+        Loads the latest snapshot and replays the write-ahead log on top of it.
+
+        A legacy positional index with a `city_names.json` list is converted on the fly,
+        using the row positions as city ids.
+        """
+        with catalog_file_lock(catalog_dir, shared=True):
+            catalog = cls._open_snapshot(catalog_dir, read_state(catalog_dir), **kwargs)
+            catalog._replay_wal()
+            catalog.disk_signature = catalog._disk_signature()
+        return catalog
+
+    @classmethod
+    def _open_snapshot(cls, catalog_dir, state, **kwargs):
+        """ The snapshot the state names, without the log applied. """
+        index_path, metadata_path = snapshot_paths(catalog_dir, state.get("snapshot"))
+
+        if not os.path.exists(metadata_path):
+            return cls._open_legacy(catalog_dir, **kwargs)
+
+        index = faiss.read_index(index_path)
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = {int(city_id): record for city_id, record in json.load(f).items()}
+
+        index_config = state.get("index_config")
+        if index_config:
+            apply_search_params(index, index_config)
+
+        return cls(
+            catalog_dir, index, metadata,
+            next_id=state.get("next_id", max(metadata, default=-1) + 1),
+            version=state.get("version", 0),
+            index_config=index_config,
+            generation=state.get("snapshot"),
+            **kwargs,
+        )
+
+    def refresh(self):
+        """
+        Catches up with edits other processes made to the catalog directory: a newer snapshot
+        is loaded, log entries appended since the last look are applied. Only a `stat` of the
+        state file and the log when nothing changed.
+        """
+        if self._disk_signature() == self.disk_signature:
+            return
+        with self.lock, catalog_file_lock(self.catalog_dir, shared=True):
+            self._catch_up()
+
+    def _catch_up(self, truncate_torn=False):
+        """ `refresh` under the file lock; a writer also cuts off a torn final log entry before appending. """
+        state = read_state(self.catalog_dir)
+        if state.get("snapshot") != self.generation:
+            snapshot = self._open_snapshot(self.catalog_dir, state)
+            self.index, self.index_config, self.metadata = snapshot.index, snapshot.index_config, snapshot.metadata
+            self.next_id, self.version, self.generation = snapshot.next_id, snapshot.version, snapshot.generation
+            self.name_to_id, self.pending_ops, self.wal_offset = snapshot.name_to_id, 0, 0
+            self._attributes = None
+        self._replay_wal(truncate_torn)
+        self.disk_signature = self._disk_signature()
+
+    @classmethod
+    def _open_legacy(cls, catalog_dir, **kwargs):
+        """ Converts an `IndexFlatL2` + `city_names.json` pair into an id-mapped cosine catalog. """
+        flat_index = faiss.read_index(os.path.join(catalog_dir, INDEX_FILE))
+        with open(os.path.join(catalog_dir, LEGACY_CITY_NAMES_FILE), "r", encoding="utf-8") as f:
+            city_names = json.load(f)
+
+        embeddings = flat_index.reconstruct_n(0, flat_index.ntotal)
+        ids = np.arange(flat_index.ntotal, dtype=np.int64)
+        index = cls.new_index(embeddings, ids, resolve_index_config(None, flat_index.d, len(ids)))
+        metadata = {int(city_id): {"name": city_names[city_id]} for city_id in ids}
+        return cls(catalog_dir, index, metadata, next_id=len(metadata), **kwargs)
+
+    def city_id(self, name):
+        """ Id of the city with the given name, or None. """
+        return self.name_to_id.get(name)
+
+    def get(self, city_id):
+        """ Metadata record of a city id, or None. """
+        return self.metadata.get(int(city_id))
+
+    def upsert(self, city, embedding=None):
+        """
+        Adds a city or replaces an existing one, without touching the other cities.
+
+        The city id is taken from `city["id"]`, else looked up by name, else newly allocated.
+
+        Args:
+            city (dict): City record with `name`, `metadata` and optionally `image_folder` / `id`.
+            embedding (np.ndarray, optional): Precomputed embedding. Computed from the city if omitted.
+
+        Returns:
+            int: The city id.
+        """
+        if embedding is None:
+            from src.faiss_indexing.generate_city_embeddings import embed_cities
+
+            embeddings, valid = embed_cities([city])
+            if not valid[0]:
+                raise ValueError(f"❌ Could not compute an embedding for city '{city['name']}'")
+            embedding = embeddings[0]
+
+        record = {"name": city["name"], "image_folder": city.get("image_folder"), **city.get("metadata", {})}
+        with self.lock, catalog_file_lock(self.catalog_dir):
+            self._catch_up(truncate_torn=True)
+            city_id = city.get("id")
+            if city_id is None:
+                city_id = self.city_id(city["name"])
+            if city_id is None:
+                city_id = self.next_id
+
+            self._log({"op": "upsert", "id": int(city_id), "record": record, "embedding": encode_vector(embedding)})
+            self._apply_upsert(int(city_id), record, np.asarray(embedding, dtype="float32"))
+            self._maybe_checkpoint()
+            self.disk_signature = self._disk_signature()
+        return int(city_id)
+
+    def remove(self, city_id):
+        """ Removes a city from the index and the metadata table. """
+        with self.lock, catalog_file_lock(self.catalog_dir):
+            self._catch_up(truncate_torn=True)
+            if int(city_id) not in self.metadata:
+                raise KeyError(f"Unknown city id {city_id}")
+            self._log({"op": "remove", "id": int(city_id)})
+            self._apply_remove(int(city_id))
+            self._maybe_checkpoint()
+            self.disk_signature = self._disk_signature()
+
+    @property
+    def attributes(self):
+        """ Columnar city attributes for filtering, rebuilt when the catalog changes. """
+        with self.lock:
+            if self._attributes is None or self._attributes_version != self.version:
+                self._attributes = CityAttributes(self.metadata, self.next_id)
+                self._attributes_version = self.version
+            return self._attributes
+
+    def filter_mask(self, expression):
+        """ Boolean mask over city ids for a filter expression (see `city_attributes.compile_filter`). """
+        return self.attributes.filter_mask(expression)
+
+    def search(self, query_embeddings, k, filter=None):
+        """
+        Searches the index, optionally restricted to the cities matching a filter.
+
+        The filter is applied inside FAISS through an `IDSelectorBitmap`, so selective
+        filters still return k results without over-fetching.
+
+        Args:
+            query_embeddings (np.ndarray): (nq, dim) or (dim,) query vectors.
+            k (int): Number of neighbours per query.
+            filter (str or np.ndarray, optional): Filter expression, e.g.
+                "crime_rating < 50 and weather[summer] in {warm, hot}", or a boolean mask over city ids.
+
+        Returns:
+            tuple: (cosine similarities (nq, k), city ids (nq, k)); missing results have id -1.
+        """
+        queries = self.prepare_queries(query_embeddings)
+        with self.lock:
+            k = min(k, max(self.index.ntotal, 1))
+            if filter is None:
+                distances, city_ids = self.index.search(queries, k)
+            else:
+                mask = self.filter_mask(filter) if isinstance(filter, str) else np.asarray(filter, dtype=bool)
+                params = search_parameters(self.index_config, mask_to_selector(mask))
+                distances, city_ids = self.index.search(queries, k, params=params)
+        return scores_to_cosine(distances, self.index_config), city_ids
+
+    def prepare_queries(self, query_embeddings):
+        """ Casts queries to float32, zero-pads / truncates them to the index dimension and normalizes them. """
+        queries = np.asarray(query_embeddings, dtype="float32")
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        if queries.shape[1] < self.dim:
+            queries = np.pad(queries, ((0, 0), (0, self.dim - queries.shape[1])), mode='constant')
+        elif queries.shape[1] > self.dim:
+            queries = queries[:, :self.dim]
+        return np.ascontiguousarray(normalize_rows(queries))
+
+    def vectors(self, city_ids):
+        """ Stored unit vectors of the given cities (approximate for PQ storage), (len(city_ids), dim). """
+        with self.lock:
+            return normalize_rows(self.index.reconstruct_batch(np.asarray(city_ids, dtype=np.int64)))
+
+    def set_search_params(self, **params):
+        """
+        Changes search-time parameters (e.g. nprobe=32, efSearch=128) and persists them.
+        """
+        with self.lock, catalog_file_lock(self.catalog_dir):
+            self._catch_up(truncate_torn=True)
+            self.index_config.update(params)
+            apply_search_params(self.index, self.index_config)
+            self._log({"op": "params", "params": params})
+            self._maybe_checkpoint()
+            self.disk_signature = self._disk_signature()
+
+    def checkpoint(self):
+        """
+        Writes a snapshot of the index, metadata and id counter, then truncates the log.
+
+        The snapshot goes to new generation files; replacing the state file switches to it in
+        one rename, after which the log and the previous generation are deleted.
+        """
+        with self.lock, catalog_file_lock(self.catalog_dir):
+            self._catch_up(truncate_torn=True)
+            self._checkpoint()
+            self.disk_signature = self._disk_signature()
+
+    def _checkpoint(self):
+        """ `checkpoint` with the file lock held. """
+        with self.lock:
+            generation = (self.generation or 0) + 1
+            index_path, metadata_path = snapshot_paths(self.catalog_dir, generation)
+            atomic_write_index(self.index, index_path)
+            atomic_write_json(metadata_path, {str(city_id): record for city_id, record in self.metadata.items()})
+            atomic_write_json(
+                os.path.join(self.catalog_dir, CATALOG_STATE_FILE),
+                {"snapshot": generation, "next_id": self.next_id, "version": self.version,
+                 "index_config": self.index_config},
+            )
+            previous, self.generation = self.generation, generation
+            if os.path.exists(self.wal_path):
+                os.remove(self.wal_path)
+            if previous is not None:
+                for path in snapshot_paths(self.catalog_dir, previous):
+                    if os.path.exists(path):
+                        os.remove(path)
+            self.pending_ops, self.wal_offset = 0, 0
+
+    def _log(self, entry):
+        """ Appends an operation to the write-ahead log and syncs it to disk. """
+        data = (json.dumps(entry) + "\n").encode("utf-8")
+        with open(self.wal_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.wal_offset += len(data)
+
+    def _replay_wal(self, truncate_torn=False):
+        """
+        Re-applies logged operations that are not in the snapshot yet, from `wal_offset` on.
+
+        A torn final write from a crash is skipped, and with `truncate_torn` cut off so the next
+        entry is not appended to it.
+        """
+        if not os.path.exists(self.wal_path):
+            self.wal_offset = 0
+            return
+        with open(self.wal_path, "rb") as f:
+            f.seek(self.wal_offset)
+            for line in f:
+                try:
+                    entry = json.loads(line) if line.endswith(b"\n") else None
+                except json.JSONDecodeError:
+                    entry = None
+                if entry is None:  # torn final write from a crash
+                    if truncate_torn:
+                        f.close()
+                        os.truncate(self.wal_path, self.wal_offset)
+                    break
+                if entry["op"] == "upsert":
+                    self._apply_upsert(entry["id"], entry["record"], decode_vector(entry["embedding"]))
+                elif entry["op"] == "remove" and entry["id"] in self.metadata:
+                    self._apply_remove(entry["id"])
+                elif entry["op"] == "params":
+                    self.index_config.update(entry["params"])
+                    apply_search_params(self.index, self.index_config)
+                self.wal_offset += len(line)
+                self.pending_ops += 1
+
+    def _remove_vectors(self, city_ids):
+        """ Deletes vectors in place, or rebuilds the index for types that cannot delete (HNSW). """
+        city_ids = np.array(city_ids, dtype=np.int64)
+        if supports_remove(self.index):
+            self.index.remove_ids(city_ids)
+            return
+
+        removed = set(city_ids.tolist())
+        keep = np.array([city_id for city_id in self.metadata if city_id not in removed], dtype=np.int64)
+        embeddings = np.stack([self.index.reconstruct(int(city_id)) for city_id in keep]) if len(keep) else \
+            np.empty((0, self.dim), dtype="float32")
+        self.index = self.new_index(embeddings, keep, self.index_config)
+
+    def _apply_upsert(self, city_id, record, embedding):
+        if city_id in self.metadata:
+            self._remove_vectors([city_id])
+            self.name_to_id.pop(self.metadata[city_id]["name"], None)
+        self.index.add_with_ids(self.prepare_queries(embedding), np.array([city_id], dtype=np.int64))
+        self.metadata[city_id] = record
+        self.name_to_id[record["name"]] = city_id
+        self.next_id = max(self.next_id, city_id + 1)
+        self.version += 1
+
+    def _apply_remove(self, city_id):
+        self._remove_vectors([city_id])
+        record = self.metadata.pop(city_id)
+        self.name_to_id.pop(record["name"], None)
+        self.version += 1
+
+    def _maybe_checkpoint(self):
+        self.pending_ops += 1
+        if self.pending_ops >= self.checkpoint_every:
+            self._checkpoint()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Edit cities in the FAISS city catalog in place.")
+    parser.add_argument("--catalog-dir", default=".")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    upsert_parser = subparsers.add_parser("upsert", help="Add or update the cities in a JSON file.")
+    upsert_parser.add_argument("cities_json")
+    remove_parser = subparsers.add_parser("remove", help="Remove cities by id.")
+    remove_parser.add_argument("city_ids", type=int, nargs="+")
+    subparsers.add_parser("checkpoint", help="Fold the write-ahead log into a new snapshot.")
+    args = parser.parse_args()
+
+    catalog = CityCatalog.open(args.catalog_dir)
+    if args.command == "upsert":
+        with open(args.cities_json, "r", encoding="utf-8") as f:
+            cities = json.load(f)
+        for city in cities if isinstance(cities, list) else [cities]:
+            print(f"✅ Upserted '{city['name']}' as id {catalog.upsert(city)}")
+    elif args.command == "remove":
+        for city_id in args.city_ids:
+            catalog.remove(city_id)
+            print(f"✅ Removed city id {city_id}")
+    else:
+        catalog.checkpoint()
+        print("✅ Catalog checkpointed")
@@ -1,64 +1,124 @@
 import os
-import faiss
 import json
 import numpy as np
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from src.embedding_extract.implicit_user_embedding import get_user_overall_embedding
+from src.embedding_extract.implicit_user_embedding import UserVectors, get_user_overall_embedding
+from src.faiss_indexing.city_catalog import CityCatalog
+from src.faiss_indexing.multi_vector import late_interaction_search
+from src.faiss_indexing.rerank import DEFAULT_RERANK_M, criteria_to_weights, rerank
+from src.faiss_indexing.result_cache import SemanticResultCache, context_key
+from src.tracing import record, span
+from functools import lru_cache
 import datetime
+import time
 
 # Get the absolute path of the current working directory (terminal location)
 SCRIPT_DIR = os.getcwd()
+CATALOG_DIR = os.environ.get("CITY_CATALOG_DIR", SCRIPT_DIR)
 
-def recommend_cities(user_embedding, top_k=None):
-    """
-    Finds the most similar city embeddings using FAISS and prints similarity scores for all cities.
-
-    Args:
-        user_embedding (np.array): The final user embedding vector.
-        top_k (int, optional): Number of top cities to retrieve. If None, shows all cities.
-
-    Returns:
-        List of recommended city names with similarity scores.
-    """
-    # Load FAISS index
-    index_path = os.path.join(SCRIPT_DIR, "city_embeddings.index")
-    index = faiss.read_index(index_path)
-
-    # Ensure user embedding matches FAISS index dimension
-    user_embedding = np.array(user_embedding).astype("float32").reshape(1, -1)
-    
-    #print(f"User embedding shape: {user_embedding.shape}")
-    #print(f"FAISS index dimension: {index.d}")
+@lru_cache(maxsize=None)
+def open_catalog(catalog_dir):
+    """ Opens the city catalog once per process; edits go through the shared instance. """
+    return CityCatalog.open(catalog_dir)
 
-    if user_embedding.shape[1] < index.d:
-        user_embedding = np.pad(user_embedding, ((0, 0), (0, index.d - user_embedding.shape[1])), mode='constant')
-    elif user_embedding.shape[1] > index.d:
-        user_embedding = user_embedding[:, :index.d]
+def get_catalog(catalog_dir=CATALOG_DIR):
+    """ The process's city catalog, caught up with edits other processes made to the directory. """
+    catalog = open_catalog(catalog_dir)
+    catalog.refresh()
+    return catalog
 
-    #print(f"Adjusted user embedding shape: {user_embedding.shape}")
+@lru_cache(maxsize=None)
+def get_result_cache():
+    """ Recommendation cache shared by all requests in the process. """
+    return SemanticResultCache()
 
-    # Search FAISS for all city embeddings
-    distances, indices = index.search(user_embedding, index.ntotal)  # Retrieve all cities
+def rank_cities(user_embedding, top_k=None, catalog=None, filter=None, criteria=None, rerank_m=DEFAULT_RERANK_M):
+    """
+    Retrieves and ranks cities, returning the ranking together with per-stage latencies.
 
-    # Convert L2 distances to similarity scores (1 / (1 + distance))
-    similarity_scores = 1 / (1 + distances[0])
+    With `criteria`, the top `rerank_m` FAISS candidates are re-scored by similarity plus the
+    city's cost, safety, health care and quality-of-life features (see `rerank.py`).
 
+    A multi-vector user (`UserVectors`) is scored by late interaction over its sub-vectors
+    (see `multi_vector.py`) with the aggregation it carries.
 
-    # Load city names
-    city_names_path = os.path.join(SCRIPT_DIR, "city_names.json")
-    with open(city_names_path, "r") as f:
-        city_names = json.load(f)
+    Args:
+        user_embedding (np.array or UserVectors): The final user embedding vector, or its sub-vectors.
+        top_k (int, optional): Number of top cities to retrieve. If None, returns all cities.
+        catalog (CityCatalog, optional): Catalog to search. Defaults to the one in the working directory.
+        filter (str, optional): Attribute filter applied inside the search,
+            e.g. "crime_rating < 50 and weather[summer] in {warm, hot}".
+        criteria (dict, optional): Travel criteria extracted by T5, used for re-ranking.
+        rerank_m (int): Number of candidates to re-rank.
 
-    # Pair city names with similarity scores
-    city_scores = [(city_names[idx], similarity_scores[i]) for i, idx in enumerate(indices[0])]
+    Returns:
+        tuple: (list of (city name, score), {"search_ms": float, "rerank_ms": float})
+    """
+    catalog = catalog or get_catalog()
+    top_k = top_k or catalog.index.ntotal
+    timings = {}
+
+    # Search FAISS for the candidates
+    start = time.perf_counter()
+    k = max(top_k, rerank_m) if criteria else top_k
+    if isinstance(user_embedding, UserVectors):
+        similarity_scores, city_ids = late_interaction_search(
+            catalog, user_embedding.vectors, k, user_embedding.weights, user_embedding.aggregation, filter=filter
+        )
+    else:
+        similarity_scores, city_ids = catalog.search(user_embedding, k, filter=filter)
+    timings["search_ms"] = (time.perf_counter() - start) * 1000
+    record("faiss_search", timings["search_ms"] / 1000)
+
+    # Re-rank with the city features the user cares about
+    start = time.perf_counter()
+    if criteria:
+        city_ids, similarity_scores = rerank(
+            city_ids, similarity_scores, catalog.attributes, criteria_to_weights(criteria), top_k
+        )
+    timings["rerank_ms"] = (time.perf_counter() - start) * 1000
+    record("rerank", timings["rerank_ms"] / 1000)
+
+    # Pair city names with scores, results are already sorted best first
+    city_scores = [
+        (catalog.get(city_id)["name"], float(similarity_scores[0][i]))
+        for i, city_id in enumerate(city_ids[0][:top_k]) if city_id != -1
+    ]
+    return city_scores, timings
+
+def recommend_cities(user_embedding, top_k=None, catalog=None, filter=None, criteria=None, rerank_m=DEFAULT_RERANK_M,
+                     cache=None):
+    """
+    Finds the most similar city embeddings using FAISS.
 
-    # Sort by similarity score (descending order)
-    city_scores = sorted(city_scores, key=lambda x: x[1], reverse=True)
+    Args:
+        user_embedding (np.array or UserVectors): The final user embedding vector, or its sub-vectors.
+        top_k (int, optional): Number of top cities to retrieve. If None, shows all cities.
+        catalog (CityCatalog, optional): Catalog to search. Defaults to the one in the working directory.
+        filter (str, optional): Attribute filter applied inside the search.
+        criteria (dict, optional): Travel criteria extracted by T5, used for re-ranking.
+        rerank_m (int): Number of FAISS candidates to re-rank.
+        cache (SemanticResultCache, optional): Serves users whose embedding is nearly identical
+            to a recent one from the cache, e.g. `get_result_cache()`. Not used for multi-vector users.
 
-    # Return top-k cities if specified
-    if top_k:
-        return city_scores[:top_k]
+    Returns:
+        List of recommended city names with cosine similarity (or re-ranked) scores.
+    """
+    catalog = catalog or get_catalog()
+    if isinstance(user_embedding, UserVectors):
+        cache = None  # the cache is keyed on single vectors
+    if cache is not None:
+        context = context_key(catalog=catalog.catalog_dir, top_k=top_k, filter=filter, criteria=criteria, rerank_m=rerank_m)
+        city_scores = cache.get(user_embedding, context, version=catalog.version)
+        if city_scores is not None:
+            return city_scores
+
+    city_scores, _ = rank_cities(
+        user_embedding, top_k=top_k, catalog=catalog, filter=filter, criteria=criteria, rerank_m=rerank_m
+    )
+    if cache is not None:
+        cache.put(user_embedding, city_scores, context, version=catalog.version)
     return city_scores
 
 def explanation(city_name):
@@ -95,8 +155,9 @@ def get_recommendations_with_time(image_folder_path, prompt, alpha, beta, top_k=
     """
     start = datetime.datetime.now()
     
-    user_embedding = get_user_overall_embedding(image_folder_path, prompt, alpha, beta)
-    recommendations = recommend_cities(user_embedding, top_k=top_k)
+    with span("recommendation"):
+        user_embedding, criteria = get_user_overall_embedding(image_folder_path, prompt, alpha, beta, return_criteria=True)
+        recommendations = recommend_cities(user_embedding, top_k=top_k, criteria=criteria)
 
     end = datetime.datetime.now()
     running_time = end - start
@@ -104,17 +165,18 @@ def get_recommendations_with_time(image_folder_path, prompt, alpha, beta, top_k=
     return recommendations, running_time
 
 # Example Usage
-image_folder_path = os.path.abspath(os.path.join(SCRIPT_DIR, "data/images"))
-prompt = "I am departing from Toronto, Canada in July and will return in August. My budget is adventure travel budget ($1,000 - $3,000 for guided tours), and I prefer local delicacies. I will be traveling solo for one week, and I enjoy hiking. I prefer a mountainous destination with cool ocean breeze weather. I will travel via high-speed train and prefer to use local currency for transactions. My accommodation choice is eco-lodge, and my transportation preference is walking. I want an adventure experience with wildlife conservation focus. My trip should be extreme adventure, and I love indigenous culture. I am interested in Carnival in Rio and will need full travel insurance. I prefer locations with female-friendly and wheelchair access support. For nightlife, I prefer casual bars, and my adventure level is high. I will also be adding guided city tours to my trip."
-alpha = 0.5
-beta = 0.5
-top_k = 5
+if __name__ == "__main__":
+    image_folder_path = os.path.abspath(os.path.join(SCRIPT_DIR, "data/images"))
+    prompt = "I am departing from Toronto, Canada in July and will return in August. My budget is adventure travel budget ($1,000 - $3,000 for guided tours), and I prefer local delicacies. I will be traveling solo for one week, and I enjoy hiking. I prefer a mountainous destination with cool ocean breeze weather. I will travel via high-speed train and prefer to use local currency for transactions. My accommodation choice is eco-lodge, and my transportation preference is walking. I want an adventure experience with wildlife conservation focus. My trip should be extreme adventure, and I love indigenous culture. I am interested in Carnival in Rio and will need full travel insurance. I prefer locations with female-friendly and wheelchair access support. For nightlife, I prefer casual bars, and my adventure level is high. I will also be adding guided city tours to my trip."
+    alpha = 0.5
+    beta = 0.5
+    top_k = 5
 
-recommendations, running_time = get_recommendations_with_time(image_folder_path, prompt, alpha, beta, top_k)
+    recommendations, running_time = get_recommendations_with_time(image_folder_path, prompt, alpha, beta, top_k)
 
-print("\n**Top Recommended Cities:**")
-for city, score in recommendations:
-    print(f"{city} - Similarity Score: {score*100:.2f}/100")
-    #print(f"Explanation: {explanation(city)}\n")
+    print("\n**Top Recommended Cities:**")
+    for city, score in recommendations:
+        print(f"{city} - Similarity Score: {score*100:.2f}/100")
+        #print(f"Explanation: {explanation(city)}\n")
 
-print("Time taken:", running_time)
+    print("Time taken:", running_time)
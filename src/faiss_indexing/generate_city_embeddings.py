@@ -1,80 +1,213 @@
+import argparse
+import hashlib
 import json
-import faiss
 import numpy as np
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from src.embedding_extract.implicit_user_embedding import get_user_overall_embedding
-from src.model.evaluate import evaluate_t5
-from src.model.evaluate import extract_criteria2, user_preferences_to_embedding
+from src.embedding_extract.image_embeddings_extraction import encode_image_files
+from src.faiss_indexing.city_catalog import CityCatalog, atomic_write_json
+from src.faiss_indexing.index_factory import INDEX_KINDS, STORAGE_MODES
+from src.model.evaluate import extract_criteria2, batch_preferences_to_embeddings
 
-def generate_city_embeddings(city_json_file):
+CITY_TEXT_FIELDS = ["description", "weather", "landscape", "transportation", "activities", "cuisine"]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+EMBEDDING_DIM = 512  # CLIP image dimension; MiniLM text vectors are zero-padded up to it
+
+BUILD_DIR = ".city_index_build"
+MANIFEST_FILE = "manifest.json"
+
+
+def city_text_attributes(city):
+    """ Structured text attributes used to embed a city. """
+    return extract_criteria2(city["metadata"], CITY_TEXT_FIELDS)
+
+
+def list_city_images(image_folder):
+    """ Image files in a city's image folder, or an empty list if there is none. """
+    if not image_folder or not os.path.isdir(image_folder):
+        return []
+    return [
+        os.path.join(image_folder, filename)
+        for filename in sorted(os.listdir(image_folder))
+        if filename.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def pad_to_dim(embeddings, dim=EMBEDDING_DIM):
+    """ Zero-pads (or truncates) the rows of an embedding matrix to `dim` columns. """
+    if embeddings.shape[1] < dim:
+        return np.pad(embeddings, ((0, 0), (0, dim - embeddings.shape[1])), mode='constant')
+    return embeddings[:, :dim]
+
+
+def embed_cities(cities, text_batch_size=256, image_batch_size=32):
+    """
+    Embeds a batch of cities, encoding all text attributes and all images in batched passes.
+
+    Cities with images use their mean CLIP image embedding; the others fall back to the
+    mean MiniLM embedding of their text attributes.
+
+    Args:
+        cities (list): City records with `name`, `metadata` and `image_folder`.
+        text_batch_size (int): Sentence transformer batch size.
+        image_batch_size (int): CLIP batch size.
+
+    Returns:
+        tuple: (np.ndarray (N, EMBEDDING_DIM) of normalized float32 embeddings, np.ndarray (N,) validity mask)
+    """
+    text_embeddings = batch_preferences_to_embeddings(
+        [city_text_attributes(city) for city in cities], batch_size=text_batch_size
+    )
+    embeddings = pad_to_dim(text_embeddings.astype("float32"))
+
+    # Encode the images of every city in one batched pass, then mean pool per city
+    image_paths, owners = [], []
+    for row, city in enumerate(cities):
+        paths = list_city_images(city.get("image_folder"))
+        image_paths.extend(paths)
+        owners.extend([row] * len(paths))
+
+    if image_paths:
+        encoded_paths, image_embeddings = encode_image_files(image_paths, batch_size=image_batch_size)
+        owner_of = dict(zip(image_paths, owners))
+        encoded_owners = np.array([owner_of[path] for path in encoded_paths], dtype=np.int64)
+        if len(encoded_owners):
+            sums = np.zeros((len(cities), image_embeddings.shape[1]), dtype="float32")
+            np.add.at(sums, encoded_owners, image_embeddings)
+            counts = np.bincount(encoded_owners, minlength=len(cities))
+            has_images = counts > 0
+            embeddings[has_images] = pad_to_dim(sums[has_images] / counts[has_images, None])
+
+    valid = ~np.isnan(embeddings).any(axis=1) & (np.linalg.norm(np.nan_to_num(embeddings), axis=1) > 0)
+    embeddings[valid] /= np.linalg.norm(embeddings[valid], axis=1, keepdims=True)
+    return embeddings.astype("float32"), valid
+
+
+def source_fingerprint(city_json_file, chunk_size):
+    """ Identifies the input a manifest belongs to, so a changed input starts a fresh build. """
+    with open(city_json_file, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return f"{digest}:{chunk_size}"
+
+
+def load_manifest(build_dir, fingerprint):
+    """ Loads the build manifest if it belongs to the same input, otherwise starts a new one. """
+    manifest_path = os.path.join(build_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("fingerprint") == fingerprint:
+            return manifest
+    return {"fingerprint": fingerprint, "completed_chunks": []}
+
+
+def generate_city_embeddings(city_json_file, output_dir=".", chunk_size=512, text_batch_size=256,
+                             image_batch_size=32, resume=True, index_config=None):
     """
-    Reads synthetic city data, extracts embeddings, and stores them in FAISS.
-    
+    Reads city data, extracts embeddings, and stores them in FAISS.
+
+    Cities are embedded in chunks; every finished chunk is checkpointed to a manifest in
+    `output_dir/.city_index_build`, so an interrupted build resumes at the first unfinished
+    chunk. The index and the id -> metadata table (see `CityCatalog`) are only replaced once
+    the build completes.
+
     Args:
         city_json_file (str): Path to JSON file containing city details.
+        output_dir (str): Directory the index, city names and metadata table are written to.
+        chunk_size (int): Cities per checkpointed chunk.
+        text_batch_size (int): Sentence transformer batch size.
+        image_batch_size (int): CLIP batch size.
+        resume (bool): Reuse finished chunks from a previous, interrupted build.
+        index_config (dict, optional): Index kind and parameters, see `index_factory.py`.
+
+    Returns:
+        CityCatalog: The freshly built catalog.
     """
     with open(city_json_file, "r", encoding="utf-8") as file:
         cities = json.load(file)
 
-    city_embeddings = []
-    city_names = []
-
-    for city in cities:
-        city_name = city["name"]
-        city_metadata = city["metadata"]  # City description
-        image_folder = city["image_folder"]  # Path to images
-        
-        # 🔹 Flatten city metadata into a string
-        #print(str(city_metadata))
-        print(city_name)
-        city_names.append(city_name)
-        #city_metadata_text = " ".join([f"{key}: {value}" for key, value in city_metadata.items()])
-        #print(city_metadata_text)
-        #print(type(city_metadata_text))
-        city_meta_text_structured = extract_criteria2(city_metadata, ["description", "weather", "landscape", "transportation", "activities", "cuisine"])
-        #print(city_meta_text_structured)
-        city_meta_text_embedidng = user_preferences_to_embedding(city_meta_text_structured)
-        #print(city_meta_text_embedidng.shape)
-        # 🔹 Check if images exist
-        image_folder_exists = os.path.exists(image_folder) and os.listdir(image_folder)
-
-        # 🔹 Compute city embedding (gracefully handling missing images or text)
-        if image_folder_exists:
-            city_embedding = get_user_overall_embedding(
-                image_folder_path=image_folder, 
-                prompt_path=None,  # Text should not be passed as a file path
-                alpha=0.5, beta=0.5
-            )
-        else:
-            #city_embedding = evaluate_t5(city_metadata_text)  # Use text-only if no images
-            #print(city_embedding.shape)
-            city_embedding = city_meta_text_embedidng
-        # 🔹 Validate and store only valid embeddings
-        if city_embedding is not None and not np.isnan(city_embedding).any() and len(city_embedding) > 0:
-            city_embeddings.append(city_embedding)
-            city_names.append(city_name)
-        else:
-            print(f"⚠️ Warning: Skipping city '{city_name}' due to invalid embedding!")
+    build_dir = os.path.join(output_dir, BUILD_DIR)
+    os.makedirs(build_dir, exist_ok=True)
+    fingerprint = source_fingerprint(city_json_file, chunk_size)
+    manifest = load_manifest(build_dir, fingerprint) if resume else {"fingerprint": fingerprint, "completed_chunks": []}
+    completed = set(manifest["completed_chunks"])
+
+    num_chunks = (len(cities) + chunk_size - 1) // chunk_size
+    for chunk_id in range(num_chunks):
+        chunk_path = os.path.join(build_dir, f"chunk-{chunk_id:05d}.npz")
+        if chunk_id in completed and os.path.exists(chunk_path):
+            continue
+
+        chunk = cities[chunk_id * chunk_size:(chunk_id + 1) * chunk_size]
+        embeddings, valid = embed_cities(chunk, text_batch_size=text_batch_size, image_batch_size=image_batch_size)
+
+        tmp_path = chunk_path + ".tmp.npz"
+        np.savez(tmp_path, embeddings=embeddings, valid=valid)
+        os.replace(tmp_path, chunk_path)
+
+        completed.add(chunk_id)
+        manifest["completed_chunks"] = sorted(completed)
+        atomic_write_json(os.path.join(build_dir, MANIFEST_FILE), manifest)
+        print(f"Embedded chunk {chunk_id + 1}/{num_chunks}")
+
+    # Assemble the catalog from the checkpointed chunks
+    city_embeddings, city_records = [], []
+    for chunk_id in range(num_chunks):
+        with np.load(os.path.join(build_dir, f"chunk-{chunk_id:05d}.npz")) as chunk_data:
+            embeddings, valid = chunk_data["embeddings"], chunk_data["valid"]
+        for offset, city in enumerate(cities[chunk_id * chunk_size:(chunk_id + 1) * chunk_size]):
+            if not valid[offset]:
+                print(f"⚠️ Warning: Skipping city '{city['name']}' due to invalid embedding!")
+                continue
+            city_records.append({"name": city["name"], "image_folder": city.get("image_folder"), **city["metadata"]})
+            city_embeddings.append(embeddings[offset])
 
     # Ensure at least one valid embedding before proceeding
     if len(city_embeddings) == 0:
         raise ValueError("❌ No valid city embeddings were generated!")
 
-    # Convert to FAISS index
-    city_embeddings = np.array(city_embeddings).astype("float32")
-    index = faiss.IndexFlatL2(city_embeddings.shape[1])
-    index.add(city_embeddings)
+    # Save the id-mapped FAISS index and the id -> metadata table
+    catalog = CityCatalog.build(
+        output_dir, np.array(city_embeddings).astype("float32"), city_records, index_config=index_config
+    )
+
+    # The build is complete, drop the checkpoints
+    for chunk_id in range(num_chunks):
+        os.remove(os.path.join(build_dir, f"chunk-{chunk_id:05d}.npz"))
+    os.remove(os.path.join(build_dir, MANIFEST_FILE))
+    os.rmdir(build_dir)
+
+    print(f"✅ {catalog.index.ntotal} city embeddings stored in FAISS, catalog snapshot {catalog.generation} saved in '{output_dir}'")
+    return catalog
 
-    # Save FAISS index
-    faiss.write_index(index, "city_embeddings.index")
 
-    # Save city names for later retrieval
-    with open("city_names.json", "w") as f:
-        json.dump(city_names, f)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the FAISS city index.")
+    parser.add_argument("--cities", default="data/dataset/us_cities.json")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--text-batch-size", type=int, default=256)
+    parser.add_argument("--image-batch-size", type=int, default=32)
+    parser.add_argument("--no-resume", action="store_true")
+    parser.add_argument("--index-kind", choices=INDEX_KINDS, default="flat")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (ivf_flat / ivf_pq).")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF lists visited per query.")
+    parser.add_argument("--pq-m", type=int, default=None, help="PQ sub-quantizers (ivf_pq).")
+    parser.add_argument("--hnsw-m", type=int, default=None, help="HNSW graph degree.")
+    parser.add_argument("--ef-search", type=int, default=None, help="HNSW search breadth.")
+    parser.add_argument("--storage", choices=STORAGE_MODES, default="fp32",
+                        help="Vector storage: fp32, fp16 or 8-bit scalar quantized.")
+    args = parser.parse_args()
 
-    print("✅ City embeddings stored in FAISS and saved as 'city_embeddings.index'")
+    index_config = {"kind": args.index_kind, "storage": args.storage}
+    for key, value in (("nlist", args.nlist), ("nprobe", args.nprobe), ("pq_m", args.pq_m),
+                       ("hnsw_m", args.hnsw_m), ("efSearch", args.ef_search)):
+        if value is not None:
+            index_config[key] = value
 
-# Run the function
-generate_city_embeddings("data/dataset/us_cities.json")
+    generate_city_embeddings(
+        args.cities, output_dir=args.output_dir, chunk_size=args.chunk_size,
+        text_batch_size=args.text_batch_size, image_batch_size=args.image_batch_size,
+        resume=not args.no_resume, index_config=index_config,
+    )
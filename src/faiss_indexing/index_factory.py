@@ -0,0 +1,184 @@
+import math
+import faiss
+import numpy as np
+
+INDEX_KINDS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+METRICS = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+STORAGE_MODES = {"fp32": "Flat", "fp16": "SQfp16", "sq8": "SQ8"}  # vector codes for flat / IVF / HNSW
+
+DEFAULT_INDEX_CONFIG = {"kind": "flat", "metric": "ip", "storage": "fp32"}
+DEFAULT_NPROBE = 16
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 80
+DEFAULT_EF_SEARCH = 64
+TRAINING_SAMPLE_SIZE = 100_000
+MIN_POINTS_PER_CENTROID = 39  # FAISS warns below this many training points per centroid
+
+
+def default_nlist(n_vectors):
+    """ Rule-of-thumb number of IVF lists for `n_vectors` vectors (about 4 * sqrt(n)). """
+    return max(1, min(65536, int(4 * math.sqrt(max(n_vectors, 1)))))
+
+
+def default_pq_m(dim):
+    """ Largest PQ sub-quantizer count <= dim / 8 that divides `dim`. """
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def resolve_index_config(index_config, dim, n_vectors):
+    """
+    Fills in the defaults of an index config for a catalog of `n_vectors` vectors.
+
+    Args:
+        index_config (dict): At least {"kind": one of INDEX_KINDS}; other keys override defaults.
+        dim (int): Vector dimension.
+        n_vectors (int): Expected number of vectors, used to size the IVF lists.
+
+    Returns:
+        dict: The complete config, as persisted next to the index.
+    """
+    config = dict(DEFAULT_INDEX_CONFIG, **(index_config or {}))
+    kind = config["kind"]
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind '{kind}', expected one of {INDEX_KINDS}")
+    if config["metric"] not in METRICS:
+        raise ValueError(f"Unknown metric '{config['metric']}', expected one of {tuple(METRICS)}")
+    if config["storage"] not in STORAGE_MODES:
+        raise ValueError(f"Unknown storage '{config['storage']}', expected one of {tuple(STORAGE_MODES)}")
+
+    if kind in ("ivf_flat", "ivf_pq"):
+        # Never ask for more lists than the training sample can support
+        max_nlist = max(1, min(n_vectors, TRAINING_SAMPLE_SIZE) // MIN_POINTS_PER_CENTROID)
+        config.setdefault("nlist", min(default_nlist(n_vectors), max_nlist))
+        config.setdefault("nprobe", min(DEFAULT_NPROBE, config["nlist"]))
+    if kind == "ivf_pq":
+        config.setdefault("pq_m", default_pq_m(dim))
+        config.setdefault("pq_nbits", 8)
+    if kind == "hnsw":
+        config.setdefault("hnsw_m", DEFAULT_HNSW_M)
+        config.setdefault("efConstruction", DEFAULT_EF_CONSTRUCTION)
+        config.setdefault("efSearch", DEFAULT_EF_SEARCH)
+    return config
+
+
+def factory_string(config):
+    """ FAISS `index_factory` description for a resolved index config. """
+    kind = config["kind"]
+    codes = STORAGE_MODES[config.get("storage", "fp32")]
+    if kind == "flat":
+        return codes
+    if kind == "ivf_flat":
+        return f"IVF{config['nlist']},{codes}"
+    if kind == "ivf_pq":
+        return f"IVF{config['nlist']},PQ{config['pq_m']}x{config['pq_nbits']}"
+    if codes == "Flat":
+        return f"HNSW{config['hnsw_m']}"
+    return f"HNSW{config['hnsw_m']},{codes}"
+
+
+def metric_of(config):
+    """ FAISS metric type of an index config. """
+    return METRICS[config.get("metric", "l2")]
+
+
+def build_index(config, dim):
+    """
+    Creates an empty (untrained) index for a resolved config.
+
+    `storage` selects how vectors are kept: fp32, fp16 or 8-bit scalar quantized
+    (`IndexScalarQuantizer` codes, 2x / 4x smaller than fp32). It has no effect on IVF-PQ.
+
+    Args:
+        config (dict): Output of `resolve_index_config`.
+        dim (int): Vector dimension.
+
+    Returns:
+        faiss.Index: The new index.
+    """
+    index = faiss.index_factory(dim, factory_string(config), metric_of(config))
+    if config["kind"] == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = config["efConstruction"]
+    return index
+
+
+def with_id_mapping(index, config):
+    """
+    Makes an index addressable by external city ids.
+
+    IVF indexes store the ids in their inverted lists themselves; they get a hashtable direct
+    map so vectors can be removed and reconstructed by id. Wrapping them in `IndexIDMap2`
+    would break on removal, since IVF does not renumber its internal ids. Flat and HNSW
+    indexes are wrapped in `IndexIDMap2`.
+    """
+    if config["kind"] in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+    return faiss.IndexIDMap2(index)
+
+
+def normalize_rows(vectors):
+    """ L2-normalizes float32 row vectors so inner product equals cosine similarity. """
+    vectors = np.array(vectors, dtype="float32", copy=True, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def scores_to_cosine(distances, config):
+    """
+    Converts raw FAISS distances on unit vectors into cosine similarities.
+
+    Inner product already is the cosine; squared L2 distance d relates to it as 1 - d / 2.
+    """
+    if metric_of(config) == faiss.METRIC_INNER_PRODUCT:
+        return distances
+    return 1 - distances / 2
+
+
+def train_index(index, vectors, sample_size=TRAINING_SAMPLE_SIZE, seed=0):
+    """ Trains an index that needs it on a random sample of `vectors`. """
+    if index.is_trained:
+        return index
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if len(vectors) > sample_size:
+        sample = np.random.default_rng(seed).choice(len(vectors), sample_size, replace=False)
+        vectors = vectors[np.sort(sample)]
+    index.train(vectors)
+    return index
+
+
+def apply_search_params(index, config):
+    """
+    Applies the persisted search-time parameters (nprobe / efSearch) to an index.
+
+    Works through wrappers such as `IndexIDMap2`.
+    """
+    parameter_space = faiss.ParameterSpace()
+    for name in ("nprobe", "efSearch"):
+        if name in config:
+            parameter_space.set_index_parameter(index, name, config[name])
+    return index
+
+
+def search_parameters(config, selector=None):
+    """
+    Per-call search parameters carrying an id selector plus the tuned nprobe / efSearch.
+
+    Passing parameters to `search` replaces the index's own settings, so the tuned values
+    have to be repeated here.
+    """
+    kind = config["kind"]
+    if kind in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=config["nprobe"])
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=config["efSearch"])
+    return faiss.SearchParameters(sel=selector)
+
+
+def supports_remove(index):
+    """ Whether the underlying index can delete vectors in place (HNSW cannot). """
+    index = faiss.downcast_index(index)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return not isinstance(inner, faiss.IndexHNSW)
@@ -0,0 +1,78 @@
+"""
+Late-interaction scoring of a user given as several sub-query vectors (one per image and per
+criterion) instead of their mean.
+
+Candidates come from a single FAISS search with the weighted mean of the sub-queries, widened
+to CANDIDATE_POOL cities, so retrieval costs the same one catalog scan as the single-vector
+path (a flat index scans the catalog once per query, so searching with every sub-query would
+cost one scan each). The candidates' stored vectors are then scored against all sub-queries
+in one matrix product and aggregated per city with NumPy:
+
+    max: the best similarity of any sub-query, so a city matching the beach photo ranks high
+         even if it has nothing in common with the mountain photo
+    sum: the weighted sum over sub-queries, with each sub-query's similarities floored at its
+         k-th best among the candidates (the imputation of XTR), so a city only gains from
+         the sub-queries it is among the best matches for
+"""
+import numpy as np
+
+AGGREGATIONS = ("max", "sum")
+CANDIDATE_POOL = 100  # cities fetched by the proxy search and re-scored by late interaction
+
+
+def late_interaction_scores(sub_queries, city_vectors, k, weights=None, aggregation="max"):
+    """
+    Aggregates the similarities of every sub-query to every candidate city.
+
+    Args:
+        sub_queries (np.ndarray): (n_sub, dim) unit sub-query vectors.
+        city_vectors (np.ndarray): (n_cand, dim) unit city vectors.
+        k (int): Number of cities that will be returned, the per-sub-query floor rank for "sum".
+        weights (np.ndarray, optional): (n_sub,) sub-query weights for "sum"; uniform by default.
+        aggregation (str): "max" or "sum".
+
+    Returns:
+        np.ndarray: (n_cand,) scores.
+    """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {aggregation!r}, expected one of {AGGREGATIONS}")
+    similarities = sub_queries @ city_vectors.T
+    if aggregation == "max":
+        return similarities.max(axis=0)
+
+    rank = min(k, similarities.shape[1])
+    floor = np.partition(similarities, -rank, axis=1)[:, -rank]
+    weights = np.ones(len(sub_queries), dtype="float32") if weights is None else np.asarray(weights, dtype="float32")
+    return weights @ np.maximum(similarities, floor[:, None]) / weights.sum()
+
+
+def late_interaction_search(catalog, sub_queries, k, weights=None, aggregation="max", filter=None,
+                            pool=CANDIDATE_POOL):
+    """
+    Retrieves candidates with the weighted-mean proxy and ranks them by their aggregated score.
+
+    Args:
+        catalog (CityCatalog): Catalog to search.
+        sub_queries (np.ndarray): (n_sub, dim) user sub-query vectors.
+        k (int): Number of cities to return.
+        weights (np.ndarray, optional): (n_sub,) sub-query weights; uniform by default.
+        aggregation (str): "max" or "sum".
+        filter (str or np.ndarray, optional): Attribute filter, as for `CityCatalog.search`.
+        pool (int): Number of candidates to re-score, at least k.
+
+    Returns:
+        tuple: (scores (1, k), city ids (1, k)) like `CityCatalog.search`; -1 pads missing results.
+    """
+    sub_queries = catalog.prepare_queries(sub_queries)
+    weights = np.ones(len(sub_queries), dtype="float32") if weights is None else np.asarray(weights, dtype="float32")
+    _, city_ids = catalog.search(weights @ sub_queries, max(k, pool), filter=filter)
+    candidates = city_ids[0][city_ids[0] >= 0]
+
+    top_scores = np.full((1, k), -np.inf, dtype="float32")
+    top_ids = np.full((1, k), -1, dtype="int64")
+    if not len(candidates):
+        return top_scores, top_ids
+    scores = late_interaction_scores(sub_queries, catalog.vectors(candidates), k, weights, aggregation)
+    top = np.argsort(-scores, kind="stable")[:k]
+    top_scores[0, :len(top)], top_ids[0, :len(top)] = scores[top], candidates[top]
+    return top_scores, top_ids
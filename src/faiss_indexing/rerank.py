@@ -0,0 +1,97 @@
+import numpy as np
+
+RERANK_FEATURES = ["purchase_power", "crime_rating", "health_care", "quality_of_life"]
+DEFAULT_RERANK_M = 50  # FAISS candidates re-scored per query
+
+# Feature weights applied to min-max scaled features centred on 0 (a city at the middle of
+# the catalog neither gains nor loses). Similarity keeps the dominant weight.
+SIMILARITY_WEIGHT = 1.0
+BASE_FEATURE_WEIGHTS = {"purchase_power": 0.0, "crime_rating": -0.02, "health_care": 0.01, "quality_of_life": 0.03}
+
+# purchase_power is the cost proxy: budget travellers are pushed toward lower values,
+# luxury travellers toward higher ones.
+BUDGET_KEYWORDS = ("budget", "backpacking", "affordable", "hostel", "under $500", "$20 per day", "$50 per day")
+LUXURY_KEYWORDS = ("luxury", "premium", "business class", "all-inclusive", "$1,000+", "$10,000")
+COST_WEIGHT = 0.08
+
+SAFETY_WEIGHTS = {
+    "low-crime area": 0.12,
+    "female-friendly": 0.08,
+    "family-friendly": 0.08,
+    "politically stable": 0.05,
+    "tourist-friendly": 0.05,
+}
+DEFAULT_SAFETY_WEIGHT = 0.05  # any other stated safety preference
+HEALTH_CARE_KEYWORDS = ("family", "elderly", "wheelchair", "child")
+HEALTH_CARE_WEIGHT = 0.05
+
+
+def cost_direction(text):
+    """ -1 for budget wording, +1 for luxury wording, 0 otherwise. """
+    text = str(text).lower()
+    if any(keyword in text for keyword in LUXURY_KEYWORDS):
+        return 1
+    if any(keyword in text for keyword in BUDGET_KEYWORDS):
+        return -1
+    return 0
+
+
+def criteria_to_weights(criteria):
+    """
+    Derives re-ranking weights from the criteria extracted by T5.
+
+    Uses `budget` and `luxury_rating` for cost, `safety_preference` for crime rating and
+    health care, and keeps a small quality-of-life prior.
+
+    Args:
+        criteria (dict): Output of `extract_user_criteria`.
+
+    Returns:
+        np.ndarray: Weights aligned with RERANK_FEATURES.
+    """
+    weights = dict(BASE_FEATURE_WEIGHTS)
+    criteria = criteria or {}
+
+    direction = cost_direction(criteria.get("luxury_rating", "")) or cost_direction(criteria.get("budget", ""))
+    weights["purchase_power"] += COST_WEIGHT * direction
+    if direction > 0:
+        weights["quality_of_life"] += COST_WEIGHT / 2
+
+    safety = str(criteria.get("safety_preference", "")).lower().strip()
+    if safety:
+        weights["crime_rating"] -= SAFETY_WEIGHTS.get(safety, DEFAULT_SAFETY_WEIGHT)
+    needs = " ".join(str(criteria.get(key, "")) for key in ("safety_preference", "accessibility_needs", "travel_companions"))
+    if any(keyword in needs.lower() for keyword in HEALTH_CARE_KEYWORDS):
+        weights["health_care"] += HEALTH_CARE_WEIGHT
+
+    return np.array([weights[name] for name in RERANK_FEATURES], dtype="float32")
+
+
+def rerank(city_ids, similarities, attributes, feature_weights, top_k):
+    """
+    Re-scores FAISS candidates with similarity plus weighted city features in one NumPy pass.
+
+    score = SIMILARITY_WEIGHT * similarity + (features - 0.5) @ feature_weights
+
+    Args:
+        city_ids (np.ndarray): (nq, M) candidate ids from FAISS, -1 for missing.
+        similarities (np.ndarray): (nq, M) cosine similarities.
+        attributes (CityAttributes): Attribute store of the catalog.
+        feature_weights (np.ndarray): (F,) or (nq, F) weights aligned with RERANK_FEATURES.
+        top_k (int): Results to keep per query.
+
+    Returns:
+        tuple: (city ids (nq, top_k), scores (nq, top_k)), best first; -1 / -inf pad missing results.
+    """
+    features = attributes.normalized(RERANK_FEATURES)  # (num_rows, F)
+    valid = city_ids >= 0
+    candidate_features = features[np.where(valid, city_ids, 0)] - 0.5  # (nq, M, F)
+
+    weights = np.asarray(feature_weights, dtype="float32")
+    weights = weights[:, None, :] if weights.ndim == 2 else weights[None, None, :]
+    scores = SIMILARITY_WEIGHT * similarities + (candidate_features * weights).sum(axis=-1)
+    scores = np.where(valid, scores, -np.inf)
+
+    top_k = min(top_k, scores.shape[1])
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+    return np.take_along_axis(city_ids, order, axis=1), np.take_along_axis(scores, order, axis=1)
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+import faiss
+import numpy as np
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.99  # cosine similarity above which two users get the same cities
+DEFAULT_TTL_S = 600
+DEFAULT_MAX_ENTRIES = 10_000
+NEIGHBOURS_CHECKED = 8  # cached embeddings compared per lookup (entries may differ in context)
+
+
+def context_key(**context):
+    """
+    Stable key for everything besides the embedding that shapes a result (top_k, filter, criteria, ...).
+
+    Boolean id masks are reduced to a digest of their packed bits.
+    """
+    def encode(value):
+        if isinstance(value, np.ndarray):
+            return hashlib.sha1(np.packbits(value.astype(bool)).tobytes()).hexdigest()
+        return value
+    return json.dumps({name: encode(value) for name, value in context.items()}, sort_keys=True, default=str)
+
+
+class SemanticResultCache:
+    """
+    Recommendation cache keyed on neighbourhoods of user embeddings.
+
+    Recent (embedding -> result) entries live in a small exact inner-product index. A lookup
+    returns a stored result when the new embedding's cosine similarity to a stored one reaches
+    `threshold` and both were computed with the same context and catalog version. Entries
+    expire after `ttl_s` seconds; the oldest are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, threshold=DEFAULT_SIMILARITY_THRESHOLD, ttl_s=DEFAULT_TTL_S, max_entries=DEFAULT_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.index = None
+        self.entries = OrderedDict()  # entry id -> (expires_at, context, result), oldest first
+        self.next_id = 0
+        self.version = None
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.array(embedding, dtype="float32", copy=True).reshape(1, -1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_version(self, version):
+        """ Drops every entry once the catalog they were computed from has changed. """
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.clear()
+            self.version = version
+
+    def clear(self):
+        self.index = None
+        self.entries.clear()
+
+    def get(self, embedding, context="", version=None):
+        """
+        Returns the cached result for an embedding close enough to a stored one, else None.
+
+        Args:
+            embedding (np.ndarray): User embedding.
+            context (str): Output of `context_key` for the request.
+            version (int, optional): Version of the catalog the result would come from.
+        """
+        query = self._normalize(embedding)
+        with self.lock:
+            self._check_version(version)
+            if self.index is None or self.index.ntotal == 0 or self.index.d != query.shape[1]:
+                self.misses += 1
+                return None
+            similarities, ids = self.index.search(query, min(NEIGHBOURS_CHECKED, self.index.ntotal))
+            now = time.monotonic()
+            for similarity, entry_id in zip(similarities[0], ids[0]):
+                if entry_id == -1 or similarity < self.threshold:
+                    break  # results are sorted, nothing closer follows
+                expires_at, entry_context, result = self.entries[entry_id]
+                if entry_context == context and expires_at > now:
+                    self.hits += 1
+                    return result
+            self.misses += 1
+            return None
+
+    def put(self, embedding, result, context="", version=None):
+        """ Stores a result, evicting expired entries and the oldest ones beyond `max_entries`. """
+        vector = self._normalize(embedding)
+        with self.lock:
+            self._check_version(version)
+            if self.index is None or self.index.d != vector.shape[1]:
+                self.clear()
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            self._evict(time.monotonic())
+            self.index.add_with_ids(vector, np.array([self.next_id], dtype=np.int64))
+            self.entries[self.next_id] = (time.monotonic() + self.ttl_s, context, result)
+            self.next_id += 1
+
+    def _evict(self, now):
+        """ Removes expired entries, and the oldest ones if the cache is full, in one `remove_ids` call. """
+        stale = []
+        for entry_id, (expires_at, _, _) in self.entries.items():
+            if expires_at > now and len(self.entries) - len(stale) < self.max_entries:
+                break  # entries are oldest first, so the rest are fresher
+            stale.append(entry_id)
+        if stale:
+            self.index.remove_ids(np.array(stale, dtype=np.int64))
+            for entry_id in stale:
+                del self.entries[entry_id]
+            self.evictions += len(stale)
+
+    def stats(self):
+        """ Hit rate and size counters. """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
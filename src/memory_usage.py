@@ -0,0 +1,70 @@
+"""
+Shared vs. private memory of a process and its forked workers, from /proc/<pid>/smaps_rollup (Linux).
+
+RSS counts every resident page a process maps, so it overstates forked workers that still share
+the master's pages copy-on-write. PSS splits each shared page between the processes mapping it,
+and Private_* is what a worker really costs: the memory freed if it exited.
+"""
+import os
+
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+
+def smaps_rollup(pid="self"):
+    """ {field: bytes} from /proc/<pid>/smaps_rollup, None where it is unavailable (not Linux, process gone). """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[0].rstrip(":") in SMAPS_FIELDS and parts[2] == "kB":
+            values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return values
+
+
+def memory_usage(pid="self"):
+    """
+    Memory of one process in bytes.
+
+    Returns:
+        dict: {"rss", "pss", "shared", "private"}, or None if smaps_rollup cannot be read
+    """
+    values = smaps_rollup(pid)
+    if values is None:
+        return None
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+        "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(pid):
+    """ Direct children of a process. """
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children", "r") as f:
+                children += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return sorted(set(children))
+
+
+def worker_memory_report(master_pid):
+    """
+    Memory of a pre-forking server: the master and each of its workers.
+
+    Returns:
+        list: [{"pid", "role", "rss", "pss", "shared", "private"}] for the processes still alive
+    """
+    rows = []
+    for role, pid in [("master", master_pid)] + [("worker", child) for child in child_pids(master_pid)]:
+        usage = memory_usage(pid)
+        if usage is not None:
+            rows.append({"pid": pid, "role": role, **usage})
+    return rows
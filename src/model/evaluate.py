@@ -1,8 +1,41 @@
-from transformers import T5Tokenizer, T5ForConditionalGeneration
-import torch
+import os
 import re
+import sys
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from functools import lru_cache
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.synthetic_data import synthetic_prompt_generator as vocabulary
+from src.tracing import span
+
+SENTENCE_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+# Fine-tuned checkpoint (see the README for the download link); override with T5_MODEL_PATH
+MODEL_PATH = os.environ.get("T5_MODEL_PATH", os.path.join(REPO_ROOT, "fine_tuned_models", "checkpoint-3000"))
+BASE_T5_MODEL = os.environ.get("T5_TOKENIZER", "t5-small")  # must match MODEL_NAME in train.py
+
+CRITERIA_LIST = [
+    "departure_location", "departure_month", "return_month", "budget", "weather_preference",
+    "destination_type", "travel_companions", "preferred_activities", "food_preference", "travel_duration",
+    "accommodation_preference", "transportation_mode", "transportation_preference", "season", "event_interest",
+    "safety_preference", "language_preference", "visa_requirement", "travel_theme",
+    "sustainability_focus", "trip_intensity", "cultural_preference", "shopping_style", "internet_availability",
+    "luxury_rating", "pet_friendly", "wellness_activities", "adventure_level", "nightlife_preferences",
+    "currency_preference", "insurance_preference", "travel_addon"
+]
+
+# Values the fine-tuning data uses for each criterion, for the rule-based parse
+CRITERIA_VOCABULARY = {
+    "departure_location": vocabulary.departure_locations, "budget": vocabulary.budgets,
+    "weather_preference": vocabulary.weather_prefs, "destination_type": vocabulary.dest_types,
+    "travel_companions": vocabulary.companions, "preferred_activities": vocabulary.activities,
+    "food_preference": vocabulary.food_prefs, "travel_duration": vocabulary.durations,
+    "accommodation_preference": vocabulary.accommodations, "transportation_mode": vocabulary.transportation_modes,
+    "season": vocabulary.seasons, "event_interest": vocabulary.events, "safety_preference": vocabulary.safety_prefs,
+    "language_preference": vocabulary.languages, "visa_requirement": vocabulary.visa_reqs,
+    "nightlife_preferences": vocabulary.nightlife_preferences,
+}
+MONTH_PATTERN = "(" + "|".join(["January", "February", "March", "April", "May", "June", "July", "August",
+                                "September", "October", "November", "December"]) + ")"
 
 def clean_and_extract_values(text):
     """
@@ -65,71 +98,183 @@ def extract_criteria2(text, criteria_list):
     return extracted_data
 
 
-def user_preferences_to_embedding(cleaned_output, model_name="sentence-transformers/all-MiniLM-L6-v2"):
+@lru_cache(maxsize=None)
+def vocabulary_patterns():
+    """ Per criterion, one regex matching any of its vocabulary values, longest first. """
+    return {
+        criterion: re.compile(
+            r"(?<!\w)(" + "|".join(re.escape(value) for value in sorted(values, key=len, reverse=True)) + r")(?!\w)",
+            re.IGNORECASE,
+        )
+        for criterion, values in CRITERIA_VOCABULARY.items()
+    }
+
+def rule_based_criteria(input_text):
+    """
+    Extracts criteria by matching the prompt against the fine-tuning vocabulary, in microseconds
+    instead of a T5 generation. Only phrasings the vocabulary covers are found, so this is the
+    fallback when there is no time for T5.
+
+    Returns:
+        dict: {criterion: value} like `extract_user_criteria`.
+    """
+    with span("criteria_rules"):
+        criteria = {}
+        for criterion, pattern in vocabulary_patterns().items():
+            match = pattern.search(input_text)
+            if match:
+                # report the vocabulary spelling, as T5 would
+                criteria[criterion] = next(v for v in CRITERIA_VOCABULARY[criterion] if v.lower() == match.group(1).lower())
+        departure = re.search(rf"\bdepart\w*\b.*?\b{MONTH_PATTERN}\b", input_text, re.IGNORECASE)
+        if departure:
+            criteria["departure_month"] = departure.group(1).capitalize()
+        back = re.search(rf"\breturn\w*\b.*?\b{MONTH_PATTERN}\b", input_text, re.IGNORECASE)
+        if back:
+            criteria["return_month"] = back.group(1).capitalize()
+        return criteria
+
+@lru_cache(maxsize=None)
+def load_sentence_model(model_name=SENTENCE_MODEL_NAME):
+    """ Loads the sentence transformer once per process and reuses it afterwards. """
+    from sentence_transformers import SentenceTransformer
+
+    with span("model_load.minilm"):
+        return SentenceTransformer(model_name)
+
+def preferences_to_texts(cleaned_output):
+    """ Flattens structured attributes into one "key: value" string per attribute. """
+    return [f"{key}: {', '.join(value) if isinstance(value, list) else value}" for key, value in cleaned_output.items()]
+
+def user_preferences_to_embedding(cleaned_output, model_name=SENTENCE_MODEL_NAME, multi_vector=False):
     """
     Converts structured user preferences into a 512D embedding.
+
+    With `multi_vector`, returns the (num_criteria, dim) per-criterion vectors instead of their mean.
     """
-    model = SentenceTransformer(model_name)
+    model = load_sentence_model(model_name)
 
     # Encode each structured attribute separately
-    text_inputs = [f"{key}: {', '.join(value) if isinstance(value, list) else value}" for key, value in cleaned_output.items()]
-    embeddings = model.encode(text_inputs, normalize_embeddings=True)  # Shape: (num_features, 512)
+    text_inputs = preferences_to_texts(cleaned_output)
+    with span("minilm_encode"):
+        embeddings = model.encode(text_inputs, normalize_embeddings=True)  # Shape: (num_features, 512)
+
+    if multi_vector:
+        return embeddings
 
     # Mean pooling for final 512D embedding
     combined_embedding = np.mean(embeddings, axis=0)  # Shape: (512,)
 
     return combined_embedding
 
-def evaluate_t5(input_text):
+def batch_preferences_to_embeddings(cleaned_outputs, model_name=SENTENCE_MODEL_NAME, batch_size=256):
     """
-    Takes an input paragraph, extracts structured attributes using T5, and returns a 512D embedding.
+    Converts many structured preference dicts into embeddings with a single encoder pass.
+
+    Args:
+        cleaned_outputs (list): Structured attribute dicts.
+        model_name (str): Sentence transformer to use.
+        batch_size (int): Encoder batch size.
+
+    Returns:
+        np.ndarray: (len(cleaned_outputs), dim) mean-pooled embeddings. Rows for empty dicts are NaN.
+    """
+    model = load_sentence_model(model_name)
+    texts_per_item = [preferences_to_texts(cleaned_output) for cleaned_output in cleaned_outputs]
+    flat_texts = [text for texts in texts_per_item for text in texts]
+    dim = model.get_sentence_embedding_dimension()
+    if not flat_texts:
+        return np.full((len(cleaned_outputs), dim), np.nan, dtype="float32")
+
+    with span("minilm_encode"):
+        embeddings = model.encode(flat_texts, batch_size=batch_size, normalize_embeddings=True)
+
+    # Mean pool each item's attribute vectors
+    counts = np.array([len(texts) for texts in texts_per_item])
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    pooled = np.full((len(cleaned_outputs), dim), np.nan, dtype="float32")
+    non_empty = counts > 0
+    pooled[non_empty] = np.add.reduceat(embeddings, offsets[non_empty], axis=0) / counts[non_empty, None]
+    return pooled
+
+@lru_cache(maxsize=None)
+def load_t5_model(model_path=MODEL_PATH, base_model=BASE_T5_MODEL):
+    """
+    Loads the fine-tuned T5 model and its tokenizer once per process.
+
+    Returns:
+        tuple: (model, tokenizer, device)
+    """
+    import torch
+    from transformers import T5Tokenizer, T5ForConditionalGeneration
+
+    with span("model_load.t5"):
+        # weights go straight from the (mmapped) safetensors file into the model, no second state-dict copy
+        model = T5ForConditionalGeneration.from_pretrained(model_path, low_cpu_mem_usage=True)
+        tokenizer = T5Tokenizer.from_pretrained(base_model, legacy=True)
+
+        model.eval()
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model.to(device)
+    return model, tokenizer, device
+
+def extract_user_criteria(input_text, max_time=None):
     """
-    MODEL_PATH = "/home/derrick/Documents/Wander Whisper/Wander-Whisper/fine_tuned_models/checkpoint-3000"
-    BASE_T5_MODEL = "t5-base"
+    Takes an input paragraph and extracts the structured travel criteria using T5.
+
+    With `max_time` (seconds), generation stops when that time is up and the criteria completed
+    so far are returned.
 
-    # Load T5 model and tokenizer
-    model = T5ForConditionalGeneration.from_pretrained(MODEL_PATH)
-    tokenizer = T5Tokenizer.from_pretrained(BASE_T5_MODEL, legacy=True)
+    Returns:
+        dict: {criterion: value} for the criteria in CRITERIA_LIST found in the generated text.
+    """
+    import torch
 
-    model.eval()
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
+    model, tokenizer, device = load_t5_model()
 
     input_text = clean_and_extract_values(input_text)
 
-    criteria_list = [
-        "departure_location", "departure_month", "return_month", "budget", "weather_preference",
-        "destination_type", "travel_companions", "preferred_activities", "food_preference", "travel_duration",
-        "accommodation_preference", "transportation_mode", "transportation_preference", "season", "event_interest",
-        "safety_preference", "language_preference", "visa_requirement", "travel_theme",
-        "sustainability_focus", "trip_intensity", "cultural_preference", "shopping_style", "internet_availability",
-        "luxury_rating", "pet_friendly", "wellness_activities", "adventure_level", "nightlife_preferences",
-        "currency_preference", "insurance_preference", "travel_addon"
-    ]
-
-    # Tokenize input
-    inputs = tokenizer(input_text, return_tensors="pt", padding=True, truncation=True, max_length=512)
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-
-    # Generate structured attributes
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_length=256,
-            #num_beams=5,
-            #repetition_penalty=1.2
-        )
+    with span("t5_generate"):
+        # Tokenize input
+        inputs = tokenizer(input_text, return_tensors="pt", padding=True, truncation=True, max_length=512)
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+
+        # Generate structured attributes
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_length=256,
+                max_time=max_time,
+                #num_beams=5,
+                #repetition_penalty=1.2
+            )
+
+        # Decode generated text
+        generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
 
-    # Decode generated text
-    generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    
     # Extract structured attributes
-    structured_output = extract_criteria2(generated_text, criteria_list)
-    #print(structured_output)
-    #print(structured_output)
+    with span("criteria_parse"):
+        return extract_criteria2(generated_text, CRITERIA_LIST)
+
+def evaluate_t5(input_text, return_criteria=False, max_time=None, multi_vector=False):
+    """
+    Takes an input paragraph, extracts structured attributes using T5, and returns a 512D embedding.
+
+    Args:
+        input_text (str): The user's travel prompt.
+        return_criteria (bool): Also return the extracted criteria dict.
+        max_time (float, optional): Cap on the T5 generation time in seconds.
+        multi_vector (bool): Return the per-criterion vectors instead of their mean.
+
+    Returns:
+        np.ndarray, or (np.ndarray, dict) when `return_criteria` is set.
+    """
+    structured_output = extract_user_criteria(input_text, max_time=max_time)
+
     # Convert structured attributes into a 512D embedding
-    user_embedding = user_preferences_to_embedding(structured_output)
+    user_embedding = user_preferences_to_embedding(structured_output, multi_vector=multi_vector)
 
+    if return_criteria:
+        return user_embedding, structured_output
     return user_embedding
 
 # Example usage
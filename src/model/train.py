@@ -1,46 +1,251 @@
 from datasets import load_from_disk
-from transformers import T5Tokenizer, T5ForConditionalGeneration, Trainer, TrainingArguments
+from transformers import T5TokenizerFast, T5ForConditionalGeneration, Trainer, TrainingArguments, TrainerCallback
+from transformers.trainer_utils import get_last_checkpoint
+from torch.utils.data import DataLoader, Sampler
+import argparse
+import os
+import random
+import sys
+import time
+import torch
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.preprocess.preprocessing import get_data_collator
 
-def train_t5():
-    MODEL_NAME = "t5-small"
-    model = T5ForConditionalGeneration.from_pretrained(MODEL_NAME)
-    tokenizer = T5Tokenizer.from_pretrained(MODEL_NAME)
+MODEL_NAME = "t5-small"
+DATASET_PATH = "./synthetic_prompts/tokenized_synthetic_travel_data"
+OUTPUT_DIR = "fine_tuned_models"
+FINAL_MODEL_DIR = "fine_tuned_models/fine_tuned_t5_small_travel_3_epochs"
+TOKENIZER_DIR = "fine_tuned_models/t5_tokenizer"
 
-    # ✅ Save tokenizer at the beginning before training starts
-    tokenizer.save_pretrained("fine_tuned_models/t5_tokenizer")
 
-    # ✅ Load dataset correctly
-    dataset = load_from_disk("./synthetic_prompts/tokenized_synthetic_travel_data")
+def select_precision(precision="auto"):
+    """
+    Picks mixed-precision flags that the current hardware can actually run.
 
-    # ✅ Explicitly reference train and validation splits
+    fp16 is only available on CUDA; on CPU-only boxes the choice is limited to bf16 and fp32.
+
+    Args:
+        precision (str): One of 'auto', 'fp32', 'fp16' or 'bf16'.
+
+    Returns:
+        dict: `fp16`, `bf16` and `use_cpu` keyword arguments for TrainingArguments.
+    """
+    has_cuda = torch.cuda.is_available()
+    bf16_supported = torch.cuda.is_bf16_supported() if has_cuda else True
+
+    if precision == "auto":
+        if has_cuda:
+            precision = "bf16" if bf16_supported else "fp16"
+        else:
+            precision = "fp32"
+    elif precision == "fp16" and not has_cuda:
+        print("⚠️ fp16 needs a CUDA device, falling back to bf16 on CPU.")
+        precision = "bf16"
+    elif precision == "bf16" and not bf16_supported:
+        print("⚠️ bf16 is not supported on this GPU, falling back to fp16.")
+        precision = "fp16"
+
+    return {"fp16": precision == "fp16", "bf16": precision == "bf16", "use_cpu": not has_cuda}
+
+
+def pack_batches_by_tokens(lengths, max_tokens, seed=0):
+    """
+    Greedily packs examples of similar length into batches under a padded-token budget.
+
+    T5 in transformers has no segment-aware attention, so packing is done at the batch level:
+    each batch holds as many examples as fit in `max_tokens` once padded to its longest member.
+
+    Args:
+        lengths (list): Sequence length of every example.
+        max_tokens (int): Budget of padded tokens per batch.
+        seed (int): Seed for shuffling the batch order.
+
+    Returns:
+        list: Batches as lists of example indices.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, current, longest = [], [], 0
+    for idx in order:
+        longest_if_added = max(longest, lengths[idx])
+        if current and longest_if_added * (len(current) + 1) > max_tokens:
+            batches.append(current)
+            current, longest_if_added = [], lengths[idx]
+        current.append(idx)
+        longest = longest_if_added
+    if current:
+        batches.append(current)
+
+    random.Random(seed).shuffle(batches)
+    return batches
+
+
+class PackedBatchSampler(Sampler):
+    """
+    Batch sampler over token-packed batches that reshuffles the batch order every epoch.
+
+    The batches themselves are packed once; each epoch visits them in the order given by
+    `seed + epoch`. The Trainer (through accelerate) calls `set_epoch` before every epoch.
+    """
+
+    def __init__(self, lengths, max_tokens, seed=0):
+        self.batches = pack_batches_by_tokens(lengths, max_tokens, seed=seed)
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        order = list(range(len(self.batches)))
+        random.Random(self.seed + self.epoch).shuffle(order)
+        for batch in order:
+            yield self.batches[batch]
+
+
+class PackedBatchTrainer(Trainer):
+    """ Trainer whose training batches are packed up to a token budget instead of a fixed size. """
+
+    def __init__(self, *args, max_tokens_per_batch=4096, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_tokens_per_batch = max_tokens_per_batch
+
+    def get_train_dataloader(self):
+        dataset = self._remove_unused_columns(self.train_dataset, description="training")
+        batch_sampler = PackedBatchSampler(
+            self.train_dataset["input_length"], self.max_tokens_per_batch, seed=self.args.seed
+        )
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
+
+
+class ThroughputCallback(TrainerCallback):
+    """ Logs step time and samples per second for every optimizer step. """
+
+    def __init__(self, samples_per_step):
+        self.samples_per_step = samples_per_step
+        self.step_start = None
+        self.total_time = 0.0
+        self.total_steps = 0
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self.step_start = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.step_start is None:
+            return
+        self.total_time += time.perf_counter() - self.step_start
+        self.total_steps += 1
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is None or self.total_steps == 0:
+            return
+        step_time = self.total_time / self.total_steps
+        logs["step_time_s"] = round(step_time, 4)
+        logs["samples_per_s"] = round(self.samples_per_step / step_time, 2)
+        self.total_time, self.total_steps = 0.0, 0
+
+
+def train_t5(model_name=MODEL_NAME, dataset_path=DATASET_PATH, output_dir=OUTPUT_DIR, num_epochs=3,
+             batch_size=16, gradient_accumulation_steps=1, precision="auto", group_by_length=True,
+             pack=False, max_tokens_per_batch=4096, resume=True):
+    """
+    Fine-tunes T5 on the tokenized synthetic travel prompts.
+
+    Args:
+        model_name (str): Base checkpoint to fine-tune.
+        dataset_path (str): Output directory of `src/preprocess/preprocessing.py`.
+        output_dir (str): Directory for checkpoints.
+        num_epochs (int): Number of training epochs.
+        batch_size (int): Per-device batch size (ignored for training when `pack` is set).
+        gradient_accumulation_steps (int): Optimizer steps are taken every N batches.
+        precision (str): 'auto', 'fp32', 'fp16' or 'bf16'; see `select_precision`.
+        group_by_length (bool): Draw batches from similarly sized prompts.
+        pack (bool): Pack training batches up to `max_tokens_per_batch` padded tokens.
+        max_tokens_per_batch (int): Token budget per packed batch.
+        resume (bool): Resume from the latest checkpoint in `output_dir` if there is one.
+    """
+    model = T5ForConditionalGeneration.from_pretrained(model_name)
+    tokenizer = T5TokenizerFast.from_pretrained(model_name)
+
+    # Save tokenizer at the beginning before training starts
+    tokenizer.save_pretrained(TOKENIZER_DIR)
+
+    dataset = load_from_disk(dataset_path)
     train_dataset = dataset["train"]
     val_dataset = dataset["validation"]
 
     training_args = TrainingArguments(
-        output_dir="fine_tuned_models",
-        num_train_epochs=3,  
-        per_device_train_batch_size=2,
-        per_device_eval_batch_size=2,
-        gradient_accumulation_steps=4,
-        evaluation_strategy="epoch",
+        output_dir=output_dir,
+        num_train_epochs=num_epochs,
+        per_device_train_batch_size=batch_size,
+        per_device_eval_batch_size=batch_size,
+        gradient_accumulation_steps=gradient_accumulation_steps,
+        eval_strategy="epoch",
         save_strategy="epoch",
         logging_dir="logs",
-        fp16=True,
+        logging_steps=50,
+        group_by_length=group_by_length and not pack,
+        length_column_name="input_length",
+        dataloader_num_workers=min(4, os.cpu_count() or 1),
+        **select_precision(precision),
     )
 
-    trainer = Trainer(
+    samples_per_batch = batch_size
+    if pack:
+        lengths = train_dataset["input_length"]
+        samples_per_batch = len(lengths) / max(len(pack_batches_by_tokens(lengths, max_tokens_per_batch)), 1)
+
+    trainer_cls = PackedBatchTrainer if pack else Trainer
+    trainer_kwargs = {"max_tokens_per_batch": max_tokens_per_batch} if pack else {}
+    trainer = trainer_cls(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
+        data_collator=get_data_collator(tokenizer, model=model),
+        callbacks=[ThroughputCallback(samples_per_batch * gradient_accumulation_steps)],
+        **trainer_kwargs,
     )
 
-    trainer.train()
+    last_checkpoint = get_last_checkpoint(output_dir) if resume and os.path.isdir(output_dir) else None
+    if last_checkpoint:
+        print(f"🔁 Resuming from {last_checkpoint}")
+    train_result = trainer.train(resume_from_checkpoint=last_checkpoint)
+    print(train_result.metrics)
 
-    # ✅ Save final trained model
-    model.save_pretrained("fine_tuned_models/fine_tuned_t5_small_travel_3_epochs")
+    # Save final trained model together with its tokenizer
+    model.save_pretrained(FINAL_MODEL_DIR)
+    tokenizer.save_pretrained(FINAL_MODEL_DIR)
 
     print("✅ Model trained and saved! Tokenizer was already saved at the beginning.")
 
 if __name__ == "__main__":
-    train_t5()
+    parser = argparse.ArgumentParser(description="Fine-tune T5 on the synthetic travel prompts.")
+    parser.add_argument("--model-name", default=MODEL_NAME)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--grad-accum", type=int, default=1)
+    parser.add_argument("--precision", choices=["auto", "fp32", "fp16", "bf16"], default="auto")
+    parser.add_argument("--no-group-by-length", action="store_true")
+    parser.add_argument("--pack", action="store_true", help="Pack batches up to --max-tokens padded tokens.")
+    parser.add_argument("--max-tokens", type=int, default=4096)
+    parser.add_argument("--no-resume", action="store_true")
+    args = parser.parse_args()
+
+    train_t5(
+        model_name=args.model_name, dataset_path=args.dataset, output_dir=args.output_dir,
+        num_epochs=args.epochs, batch_size=args.batch_size, gradient_accumulation_steps=args.grad_accum,
+        precision=args.precision, group_by_length=not args.no_group_by_length, pack=args.pack,
+        max_tokens_per_batch=args.max_tokens, resume=not args.no_resume,
+    )
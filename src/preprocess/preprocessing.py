@@ -1,55 +1,158 @@
-from datasets import Dataset, DatasetDict
-from transformers import T5Tokenizer
+from datasets import Dataset, DatasetDict, load_dataset
+from transformers import T5TokenizerFast, DataCollatorForSeq2Seq
+import argparse
+import glob
 import json
-from sklearn.model_selection import train_test_split
+import os
 
-def tokenize_function(examples, tokenizer):
+MAX_SOURCE_LENGTH = 512
+MAX_TARGET_LENGTH = 256
+LABEL_PAD_TOKEN_ID = -100  # ignored by the cross-entropy loss
+
+def tokenize_function(examples, tokenizer, max_source_length=MAX_SOURCE_LENGTH, max_target_length=MAX_TARGET_LENGTH):
+    """
+    Tokenizes a batch of prompts and their expected outputs without padding.
+
+    Sequences are stored at their natural length together with `input_length` and
+    `label_length` columns, so batches can be padded to the longest member at train
+    time instead of to a fixed `max_length`.
+    """
     target_text = [json.dumps(output) for output in examples["output"]]
-    #print("Target text: ", target_text[:1])
 
     # Tokenize input
     model_inputs = tokenizer(
         examples["prompt"],
-        max_length=512,
-        padding="max_length",
+        max_length=max_source_length,
         truncation=True
     )
-    
+
     # Tokenize output
     labels = tokenizer(
-        target_text,
-        max_length=256,
-        padding="max_length",
+        text_target=target_text,
+        max_length=max_target_length,
         truncation=True
     )
 
     model_inputs["labels"] = labels["input_ids"]
+    model_inputs["input_length"] = [len(ids) for ids in model_inputs["input_ids"]]
+    model_inputs["label_length"] = [len(ids) for ids in labels["input_ids"]]
     return model_inputs
 
-if __name__ == "__main__":
-    tokenizer = T5Tokenizer.from_pretrained("t5-base")
-    
-    with open("./synthetic_prompts/expanded_synthetic_travel_data.json", "r") as f:
+def get_data_collator(tokenizer, model=None, pad_to_multiple_of=8):
+    """
+    Builds the collator that pads each batch dynamically to its longest sequence.
+
+    Label padding is filled with -100 so pad tokens are not counted in the loss. Use it
+    together with `group_by_length=True` (length column `input_length`) so that batches
+    are drawn from similarly sized prompts and very little padding is added.
+
+    Args:
+        tokenizer: Tokenizer used during preprocessing.
+        model (optional): Seq2seq model, used to prepare `decoder_input_ids`.
+        pad_to_multiple_of (int, optional): Round padded lengths up for tensor-core friendly shapes.
+
+    Returns:
+        DataCollatorForSeq2Seq: The dynamic padding collator.
+    """
+    return DataCollatorForSeq2Seq(
+        tokenizer,
+        model=model,
+        padding="longest",
+        label_pad_token_id=LABEL_PAD_TOKEN_ID,
+        pad_to_multiple_of=pad_to_multiple_of,
+    )
+
+def load_raw_dataset(input_path):
+    """
+    Loads the synthetic prompt data as a Hugging Face Dataset.
+
+    Accepts the legacy single JSON file ({"data": [...]}) or a directory of JSONL / Parquet
+    shards written by `src/synthetic_data/synthetic_prompt_generator.py`.
+    """
+    if os.path.isdir(input_path):
+        for ext, builder in (("jsonl", "json"), ("parquet", "parquet")):
+            data_files = sorted(glob.glob(os.path.join(input_path, f"*.{ext}")))
+            if data_files:
+                return load_dataset(builder, data_files=data_files, split="train")
+        raise FileNotFoundError(f"No .jsonl or .parquet shards found in {input_path}")
+
+    with open(input_path, "r") as f:
         raw_data = json.load(f)['data']
+    return Dataset.from_list(raw_data)
 
-    
-    print(raw_data[0])
-    # Split into train (80%) and validation (20%)
-    train_data, val_data = train_test_split(raw_data, test_size=0.2, random_state=42)
+def preprocess(input_path, output_path, tokenizer_name="t5-base", num_proc=None, num_shards=None,
+               max_source_length=MAX_SOURCE_LENGTH, max_target_length=MAX_TARGET_LENGTH):
+    """
+    Tokenizes the raw synthetic prompts and saves length-sorted, sharded Arrow splits.
+
+    Args:
+        input_path (str): Path to the raw synthetic prompt data.
+        output_path (str): Directory the tokenized DatasetDict is saved to.
+        tokenizer_name (str): Name or path of the (fast) T5 tokenizer.
+        num_proc (int, optional): Tokenization worker processes. Defaults to all cores.
+        num_shards (int, optional): Arrow shards per split. Defaults to one per worker.
+        max_source_length (int): Truncation length for prompts.
+        max_target_length (int): Truncation length for labels.
 
-    # Convert to Hugging Face Dataset
-    train_dataset = Dataset.from_list(train_data)
-    val_dataset = Dataset.from_list(val_data)
+    Returns:
+        DatasetDict: The tokenized train and validation splits.
+    """
+    num_proc = num_proc or os.cpu_count() or 1
+    num_shards = num_shards or num_proc
+    tokenizer = T5TokenizerFast.from_pretrained(tokenizer_name)
 
-    
+    raw_dataset = load_raw_dataset(input_path)
+    print(raw_dataset[0])
+
+    # Split into train (80%) and validation (20%)
+    splits = raw_dataset.train_test_split(test_size=0.2, seed=42)
+    dataset_dict = DatasetDict({"train": splits["train"], "validation": splits["test"]})
 
+    # Tokenize both datasets in parallel
+    dataset_dict = dataset_dict.map(
+        tokenize_function,
+        batched=True,
+        num_proc=num_proc,
+        fn_kwargs={
+            "tokenizer": tokenizer,
+            "max_source_length": max_source_length,
+            "max_target_length": max_target_length,
+        },
+        desc="Tokenizing",
+    )
 
-    # Tokenize both datasets
-    train_dataset = train_dataset.map(lambda x: tokenize_function(x, tokenizer), batched=True)
-    val_dataset = val_dataset.map(lambda x: tokenize_function(x, tokenizer), batched=True)
+    # Sort by length so every shard holds a contiguous length bucket
+    dataset_dict = DatasetDict({
+        split: dataset.sort("input_length").flatten_indices()
+        for split, dataset in dataset_dict.items()
+    })
 
     # Save tokenized datasets
-    dataset_dict = DatasetDict({"train": train_dataset, "validation": val_dataset})
-    
-    dataset_dict.save_to_disk("./synthetic_prompts/tokenized_synthetic_travel_data")
+    dataset_dict.save_to_disk(
+        output_path,
+        num_shards={split: min(num_shards, max(len(dataset), 1)) for split, dataset in dataset_dict.items()},
+        num_proc=num_proc,
+    )
+    return dataset_dict
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokenize synthetic travel prompts for T5 fine-tuning.")
+    parser.add_argument("--input", default="./synthetic_prompts/synthetic_travel_data",
+                        help="Directory of generated JSONL/Parquet shards or a legacy JSON file.")
+    parser.add_argument("--output", default="./synthetic_prompts/tokenized_synthetic_travel_data")
+    parser.add_argument("--tokenizer", default="t5-base")
+    parser.add_argument("--num-proc", type=int, default=None)
+    parser.add_argument("--num-shards", type=int, default=None)
+    parser.add_argument("--max-source-length", type=int, default=MAX_SOURCE_LENGTH)
+    parser.add_argument("--max-target-length", type=int, default=MAX_TARGET_LENGTH)
+    args = parser.parse_args()
+
+    dataset_dict = preprocess(
+        args.input, args.output, tokenizer_name=args.tokenizer, num_proc=args.num_proc,
+        num_shards=args.num_shards, max_source_length=args.max_source_length,
+        max_target_length=args.max_target_length,
+    )
+    for split, dataset in dataset_dict.items():
+        lengths = dataset["input_length"]
+        print(f"{split}: {len(dataset)} samples, mean prompt length {sum(lengths) / max(len(lengths), 1):.1f} tokens")
+    print("✅ Tokenized dataset saved!")
@@ -0,0 +1,169 @@
+"""
+Low-overhead sampling profiler for single requests or pipeline runs.
+
+    with capture("find_recommended_cities") as profile:
+        ...
+    save_capture(profile, "Profiles", capture_id)
+
+While a capture is active, a background thread samples the stacks of every thread working
+for it every few milliseconds: the thread that opened it and any executor thread running a
+callable wrapped with `tracing.in_context`. Stacks are stored in the collapsed format
+("root;caller;callee count"), which flamegraph.pl and https://www.speedscope.app read directly.
+"""
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from src.tracing import bound_thread, thread_context
+
+SAMPLE_INTERVAL_S = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", 5)) / 1000
+MAX_STACK_DEPTH = 128
+COLLAPSED_EXTENSION = ".folded"
+META_EXTENSION = ".json"
+
+_current_capture = contextvars.ContextVar("current_capture", default=None)
+
+
+class Capture:
+    """ Stack samples of one request, counted per distinct stack. """
+
+    def __init__(self, name):
+        self.name = name
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, stack):
+        with self.lock:
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapsed_stack(frame, thread_name):
+    """ "thread;outermost;...;innermost" for a frame, dropping the outer frames of very deep stacks. """
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+class Sampler:
+    """ Background thread sampling all threads bound to an active capture; idle while there is none. """
+
+    def __init__(self, interval_s=SAMPLE_INTERVAL_S):
+        self.interval_s = interval_s
+        self.active = set()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def add(self, capture):
+        with self.lock:
+            self.active.add(capture)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="profiler-sampler", daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def remove(self, capture):
+        with self.lock:
+            self.active.discard(capture)
+
+    def run(self):
+        own_id = threading.get_ident()
+        while True:
+            with self.lock:
+                idle = not self.active
+                if idle:
+                    self.wake.clear()
+            if idle:
+                self.wake.wait()
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                context = thread_context(thread_id)
+                capture = context.get(_current_capture) if context is not None else None
+                if capture is not None and capture in self.active:
+                    capture.add(collapsed_stack(frame, names.get(thread_id, str(thread_id))))
+            time.sleep(self.interval_s)
+
+
+_sampler = Sampler()
+
+
+@contextlib.contextmanager
+def capture(name, bind_thread=True):
+    """
+    Samples the current request until the block exits.
+
+    Args:
+        name (str): Label of the capture, e.g. the view name.
+        bind_thread (bool): Also sample the calling thread. Turn this off on an event loop
+            thread, which is shared by many requests; executor work is sampled either way.
+    """
+    profile = Capture(name)
+    token = _current_capture.set(profile)
+    _sampler.add(profile)
+    try:
+        if bind_thread:
+            with bound_thread(contextvars.copy_context()):
+                yield profile
+        else:
+            yield profile
+    finally:
+        _sampler.remove(profile)
+        _current_capture.reset(token)
+
+
+def save_capture(profile, directory, capture_id, max_captures=None, **meta):
+    """
+    Writes `<capture_id>.folded` with the collapsed stacks and `<capture_id>.json` with the
+    metadata, then deletes the oldest captures beyond `max_captures`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    meta = {"id": capture_id, "name": profile.name, "samples": profile.samples,
+            "sample_interval_ms": SAMPLE_INTERVAL_S * 1000, "captured_at": time.time(), **meta}
+    for extension, content in ((COLLAPSED_EXTENSION, profile.collapsed()), (META_EXTENSION, json.dumps(meta))):
+        path = os.path.join(directory, capture_id + extension)
+        with open(path + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+    if max_captures:
+        for old in list_captures(directory)[max_captures:]:
+            for extension in (COLLAPSED_EXTENSION, META_EXTENSION):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(directory, old["id"] + extension))
+
+
+def list_captures(directory, limit=None):
+    """ Metadata of the stored captures, newest first. """
+    if not os.path.isdir(directory):
+        return []
+    captures = []
+    for filename in os.listdir(directory):
+        if filename.endswith(META_EXTENSION):
+            try:
+                with open(os.path.join(directory, filename), "r") as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    captures.sort(key=lambda meta: meta.get("captured_at", 0), reverse=True)
+    return captures[:limit] if limit else captures
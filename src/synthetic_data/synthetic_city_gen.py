@@ -1,5 +1,8 @@
+import argparse
 import json
 import random
+import zlib
+import numpy as np
 
 # Define city names
 city_names = [
@@ -27,26 +30,97 @@ activities = ["sightseeing", "hiking", "scuba diving", "skiing", "shopping", "fo
 local_cuisines = ["French", "Japanese", "Italian", "Mediterranean", "Asian fusion", "Street food culture"]
 image_folders = ["./images/paris", "./images/nyc", "./images/tokyo", "./images/london"]  # Example image paths
 
-# Generate synthetic city data
-cities_data = []
-
-for city in city_names:
-    city_data = {
-        "name": city,
-        "metadata": {
-            "description": random.choice(city_descriptions),
-            "weather": random.choice(weather_types),
-            "landscape": random.choice(landscapes),
-            "transportation": random.choice(transportation),
-            "activities": random.sample(activities, 2),  # Select 2 random activities
-            "cuisine": random.choice(local_cuisines),
-        },
-        "image_folder": random.choice(image_folders)  # Assign random image folder
-    }
-    cities_data.append(city_data)
-
-# Save to JSON
-with open("synthetic_city_database.json", "w") as f:
-    json.dump(cities_data, f, indent=4)
-
-print("✅ Synthetic city database generated and saved as 'synthetic_city_database.json'")
+CITY_VECTOR_NOISE = 0.5  # spread of cities around the sum of their attribute directions
+
+def generate_cities(count=None, seed=None):
+    """
+    Generates synthetic city records.
+
+    Args:
+        count (int, optional): Number of cities. Defaults to one per name in `city_names`;
+            larger catalogs get numbered names ("Paris 12").
+        seed (int, optional): Seed for reproducible output.
+
+    Returns:
+        list: City records with `name`, `metadata` and `image_folder`.
+    """
+    rng = random.Random(seed)
+    count = len(city_names) if count is None else count
+
+    cities_data = []
+    for i in range(count):
+        city = city_names[i % len(city_names)]
+        if count > len(city_names):
+            city = f"{city} {i // len(city_names)}"
+        city_data = {
+            "name": city,
+            "metadata": {
+                "description": rng.choice(city_descriptions),
+                "weather": rng.choice(weather_types),
+                "landscape": rng.choice(landscapes),
+                "transportation": rng.choice(transportation),
+                "activities": rng.sample(activities, 2),  # Select 2 random activities
+                "cuisine": rng.choice(local_cuisines),
+            },
+            "image_folder": rng.choice(image_folders)  # Assign random image folder
+        }
+        cities_data.append(city_data)
+    return cities_data
+
+
+def attribute_direction(value, dim, seed):
+    """ Fixed random unit vector for one attribute value. """
+    direction = np.random.default_rng([seed, zlib.crc32(value.encode("utf-8"))]).standard_normal(dim)
+    return direction / np.linalg.norm(direction)
+
+
+def synthetic_city_vectors(cities, dim=512, seed=0, noise=CITY_VECTOR_NOISE):
+    """
+    Turns synthetic cities into normalized embedding-like vectors without running any model.
+
+    Each attribute value maps to a fixed random direction; a city vector is the sum of its
+    attributes' directions plus Gaussian noise. Cities that share attributes end up close
+    together, which gives the clustered structure of real embeddings for index benchmarks.
+
+    Args:
+        cities (list): Output of `generate_cities`.
+        dim (int): Vector dimension.
+        seed (int): Seed for the attribute directions and the noise.
+        noise (float): Norm of the per-city noise relative to the norm of the attribute sum.
+
+    Returns:
+        np.ndarray: (len(cities), dim) float32 unit vectors.
+    """
+    directions = {}
+    vectors = np.zeros((len(cities), dim), dtype="float32")
+    for row, city in enumerate(cities):
+        metadata = city["metadata"]
+        values = [metadata["description"], metadata["weather"], metadata["landscape"],
+                  metadata["transportation"], metadata["cuisine"], *metadata["activities"]]
+        for value in values:
+            if value not in directions:
+                directions[value] = attribute_direction(value, dim, seed)
+            vectors[row] += directions[value]
+
+    rng = np.random.default_rng(seed)
+    for start in range(0, len(cities), 100_000):  # bounded temporaries for 1M+ rows
+        block = vectors[start:start + 100_000]
+        block += rng.standard_normal(block.shape, dtype="float32") * noise * np.sqrt(len(values) / dim)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+    return vectors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic city database.")
+    parser.add_argument("--count", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="synthetic_city_database.json")
+    args = parser.parse_args()
+
+    cities_data = generate_cities(args.count, seed=args.seed)
+
+    # Save to JSON
+    with open(args.output, "w") as f:
+        json.dump(cities_data, f, indent=4)
+
+    print(f"✅ Synthetic city database generated and saved as '{args.output}'")
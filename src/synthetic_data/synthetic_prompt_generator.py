@@ -1,6 +1,8 @@
-import random
+import argparse
 import json
-from sklearn.model_selection import train_test_split
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
 
 # Define categories with great variability
 budgets = [
@@ -37,6 +39,7 @@ adventure_level = ["low", "moderate", "high", "extreme"]
 nightlife_preferences = ["quiet", "casual bars", "clubbing", "live music", "beach parties", "jazz clubs"]
 currency_preferences = ["local currency", "USD", "EUR", "GBP", "cryptocurrency accepted"]
 insurance_preferences = ["full travel insurance", "medical-only insurance", "cancellation protection", "adventure sports coverage"]
+travel_themes = ["adventure", "luxury", "cultural", "romantic", "spiritual retreat", "wellness"]
 travel_addons = ["airport lounge access", "travel SIM card", "guided city tours", "car rental", "VIP airport service"]
 
 # Departure Locations
@@ -44,45 +47,47 @@ departure_locations = ["New York, USA", "Los Angeles, USA", "Toronto, Canada", "
 departure_months = ["January", "February", "March", "April", "May", "June", "July", "August"]
 return_months = departure_months  # Same as departure months
 
-# Generate synthetic dataset
-synthetic_data = {"data": []}
+SHARD_FILE_PATTERN = "synthetic_travel_data-{shard:05d}-of-{num_shards:05d}.{ext}"
+PARQUET_ROW_GROUP_SIZE = 10_000
+
+
+def generate_sample(rng):
+    """
+    Generates one synthetic prompt and its expected structured output.
+
+    Args:
+        rng (random.Random): Random stream to draw the attributes from.
+
+    Returns:
+        dict: {"prompt": str, "output": dict}
+    """
+    departure_location = rng.choice(departure_locations)
+    departure_month = rng.choice(departure_months)
+    return_month = rng.choice(return_months)
 
-for _ in range(10000):  # Generate 10,000 samples
-    departure_location = random.choice(departure_locations)
-    departure_month = random.choice(departure_months)
-    return_month = random.choice(return_months)
-    
     while departure_month == return_month:
-        return_month = random.choice(return_months)
-
-    budget = random.choice(budgets)
-    food_preference = random.choice(food_prefs)
-    travel_companions = random.choice(companions)
-    travel_duration = random.choice(durations)
-    preferred_activities = random.choice(activities)
-    destination_type = random.choice(dest_types)
-    weather_preference = random.choice(weather_prefs)
-    transportation_mode = random.choice(transportation_modes)
-    season = random.choice(seasons)
-    event_interest = random.choice(events)
-    language_preference = random.choice(languages)
-    visa_requirement = random.choice(visa_reqs)
-    safety_preference = random.choice(safety_prefs)
-    accessibility_needs = random.choice(accessibility)
-    travel_theme = random.choice(["adventure", "luxury", "cultural", "romantic", "spiritual retreat", "wellness"])
-    sustainability_focus = random.choice(sustainability)
-    trip_intensity = random.choice(trip_intensity)
-    cultural_preference = random.choice(cultural_prefs)
-    shopping_style = random.choice(shopping_style)
-    internet = random.choice(internet_availability)
-    luxury = random.choice(luxury_rating)
-    pet = random.choice(pet_friendly)
-    wellness = random.choice(wellness_activities)
-    adventure = random.choice(adventure_level)
-    nightlife = random.choice(nightlife_preferences)
-    currency = random.choice(currency_preferences)
-    insurance = random.choice(insurance_preferences)
-    travel_addon = random.choice(travel_addons)
+        return_month = rng.choice(return_months)
+
+    budget = rng.choice(budgets)
+    food_preference = rng.choice(food_prefs)
+    travel_companions = rng.choice(companions)
+    travel_duration = rng.choice(durations)
+    preferred_activities = rng.choice(activities)
+    destination_type = rng.choice(dest_types)
+    weather_preference = rng.choice(weather_prefs)
+    transportation_mode = rng.choice(transportation_modes)
+    season = rng.choice(seasons)
+    event_interest = rng.choice(events)
+    language_preference = rng.choice(languages)
+    visa_requirement = rng.choice(visa_reqs)
+    safety_preference = rng.choice(safety_prefs)
+    accessibility_needs = rng.choice(accessibility)
+    travel_theme = rng.choice(travel_themes)
+    sustainability_focus = rng.choice(sustainability)
+    intensity = rng.choice(trip_intensity)
+    adventure = rng.choice(adventure_level)
+    nightlife = rng.choice(nightlife_preferences)
+    travel_addon = rng.choice(travel_addons)
 
     # Create the prompt
     prompt = f"I am departing from {departure_location} in {departure_month} and will return in {return_month}. "
@@ -92,7 +97,7 @@ for _ in range(10000):  # Generate 10,000 samples
     prompt += f"My transportation preference is {transportation_mode}. "
     prompt += f"My trip is in {season}, and I am interested in {event_interest}. "
     prompt += f"The local language should be {language_preference}, and I need a {visa_requirement} destination. "
-    prompt += f"My trip should be {trip_intensity}, and my adventure level is {adventure}. "
+    prompt += f"My trip should be {intensity}, and my adventure level is {adventure}. "
     prompt += f"For nightlife, I prefer {nightlife}. I prefer locations with {safety_preference} and {accessibility_needs} support. "
     prompt += f"I am interested in a {travel_theme} experience with {sustainability_focus} focus. "
     prompt += f"I will also be adding {travel_addon} to my trip."
@@ -118,10 +123,96 @@ for _ in range(10000):  # Generate 10,000 samples
         "accessibility_needs": accessibility_needs,
     }
 
-    synthetic_data["data"].append({"prompt": prompt, "output": expected_output})
+    return {"prompt": prompt, "output": expected_output}
+
+
+def shard_sizes(count, num_shards):
+    """ Splits `count` samples as evenly as possible across `num_shards` shards. """
+    return [count // num_shards + (1 if shard < count % num_shards else 0) for shard in range(num_shards)]
+
+
+def write_shard(shard_id, num_shards, shard_count, seed, output_dir, fmt="jsonl"):
+    """
+    Streams one shard of samples to disk without holding it in memory.
+
+    Every shard has its own RNG seeded from (seed, shard_id), so the output only depends on
+    the seed and shard layout, never on the number of worker processes.
+
+    Returns:
+        str: Path of the written shard.
+    """
+    rng = random.Random(f"{seed}-{shard_id}")
+    path = os.path.join(output_dir, SHARD_FILE_PATTERN.format(shard=shard_id, num_shards=num_shards, ext=fmt))
+    tmp_path = path + ".tmp"
+
+    if fmt == "jsonl":
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for _ in range(shard_count):
+                f.write(json.dumps(generate_sample(rng)) + "\n")
+    elif fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        remaining = shard_count
+        while remaining > 0:
+            rows = [generate_sample(rng) for _ in range(min(PARQUET_ROW_GROUP_SIZE, remaining))]
+            remaining -= len(rows)
+            table = pa.Table.from_pylist(rows)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+        if writer is None:
+            # an empty shard still gets a file, with the schema of a sample
+            schema = pa.Table.from_pylist([generate_sample(random.Random(seed))]).schema
+            writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(schema.empty_table())
+        writer.close()
+    else:
+        raise ValueError(f"Unsupported output format: {fmt}")
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def generate_dataset(count, seed=42, num_shards=8, output_dir="./synthetic_prompts/synthetic_travel_data",
+                     fmt="jsonl", workers=None):
+    """
+    Generates `count` synthetic prompts as sharded JSONL or Parquet files in parallel.
+
+    Args:
+        count (int): Total number of samples.
+        seed (int): Base seed; the same seed and shard count always give the same files.
+        num_shards (int): Number of output shards.
+        output_dir (str): Directory the shards are written to.
+        fmt (str): 'jsonl' or 'parquet'.
+        workers (int, optional): Worker processes. Defaults to min(num_shards, cpu count).
+
+    Returns:
+        list: Paths of the written shards.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or min(num_shards, os.cpu_count() or 1)
+    sizes = shard_sizes(count, num_shards)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(write_shard, shard_id, num_shards, shard_count, seed, output_dir, fmt)
+            for shard_id, shard_count in enumerate(sizes)
+        ]
+        return [future.result() for future in futures]
+
 
-# Save dataset
-with open("./synthetic_prompts/expanded_synthetic_travel_data.json", "w") as f:
-    json.dump(synthetic_data, f, indent=4)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic travel prompts for T5 fine-tuning.")
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--output-dir", default="./synthetic_prompts/synthetic_travel_data")
+    args = parser.parse_args()
 
-print("✅ Synthetic travel data generated and saved!")
+    paths = generate_dataset(args.count, seed=args.seed, num_shards=args.shards, output_dir=args.output_dir,
+                             fmt=args.format, workers=args.workers)
+    print(f"✅ {args.count} synthetic travel samples saved to {len(paths)} shards in {args.output_dir}")
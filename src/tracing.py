@@ -0,0 +1,222 @@
+"""
+Lightweight per-stage latency tracing.
+
+    with span("clip_encode"):
+        ...
+
+Every span records its duration into a process-wide HDR-style histogram (log-linear buckets,
+about 6% relative error) that `prometheus_text` exposes in the Prometheus text format. Inside
+a request trace (`start_trace` / `end_trace`) the spans are also collected per request, e.g.
+for a `Server-Timing` header. Set TRACING=0 to turn spans into a shared no-op context manager.
+"""
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+TRACING_ENABLED = os.environ.get("TRACING", "1") != "0"
+
+SUB_BUCKET_BITS = 4  # 16 linear sub-buckets per power of two
+MAX_SHIFT = 40  # microsecond values up to 2**44 (about 200 days)
+PROMETHEUS_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROMETHEUS_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+METRIC_PREFIX = "trip"
+
+_NOOP_SPAN = contextlib.nullcontext()
+_histograms = {}
+_histograms_lock = threading.Lock()
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_thread_contexts = {}  # thread id -> context it is running work in, read by the sampling profiler
+
+
+class Histogram:
+    """
+    Log-linear latency histogram over integer microseconds, in the spirit of HdrHistogram.
+
+    A value v falls in bucket (shift << SUB_BUCKET_BITS) + (v >> shift), where shift keeps the
+    top SUB_BUCKET_BITS bits of v, so every bucket is at most 1/8 of its value wide.
+    """
+
+    def __init__(self):
+        self.counts = [0] * ((MAX_SHIFT + 1) << SUB_BUCKET_BITS)
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def bucket_of(value_us):
+        shift = min(max(value_us.bit_length() - SUB_BUCKET_BITS, 0), MAX_SHIFT)
+        return (shift << SUB_BUCKET_BITS) + min(value_us >> shift, (1 << SUB_BUCKET_BITS) - 1)
+
+    @staticmethod
+    def bucket_bounds(bucket):
+        """ (lowest, highest) microsecond value of a bucket. """
+        shift, mantissa = bucket >> SUB_BUCKET_BITS, bucket & ((1 << SUB_BUCKET_BITS) - 1)
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds):
+        bucket = self.bucket_of(max(int(seconds * 1e6), 0))
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total_s += seconds
+            self.max_s = max(self.max_s, seconds)
+
+    def percentile(self, q):
+        """ Value in seconds at quantile q (0..1), the midpoint of the bucket it falls in. """
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            rank, seen = q * self.count, 0
+            for bucket, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if bucket_count and seen >= rank:
+                    low, high = self.bucket_bounds(bucket)
+                    return min((low + high) / 2e6, self.max_s)
+            return self.max_s
+
+    def cumulative_counts(self, bounds_s):
+        """ Number of values <= each bound, counting a bucket once its highest value is below the bound. """
+        with self.lock:
+            counts = list(self.counts)
+        result, seen, bucket = [], 0, 0
+        for bound_us in (bound * 1e6 for bound in bounds_s):
+            while bucket < len(counts) and self.bucket_bounds(bucket)[1] <= bound_us:
+                seen += counts[bucket]
+                bucket += 1
+            result.append(seen)
+        return result
+
+
+def histogram(name):
+    """ The process-wide histogram of a stage, created on first use. """
+    hist = _histograms.get(name)
+    if hist is None:
+        with _histograms_lock:
+            hist = _histograms.setdefault(name, Histogram())
+    return hist
+
+
+def record(name, seconds):
+    """ Records a duration measured elsewhere, e.g. from an existing timer. """
+    if not TRACING_ENABLED:
+        return
+    histogram(name).record(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+
+class Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def span(name):
+    """ Context manager timing a pipeline stage; a shared no-op when tracing is disabled. """
+    return Span(name) if TRACING_ENABLED else _NOOP_SPAN
+
+
+def traced(name):
+    """ Decorator timing every call of a function as a span. """
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = func.__name__, func.__doc__, func
+        return wrapper
+    return decorator
+
+
+def start_trace():
+    """ Starts collecting the spans of the current request; returns a token for `end_trace`. """
+    return _current_trace.set([])
+
+
+def end_trace(token):
+    """ Stops collecting and returns the request's [(stage, seconds)] in completion order. """
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    return trace or []
+
+
+@contextlib.contextmanager
+def bound_thread(context):
+    """ Marks the current thread as working in `context` until the block exits. """
+    thread_id = threading.get_ident()
+    previous = _thread_contexts.get(thread_id)
+    _thread_contexts[thread_id] = context
+    try:
+        yield
+    finally:
+        if previous is None:
+            _thread_contexts.pop(thread_id, None)
+        else:
+            _thread_contexts[thread_id] = previous
+
+
+def thread_context(thread_id):
+    """ The context a thread is bound to (see `bound_thread`), None if it is not working for anyone. """
+    return _thread_contexts.get(thread_id)
+
+
+def in_context(func):
+    """
+    Binds a callable to the current context, so spans it records in an executor thread
+    still reach the request trace (`run_in_executor` does not copy context variables).
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        with bound_thread(context):
+            return context.run(func, *args, **kwargs)
+    return run
+
+
+def server_timing_header(trace):
+    """ `Server-Timing` header value with the summed duration of each stage in milliseconds. """
+    totals = {}
+    for name, seconds in trace:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name.replace('.', '_')};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+def prometheus_text(gauges=None):
+    """
+    All stage histograms in the Prometheus text exposition format.
+
+    Args:
+        gauges (dict, optional): Extra {metric name: value} gauges, e.g. cache hit rates.
+    """
+    name = f"{METRIC_PREFIX}_stage_duration_seconds"
+    lines = [f"# HELP {name} Duration of each pipeline stage.", f"# TYPE {name} histogram"]
+    quantile_lines = []
+    for stage, hist in sorted(_histograms.items()):
+        for bound, count in zip(PROMETHEUS_BUCKETS_S, hist.cumulative_counts(PROMETHEUS_BUCKETS_S)):
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {hist.count}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {hist.total_s:.6f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {hist.count}')
+        for q in PROMETHEUS_QUANTILES:
+            quantile_lines.append(f'{METRIC_PREFIX}_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} {hist.percentile(q):.6f}')
+
+    if quantile_lines:
+        lines.append(f"# HELP {METRIC_PREFIX}_stage_latency_seconds Stage latency quantiles from the histograms.")
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_latency_seconds gauge")
+        lines.extend(quantile_lines)
+    for gauge, value in (gauges or {}).items():
+        lines.append(f"# TYPE {METRIC_PREFIX}_{gauge} gauge")
+        lines.append(f"{METRIC_PREFIX}_{gauge} {value}")
+    return "\n".join(lines) + "\n"